@@ -1,49 +1,831 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, g, has_app_context, message_flashed
 import sqlite3
-import pandas as pd
 import os
 from werkzeug.utils import secure_filename
-import math
+import threading
+import functools
+import contextlib
+import random
+import uuid
+import time
 from datetime import datetime, date, timedelta #timedelta para calcular datas passadas
+from collections import OrderedDict
 import io
+import urllib.parse
 import json # Para passar dados para o Chart.js
-
-# --- Função para formatar como moeda BRL ---
-def format_brl(value):
-    if pd.isna(value) or value == 0:
-         return "R$ 0,00"
-    try:
-         float_value = float(value)
-         if float_value == 0.0 and math.copysign(1.0, float_value) == -1.0:
-             return "R$ 0,00"
-         return f"R$ {float_value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-    except (ValueError, TypeError):
-         return "Valor Inválido"
+from migracoes import (aplicar_migracoes, somar_saldos_diarios, agregacao_resumo_mensal, somar_resumo_mensal,
+                        somar_posicoes_investimentos)
+from dinheiro import para_centavos, de_centavos, somar_centavos
+from formatacao import format_brl, format_brl_frame, format_brl_array
 
 app = Flask(__name__)
-app.secret_key = 'sua_chave_secreta_aqui_pode_ser_qualquer_coisa'
-DATABASE = 'financas.db'
+# Valores padrão; create_app() (no fim do arquivo) aplica a configuração final antes de servir
+app.config['SECRET_KEY'] = 'sua_chave_secreta_aqui_pode_ser_qualquer_coisa'
+app.config.setdefault('DATABASE', 'financas.db')
+app.config.setdefault('UPLOAD_FOLDER', 'uploads')
 
 # --- Registra a função no Jinja ---
 app.jinja_env.globals.update(format_brl=format_brl)
 
-UPLOAD_FOLDER = 'uploads'
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 ALLOWED_EXTENSIONS = {'csv', 'xlsx', 'xls'}
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def get_db_connection():
-    conn = sqlite3.connect(DATABASE, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-    conn.execute("PRAGMA foreign_keys = ON;")
-    conn.execute("PRAGMA journal_mode=WAL")
+# --- POOL DE CONEXÕES ---
+# PRAGMAs aplicados uma única vez, quando a conexão é criada
+DB_PRAGMAS = [
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",     # seguro em WAL; evita fsync a cada commit
+    "PRAGMA temp_store = MEMORY",      # GROUP BY / ORDER BY temporários em memória
+    "PRAGMA cache_size = -20000",      # ~20 MB de cache de páginas por conexão
+    "PRAGMA mmap_size = 268435456",    # leitura do arquivo via mmap (até 256 MB)
+]
+# Conexões dos relatórios: arquivo aberto com mode=ro e query_only, então nunca pedem o lock de
+# escrita; em WAL leem um snapshot sem bloquear nem esperar quem está lançando dados
+DB_PRAGMAS_LEITURA = [
+    "PRAGMA query_only = ON",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -20000",
+    "PRAGMA mmap_size = 268435456",
+]
+app.config.setdefault('DB_POOL_TAMANHO', 8)
+app.config.setdefault('DB_POOL_LEITURA_TAMANHO', 8)
+app.config.setdefault('DB_POOL_TIMEOUT', 30)
+app.config.setdefault('DB_BUSY_TIMEOUT_MS', 5000)   # espera do SQLite pelo lock de escrita, por tentativa
+app.config.setdefault('DB_ESCRITA_TENTATIVAS', 4)   # tentativas de BEGIN IMMEDIATE antes de desistir
+
+class ConexaoPool(sqlite3.Connection):
+    """
+    Conexão emprestada a uma requisição. Enquanto emprestada, close() não fecha nada:
+    as rotas continuam chamando conn.close() e a conexão volta ao pool no teardown.
+    """
+    emprestada = False
+
+    def close(self):
+        if self.emprestada: return
+        super().close()
+
+# Conexões abertas num processo que depois fez fork (gunicorn --preload). O filho não as usa nem
+# as fecha: fechar no filho pode fazer o SQLite checkpointar ou apagar o WAL que o pai ainda usa.
+_conexoes_herdadas = []
+
+def _nova_conexao(somente_leitura=False):
+    if somente_leitura:
+        uri = 'file:' + urllib.parse.quote(os.path.abspath(app.config['DATABASE'])) + '?mode=ro'
+        conn = sqlite3.connect(uri, uri=True, factory=ConexaoPool, check_same_thread=False,
+                               timeout=app.config['DB_BUSY_TIMEOUT_MS'] / 1000)
+    else:
+        conn = sqlite3.connect(app.config['DATABASE'], factory=ConexaoPool, check_same_thread=False,
+                               timeout=app.config['DB_BUSY_TIMEOUT_MS'] / 1000)
+    for pragma in (DB_PRAGMAS_LEITURA if somente_leitura else DB_PRAGMAS):
+        conn.execute(pragma)
     conn.row_factory = sqlite3.Row
     return conn
 
+class PoolConexoes:
+    """Pool limitado de conexões ociosas (LIFO: a mais recente, com cache quente, é reutilizada primeiro)."""
+
+    def __init__(self, tamanho, timeout, somente_leitura=False):
+        self.tamanho = tamanho
+        self.timeout = timeout
+        self.somente_leitura = somente_leitura
+        self._ociosas = []
+        self._vagas = threading.BoundedSemaphore(tamanho)
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.criadas = 0
+        self.reutilizadas = 0
+        self.esperas = 0
+        self.tempo_espera_total = 0.0
+        self.tempo_espera_max = 0.0
+
+    def _apos_fork(self):
+        # Cada processo (worker) abre as próprias conexões; as do processo pai são abandonadas
+        with self._lock:
+            if self._pid == os.getpid(): return
+            _conexoes_herdadas.extend(self._ociosas)
+            self._ociosas = []
+            self._vagas = threading.BoundedSemaphore(self.tamanho)
+            self._pid = os.getpid()
+
+    def obter(self):
+        if self._pid != os.getpid(): self._apos_fork()
+        inicio = time.perf_counter()
+        if not self._vagas.acquire(blocking=False):
+            if not self._vagas.acquire(timeout=self.timeout):
+                raise sqlite3.OperationalError('Pool de conexões esgotado')
+            espera = time.perf_counter() - inicio
+            with self._lock:
+                self.esperas += 1
+                self.tempo_espera_total += espera
+                self.tempo_espera_max = max(self.tempo_espera_max, espera)
+        with self._lock:
+            conn = self._ociosas.pop() if self._ociosas else None
+            if conn: self.reutilizadas += 1
+            else: self.criadas += 1
+        try:
+            if conn is None: conn = _nova_conexao(self.somente_leitura)
+        except Exception:
+            self._vagas.release()
+            raise
+        conn.emprestada = True
+        return conn
+
+    def devolver(self, conn):
+        conn.emprestada = False
+        if conn.in_transaction: conn.rollback()
+        with self._lock:
+            self._ociosas.append(conn)
+        self._vagas.release()
+
+    def fechar(self):
+        """Fecha as conexões ociosas (usado quando create_app troca o pool)."""
+        with self._lock:
+            ociosas, self._ociosas = self._ociosas, []
+        if self._pid != os.getpid():
+            _conexoes_herdadas.extend(ociosas)
+            return
+        for conn in ociosas:
+            conn.close()
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'pid': self._pid,
+                'tamanho': self.tamanho,
+                'ociosas': len(self._ociosas),
+                'criadas': self.criadas,
+                'reutilizadas': self.reutilizadas,
+                'esperas': self.esperas,
+                'tempo_espera_total_ms': round(self.tempo_espera_total * 1000, 3),
+                'tempo_espera_max_ms': round(self.tempo_espera_max * 1000, 3),
+            }
+
+pool_conexoes = PoolConexoes(app.config['DB_POOL_TAMANHO'], app.config['DB_POOL_TIMEOUT'])
+pool_leitura = PoolConexoes(app.config['DB_POOL_LEITURA_TAMANHO'], app.config['DB_POOL_TIMEOUT'], somente_leitura=True)
+
+def get_db_connection():
+    """
+    Dentro de uma requisição devolve sempre a mesma conexão (guardada em g), emprestada do pool.
+    Fora de contexto de app (migrações, scripts) abre uma conexão avulsa.
+    """
+    if not has_app_context():
+        return _nova_conexao()
+    if 'db' not in g:
+        g.db = pool_conexoes.obter()
+    return g.db
+
+def get_db_leitura():
+    """Como get_db_connection, mas somente leitura e de um pool próprio: usada pelos relatórios,
+    dashboards e exportações, que assim não disputam conexões nem locks com as telas de lançamento."""
+    if not has_app_context():
+        return _nova_conexao(somente_leitura=True)
+    if 'db_leitura' not in g:
+        g.db_leitura = pool_leitura.obter()
+    return g.db_leitura
+
+@app.teardown_appcontext
+def devolver_conexao(exc):
+    conn = g.pop('db', None)
+    if conn is not None:
+        pool_conexoes.devolver(conn)
+    conn = g.pop('db_leitura', None)
+    if conn is not None:
+        pool_leitura.devolver(conn)
+
+@app.route('/status/pool')
+def status_pool():
+    return jsonify({**pool_conexoes.estatisticas(), 'leitura': pool_leitura.estatisticas()})
+
+# --- TRANSAÇÕES DE ESCRITA ---
+# Toda escrita de várias instruções (movimentos, transferências, investimentos, importações) passa por
+# transacao_escrita. BEGIN IMMEDIATE pega o lock de escrita antes da primeira leitura, então escritores
+# simultâneos entram em fila (busy_timeout) em vez de falhar com "database is locked" ao promover uma
+# transação de leitura, e o que a transação lê antes de escrever não muda até o COMMIT.
+class MetricasEscrita:
+    """Contadores de espera pelo lock de escrita (expostos em /status/escritas)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.transacoes = 0
+        self.com_espera = 0
+        self.novas_tentativas = 0
+        self.falhas = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+
+    def registrar(self, espera, tentativas, sucesso):
+        with self._lock:
+            if sucesso: self.transacoes += 1
+            else: self.falhas += 1
+            self.novas_tentativas += tentativas - 1
+            if espera >= 0.001: self.com_espera += 1
+            self.espera_total += espera
+            self.espera_max = max(self.espera_max, espera)
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'transacoes': self.transacoes,
+                'com_espera': self.com_espera,
+                'novas_tentativas': self.novas_tentativas,
+                'falhas': self.falhas,
+                'espera_total_ms': round(self.espera_total * 1000, 3),
+                'espera_max_ms': round(self.espera_max * 1000, 3),
+            }
+
+metricas_escrita = MetricasEscrita()
+
+def _banco_ocupado(erro):
+    return 'locked' in str(erro) or 'busy' in str(erro)
+
+@contextlib.contextmanager
+def transacao_escrita(conn):
+    """
+    with transacao_escrita(conn): ... -> BEGIN IMMEDIATE, COMMIT no fim do bloco e ROLLBACK se algo falhar.
+    Cada tentativa de BEGIN espera até DB_BUSY_TIMEOUT_MS pelo lock; se o banco continuar ocupado,
+    tenta de novo após uma pausa aleatória crescente (até DB_ESCRITA_TENTATIVAS vezes).
+    """
+    tentativas = app.config['DB_ESCRITA_TENTATIVAS']
+    inicio = time.perf_counter()
+    for tentativa in range(1, tentativas + 1):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            break
+        except sqlite3.OperationalError as e:
+            if not _banco_ocupado(e) or tentativa == tentativas:
+                metricas_escrita.registrar(time.perf_counter() - inicio, tentativa, sucesso=False)
+                raise
+            # Pausa com jitter para os escritores que desistiram juntos não voltarem juntos
+            time.sleep(random.uniform(0, 0.05 * 2 ** tentativa))
+    metricas_escrita.registrar(time.perf_counter() - inicio, tentativa, sucesso=True)
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+@app.route('/status/escritas')
+def status_escritas():
+    return jsonify(metricas_escrita.estatisticas())
+
+# --- CACHE DE RELATÓRIOS ---
+# Respostas dos relatórios pesados ficam em memória, indexadas por rota + parâmetros + dia.
+# A validade vem do PRAGMA data_version lido numa conexão que nunca escreve: o valor muda a cada
+# commit feito por qualquer outra conexão (pool, importações, scripts), então qualquer escrita
+# invalida o cache inteiro e uma visita repetida sem escritas não lê nenhuma tabela.
+app.config.setdefault('CACHE_RELATORIOS_MAX_BYTES', 32 * 1024 * 1024)
+
+class CacheRelatorios:
+    """Cache LRU de respostas, limitado pelo total de bytes guardados."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._itens = OrderedDict()
+        self._bytes = 0
+        self._versao = None
+        self._conn_versao = None
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.descartes = 0
+        self.invalidacoes = 0
+
+    def versao_dados(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Worker recém-criado por fork: abre a própria conexão de monitoramento
+                if self._conn_versao is not None: _conexoes_herdadas.append(self._conn_versao)
+                self._conn_versao = None
+                self._pid = os.getpid()
+                self._validar(None)  # data_version só é comparável dentro da mesma conexão
+            if self._conn_versao is None:
+                self._conn_versao = sqlite3.connect(app.config['DATABASE'], check_same_thread=False)
+            return self._conn_versao.execute('PRAGMA data_version').fetchone()[0]
+
+    def _validar(self, versao):
+        # Chamado com o lock: versão nova do banco descarta tudo o que foi calculado antes
+        if versao != self._versao:
+            if self._itens: self.invalidacoes += 1
+            self._itens.clear()
+            self._bytes = 0
+            self._versao = versao
+
+    def obter(self, chave):
+        """Devolve (versão, item); item é None quando não está no cache."""
+        versao = self.versao_dados()
+        with self._lock:
+            self._validar(versao)
+            guardado = self._itens.get(chave)
+            if guardado is None:
+                self.falhas += 1
+                return versao, None
+            self._itens.move_to_end(chave)
+            self.acertos += 1
+            return versao, guardado[0]
+
+    def guardar(self, chave, versao, item, tamanho):
+        if tamanho > self.max_bytes: return
+        with self._lock:
+            if versao != self._versao: return  # houve escrita enquanto o relatório era calculado
+            anterior = self._itens.pop(chave, None)
+            if anterior is not None: self._bytes -= anterior[1]
+            self._itens[chave] = (item, tamanho)
+            self._bytes += tamanho
+            while self._bytes > self.max_bytes:
+                _, (_, tamanho_descartado) = self._itens.popitem(last=False)
+                self._bytes -= tamanho_descartado
+                self.descartes += 1
+
+    def estatisticas(self):
+        with self._lock:
+            consultas = self.acertos + self.falhas
+            return {
+                'itens': len(self._itens),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'versao_dados': self._versao,
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'taxa_acerto': round(self.acertos / consultas, 4) if consultas else None,
+                'descartes': self.descartes,
+                'invalidacoes': self.invalidacoes,
+            }
+
+cache_relatorios = CacheRelatorios(app.config['CACHE_RELATORIOS_MAX_BYTES'])
+
+def relatorio_em_cache(view):
+    """
+    Decorador das rotas de relatório: devolve a resposta guardada enquanto o banco não mudar.
+    Páginas com mensagens flash (pendentes ou geradas pela própria rota) não entram no cache,
+    porque a mensagem é renderizada junto com o HTML.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if session.get('_flashes'):
+            return view(*args, **kwargs)
+        # O dia entra na chave: os relatórios usam a data de hoje para montar as janelas
+        chave = (request.endpoint, tuple(sorted(request.args.items(multi=True))), date.today().isoformat())
+        versao, item = cache_relatorios.obter(chave)
+        if item is not None:
+            corpo, mimetype = item
+            return app.response_class(corpo, mimetype=mimetype)
+        mensagens = []
+        def registrar_flash(sender, message, category, **extra):
+            mensagens.append(message)
+        with message_flashed.connected_to(registrar_flash, app):
+            resposta = app.make_response(view(*args, **kwargs))
+        if resposta.status_code == 200 and not mensagens and not resposta.direct_passthrough:
+            corpo = resposta.get_data()
+            cache_relatorios.guardar(chave, versao, (corpo, resposta.mimetype), len(corpo))
+        return resposta
+    return wrapper
+
+@app.route('/status/cache')
+def status_cache():
+    return jsonify(cache_relatorios.estatisticas())
+
+# --- MIGRAÇÕES ---
+def init_db():
+    # Conexão avulsa, fechada em seguida: nada do pool fica aberto antes do fork dos workers
+    conn = _nova_conexao()
+    aplicar_migracoes(conn)
+    conn.close()
+
+# --- LEDGER DE SALDOS DIÁRIOS ---
+# Tabela saldos_diarios (criada em migracoes.py): uma linha por (conta, dia com movimentação).
+# Cada escrita em movimentos/transferências estorna a versão antiga e aplica a nova.
+# Variação e saldo ficam em centavos, então estornar e reaplicar nunca acumula erro.
+def _saldo_diario_aplicar(conn, instituicao_id, data, centavos):
+    """Soma 'centavos' ao dia 'data' da conta e desloca todos os saldos posteriores."""
+    if not instituicao_id or not data or not centavos: return
+    conn.execute('''
+        INSERT INTO saldos_diarios (instituicao_id, data, variacao_centavos, saldo_centavos)
+        VALUES (?, date(?), 0, COALESCE((SELECT saldo_centavos FROM saldos_diarios
+                                         WHERE instituicao_id = ? AND data < date(?)
+                                         ORDER BY data DESC LIMIT 1), 0))
+        ON CONFLICT (instituicao_id, data) DO NOTHING
+    ''', (instituicao_id, data, instituicao_id, data))
+    conn.execute('UPDATE saldos_diarios SET variacao_centavos = variacao_centavos + ? WHERE instituicao_id = ? AND data = date(?)',
+                 (centavos, instituicao_id, data))
+    conn.execute('UPDATE saldos_diarios SET saldo_centavos = saldo_centavos + ? WHERE instituicao_id = ? AND data >= date(?)',
+                 (centavos, instituicao_id, data))
+
+def ledger_movimento(conn, mov, sinal=1):
+    """Aplica (sinal=1) ou estorna (sinal=-1) um movimento no ledger. Só contam efetivados fora do cartão."""
+    if mov is None: return
+    if mov['status'] == 'Efetivado' and mov['cartao_id'] is None and mov['data_efetivacao']:
+        _saldo_diario_aplicar(conn, mov['instituicao_id'], mov['data_efetivacao'], sinal * mov['valor_centavos'])
+
+def ledger_transferencia(conn, transf, sinal=1):
+    """Aplica (sinal=1) ou estorna (sinal=-1) uma transferência nas contas de origem e destino."""
+    if transf is None: return
+    if transf['status'] == 'Efetivado' and transf['data_efetivacao']:
+        _saldo_diario_aplicar(conn, transf['conta_origem_id'], transf['data_efetivacao'], -sinal * transf['valor_centavos'])
+        _saldo_diario_aplicar(conn, transf['conta_destino_id'], transf['data_efetivacao'], sinal * transf['valor_centavos'])
+
+def saldo_em_centavos(conn, instituicao_id, data, inclusive=True):
+    """Saldo da conta, em centavos, ao fim de 'data' (inclusive) ou imediatamente antes dela (inclusive=False)."""
+    operador = '<=' if inclusive else '<'
+    row = conn.execute(f'''
+        SELECT saldo_centavos FROM saldos_diarios
+        WHERE instituicao_id = ? AND data {operador} date(?)
+        ORDER BY data DESC LIMIT 1
+    ''', (instituicao_id, data)).fetchone()
+    return row['saldo_centavos'] if row else 0
+
+def saldo_em(conn, instituicao_id, data, inclusive=True):
+    """Saldo da conta ao fim de 'data' (inclusive) ou imediatamente antes dela (inclusive=False)."""
+    return de_centavos(saldo_em_centavos(conn, instituicao_id, data, inclusive))
+
+# Dia 0 das chaves numéricas de saldos_em_datas (dias desde 1970-01-01, como julianday - 2440587.5)
+EPOCA = date(1970, 1, 1)
+
+def busca_asof(grupos, dias, grupos_consulta, dias_consulta):
+    """
+    Join "as-of" vetorizado. grupos e dias (int64, não vazios) descrevem linhas ordenadas por
+    (grupo, dia); para cada par consultado (arrays que se combinam por broadcasting) devolve
+    (posição, encontrada): a última linha do mesmo grupo com dia <= dia consultado, e se ela existe.
+    """
+    import numpy as np
+    # Chave única e crescente na ordem das linhas: grupo nos 32 bits altos, dia (deslocado para
+    # ficar positivo) nos baixos
+    chaves = (grupos << 32) + (dias + 2 ** 31)
+    consultas = (grupos_consulta << 32) + (dias_consulta + 2 ** 31)
+    posicao = np.searchsorted(chaves, consultas, side='right') - 1
+    # A linha anterior à chave consultada pode ser de outro grupo: então o grupo não tinha linha até o dia
+    encontrada = (posicao >= 0) & (grupos[np.maximum(posicao, 0)] == grupos_consulta)
+    return posicao, encontrada
+
+def saldos_em_datas(conn, datas):
+    """
+    Saldo de todas as contas ao fim de cada data de 'datas' (lista de date), numa só leitura
+    ordenada do ledger. Devolve (contas, saldos): as linhas (id, descricao) de instituicoes por
+    nome e uma matriz int64 de centavos com uma linha por conta e uma coluna por data.
+    Cada par (conta, data) sai de uma busca binária (busca_asof) na chave conta+dia do ledger,
+    então o custo é O(linhas do ledger + contas x datas), e não uma consulta por data.
+    """
+    import numpy as np
+    contas = conn.execute('SELECT id, descricao FROM instituicoes ORDER BY descricao').fetchall()
+    saldos = np.zeros((len(contas), len(datas)), dtype=np.int64)
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    ledger = cursor.execute('''
+        SELECT instituicao_id, CAST(julianday(data) - 2440587.5 AS INTEGER), saldo_centavos
+        FROM saldos_diarios
+        ORDER BY instituicao_id, data
+    ''').fetchall()
+    if not ledger or not contas or not datas:
+        return contas, saldos
+
+    conta, dia, saldo = np.array(ledger, dtype=np.int64).T
+    ids = np.array([c['id'] for c in contas], dtype=np.int64)
+    alvos = np.array([(d - EPOCA).days for d in datas], dtype=np.int64)
+    # Sem linha da conta até a data: ainda não havia movimento efetivado e o saldo é 0
+    posicao, encontrada = busca_asof(conta, dia, ids[:, None], alvos[None, :])
+    saldos[encontrada] = saldo[posicao[encontrada]]
+    return contas, saldos
+
+# --- SÉRIE DO PATRIMÔNIO ---
+# Patrimônio ao fim de cada dia = saldo somado das contas (variações do ledger) + posição em
+# investimentos ao custo (compras menos vendas). As duas partes ficam em memória como arrays
+# acumulados em centavos, um elemento por dia; quando o banco muda, só o trecho a partir do
+# primeiro dia com variação diferente é reacumulado, e dias depois do último dado repetem o
+# último valor.
+class SeriePatrimonio:
+    """Acumulados diários de bancos (linha 0) e investimentos (linha 1), em centavos."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chave = None       # (pid, data_version) de quando os arrays foram montados
+        self._inicio = None      # dia (desde EPOCA) do primeiro elemento
+        self._variacoes = None
+        self._acumulado = None
+
+    def _variacoes_diarias(self, conn):
+        import numpy as np
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        bancos = cursor.execute('''
+            SELECT CAST(julianday(data) - 2440587.5 AS INTEGER), SUM(variacao_centavos)
+            FROM saldos_diarios
+            GROUP BY data
+        ''').fetchall()
+        investimentos = cursor.execute('''
+            SELECT CAST(julianday(date(i.data_investimento)) - 2440587.5 AS INTEGER),
+                   SUM(CASE WHEN o.natureza = 'Entrada' THEN ABS(i.valor_total_centavos)
+                            ELSE -ABS(i.valor_total_centavos) END)
+            FROM investimentos i
+            JOIN operacoes o ON i.operacao_id = o.id
+            WHERE date(i.data_investimento) IS NOT NULL
+            GROUP BY 1
+        ''').fetchall()
+        partes = [np.array(linhas, dtype=np.int64).reshape(-1, 2) for linhas in (bancos, investimentos)]
+        dias = np.concatenate([parte[:, 0] for parte in partes])
+        if not len(dias):
+            return None, np.zeros((2, 0), dtype=np.int64)
+        inicio = int(dias.min())
+        variacoes = np.zeros((2, int(dias.max()) - inicio + 1), dtype=np.int64)
+        for linha, parte in enumerate(partes):
+            variacoes[linha, parte[:, 0] - inicio] = parte[:, 1]
+        return inicio, variacoes
+
+    def acumulados(self, conn):
+        """(dia inicial, matriz 2 x dias de acumulados), refeita só se o banco mudou."""
+        import numpy as np
+        chave = (os.getpid(), cache_relatorios.versao_dados())
+        with self._lock:
+            if chave == self._chave:
+                return self._inicio, self._acumulado
+        inicio, variacoes = self._variacoes_diarias(conn)
+        with self._lock:
+            primeiro = 0
+            if self._acumulado is not None and inicio == self._inicio:
+                # Dados novos costumam entrar no fim: o prefixo que não mudou é aproveitado
+                n = min(variacoes.shape[1], self._variacoes.shape[1])
+                mudou = np.flatnonzero((variacoes[:, :n] != self._variacoes[:, :n]).any(axis=0))
+                primeiro = int(mudou[0]) if len(mudou) else n
+            acumulado = np.empty_like(variacoes)
+            acumulado[:, :primeiro] = self._acumulado[:, :primeiro] if primeiro else 0
+            base = acumulado[:, primeiro - 1:primeiro] if primeiro else 0
+            acumulado[:, primeiro:] = base + np.cumsum(variacoes[:, primeiro:], axis=1)
+            self._chave, self._inicio, self._variacoes, self._acumulado = chave, inicio, variacoes, acumulado
+            return inicio, acumulado
+
+    def valores(self, conn, dias):
+        """Bancos e investimentos (matriz 2 x len(dias), centavos) ao fim de cada dia de 'dias' (datetime64[D])."""
+        import numpy as np
+        inicio, acumulado = self.acumulados(conn)
+        resultado = np.zeros((2, len(dias)), dtype=np.int64)
+        if inicio is None:
+            return resultado
+        posicao = dias.astype(np.int64) - inicio
+        dentro = posicao >= 0
+        resultado[:, dentro] = acumulado[:, np.minimum(posicao[dentro], acumulado.shape[1] - 1)]
+        return resultado
+
+    def primeiro_dia(self, conn):
+        """Primeiro dia com dados (date), ou None se não há lançamentos nem investimentos."""
+        inicio, _ = self.acumulados(conn)
+        return None if inicio is None else EPOCA + timedelta(days=inicio)
+
+serie_patrimonio = SeriePatrimonio()
+
+def dias_da_serie(inicio, fim, periodo='mensal'):
+    """
+    Dias (datetime64[D]) da série entre inicio e fim (date): todos os dias (periodo='diario') ou o
+    último dia de cada mês, com fim no lugar do último quando o mês ainda não acabou (mensal).
+    """
+    import numpy as np
+    primeiro, ultimo = np.datetime64(inicio, 'D'), np.datetime64(fim, 'D')
+    if periodo == 'diario':
+        return np.arange(primeiro, ultimo + 1)
+    meses = np.arange(np.datetime64(inicio, 'M'), np.datetime64(fim, 'M') + 1)
+    return np.minimum((meses + 1).astype('datetime64[D]') - 1, ultimo)
+
+# --- COTAÇÕES E ÍNDICES ---
+# Tabela precos (criada em migracoes.py): um valor por série e dia. Séries de ticker guardam o preço
+# unitário com o mesmo código do cadastro de tickers; séries de benchmark (CDI, IPCA, IBOV) guardam
+# o número-índice acumulado, de modo que a variação num período é a razão entre dois valores.
+def precos_em(conn, series, datas):
+    """
+    Último valor de cada série de 'series' (lista de códigos) até cada data de 'datas' (lista de
+    date): matriz float séries x datas, com NaN onde a série ainda não tinha valor. Uma leitura
+    ordenada de precos e um join as-of vetorizado (busca_asof), como em saldos_em_datas.
+    """
+    import numpy as np
+    resultado = np.full((len(series), len(datas)), np.nan)
+    if not len(series) or not len(datas):
+        return resultado
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    linhas = cursor.execute('''
+        SELECT s.key, CAST(julianday(p.data) - 2440587.5 AS INTEGER), p.valor
+        FROM json_each(?) s
+        JOIN precos p ON p.serie = s.value
+        ORDER BY s.key, p.data
+    ''', (json.dumps(list(series)),)).fetchall()
+    if not linhas:
+        return resultado
+    tabela = np.array(linhas, dtype=np.float64)
+    grupo, dia = tabela[:, 0].astype(np.int64), tabela[:, 1].astype(np.int64)
+    alvos = np.array([(d - EPOCA).days for d in datas], dtype=np.int64)
+    posicao, encontrada = busca_asof(grupo, dia, np.arange(len(series), dtype=np.int64)[:, None], alvos[None, :])
+    resultado[encontrada] = tabela[posicao[encontrada], 2]
+    return resultado
+
+def marcar_a_mercado(conn, tickers, quantidades, investido, data):
+    """
+    Avalia todas as posições de uma vez pela última cotação até 'data'. Recebe listas alinhadas
+    (ticker, quantidade, valor investido em reais) e devolve arrays (valor atual, rentabilidade em %,
+    preço médio, tem cotação). Ativo sem cotação carregada fica pelo valor investido.
+    """
+    import numpy as np
+    quantidades = np.asarray(quantidades, dtype=np.float64)
+    investido = np.asarray(investido, dtype=np.float64)
+    preco = precos_em(conn, tickers, [data])[:, 0]
+    tem_cotacao = ~np.isnan(preco)
+    valor_atual = np.where(tem_cotacao, quantidades * np.nan_to_num(preco), investido)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rentabilidade = np.where(investido > 0, (valor_atual / investido - 1) * 100, 0.0)
+        preco_medio = np.where(quantidades > 0, investido / quantidades, 0.0)
+    return valor_atual, rentabilidade, preco_medio, tem_cotacao
+
+# Benchmarks do dashboard de investimentos: chave no template -> série em precos. Sem série
+# carregada para os últimos 12 meses vale o número fixo de BENCHMARKS_PADRAO.
+BENCHMARKS = {'cdi_12m': 'CDI', 'ipca_12m': 'IPCA', 'ibov_12m': 'IBOV'}
+BENCHMARKS_PADRAO = {'cdi_12m': 13.65, 'ipca_12m': 4.51, 'ibov_12m': 12.8}
+
+def variacao_benchmarks(conn, inicio, fim):
+    """Variação (%, 2 casas) de cada benchmark entre inicio e fim, pelos números-índice de precos."""
+    niveis = precos_em(conn, list(BENCHMARKS.values()), [inicio, fim])
+    variacoes = (niveis[:, 1] / niveis[:, 0] - 1) * 100
+    return {chave: round(float(v), 2) if v == v else BENCHMARKS_PADRAO[chave]
+            for chave, v in zip(BENCHMARKS, variacoes)}
+
+# Nomes de coluna aceitos no arquivo de cotações (formato longo); sem coluna de série o arquivo é
+# lido no formato largo: a coluna data e uma coluna por série
+COLUNAS_SERIE_PRECOS = ['serie', 'série', 'ticker', 'codigo', 'código', 'indice', 'índice']
+COLUNAS_VALOR_PRECOS = ['valor', 'preco', 'preço', 'fechamento', 'cotacao', 'cotação']
+
+def ler_arquivo_precos(arquivo, nome):
+    """
+    Lê o CSV/XLSX de cotações (objeto de arquivo) e devolve (DataFrame serie/data/valor só com as
+    linhas válidas, número de linhas descartadas). Tudo é convertido por coluna, sem laço por linha.
+    """
+    import pandas as pd
+    if nome.endswith('.csv'):
+        df = pd.read_csv(arquivo, sep=';', decimal=',')
+        if len(df.columns) == 1:
+            arquivo.seek(0)
+            df = pd.read_csv(arquivo, sep=',', decimal='.')
+    else: df = pd.read_excel(arquivo)
+
+    nomes = df.columns.astype(str).str.strip()
+    df.columns = nomes.str.lower()
+    if 'data' not in df.columns: raise ValueError("o arquivo precisa de uma coluna 'data'")
+    coluna_serie = next((c for c in COLUNAS_SERIE_PRECOS if c in df.columns), None)
+    if coluna_serie:
+        coluna_valor = next((c for c in COLUNAS_VALOR_PRECOS if c in df.columns), None)
+        if not coluna_valor: raise ValueError(f"coluna de valor em falta: {COLUNAS_VALOR_PRECOS}")
+        df = df[['data', coluna_serie, coluna_valor]].set_axis(['data', 'serie', 'valor'], axis=1)
+    else:
+        # Formato largo: os códigos das séries são os nomes das colunas, como vieram no cabeçalho
+        df.columns = ['data' if nome.lower() == 'data' else nome for nome in nomes]
+        df = df.melt(id_vars='data', var_name='serie', value_name='valor')
+
+    datas, datas_invalidas = _datas_importacao(df)
+    serie = _coluna_texto(df, 'serie')
+    valor = df['valor']
+    if not pd.api.types.is_numeric_dtype(valor):
+        valor = pd.to_numeric(valor.astype(str).str.strip().str.replace(',', '.', regex=False), errors='coerce')
+    validas = ~datas_invalidas & valor.notna() & (serie != '') & (serie != 'nan')
+    resultado = pd.DataFrame({'serie': serie[validas], 'data': datas[validas], 'valor': valor[validas].astype(float)})
+    return resultado, int((~validas).sum())
+
+# --- EXTRATO DA CONTA ---
+# Movimentos fora do cartão, transferências recebidas e enviadas num só UNION ALL. O SQLite devolve
+# as linhas já ordenadas, com a data formatada e o saldo após cada lançamento (soma acumulada em
+# centavos sobre o saldo de abertura). A tela e as exportações do extrato usam a mesma consulta.
+# {periodo_m}/{periodo_t} recebem os filtros de data só quando informados, para o SQLite percorrer
+# apenas o trecho do período nos índices por conta e dia de efetivação.
+SQL_EXTRATO = '''
+    WITH lancamentos AS (
+        SELECT m.dia_efetivacao AS data, 0 AS ordem, m.id,
+               m.descricao, 'Movimento' AS tipo, c.descricao AS categoria, c.tipo AS categoria_tipo,
+               m.valor_centavos, m.compartilhado, NULL AS origem_destino
+        FROM movimentos m
+        JOIN categorias c ON m.categoria_id = c.id
+        WHERE m.instituicao_id = :conta
+        AND m.status = 'Efetivado'
+        AND m.cartao_id IS NULL
+        AND m.data_efetivacao IS NOT NULL
+        {periodo_m}
+        UNION ALL
+        SELECT t.dia_efetivacao, 1, t.id,
+               t.descricao, 'Transferência Recebida', NULL, NULL,
+               t.valor_centavos, t.compartilhado, 'De: ' || io.descricao
+        FROM transferencias t
+        JOIN instituicoes io ON t.conta_origem_id = io.id
+        WHERE t.conta_destino_id = :conta
+        AND t.status = 'Efetivado'
+        AND t.data_efetivacao IS NOT NULL
+        {periodo_t}
+        UNION ALL
+        SELECT t.dia_efetivacao, 2, t.id,
+               t.descricao, 'Transferência Enviada', NULL, NULL,
+               -t.valor_centavos, t.compartilhado,
+               'Para: ' || CASE
+                   WHEN t.conta_destino_id IS NOT NULL THEN id.descricao
+                   WHEN t.cartao_id IS NOT NULL THEN cc.descricao
+                   ELSE 'Desconhecido'
+               END
+        FROM transferencias t
+        LEFT JOIN instituicoes id ON t.conta_destino_id = id.id
+        LEFT JOIN cartoes_credito cc ON t.cartao_id = cc.id
+        WHERE t.conta_origem_id = :conta
+        AND t.status = 'Efetivado'
+        AND t.data_efetivacao IS NOT NULL
+        {periodo_t}
+    )
+    SELECT data,
+           strftime('%d/%m/%Y', data) AS data_formatada,
+           descricao, tipo, categoria, categoria_tipo,
+           valor_centavos / 100.0 AS valor,
+           compartilhado, origem_destino,
+           (:saldo_inicial + SUM(valor_centavos) OVER acumulado) / 100.0 AS saldo_apos,
+           SUM(MAX(valor_centavos, 0)) OVER acumulado AS entradas_centavos,
+           SUM(MIN(valor_centavos, 0)) OVER acumulado AS saidas_centavos
+    FROM lancamentos
+    WINDOW acumulado AS (ORDER BY data, ordem, id ROWS UNBOUNDED PRECEDING)
+    ORDER BY data, ordem, id
+'''
+
+def extrato_conta(conn, instituicao_id, data_inicio=None, data_fim=None):
+    """
+    Extrato da conta no período: dicionário com 'movimentacoes' (linhas sqlite3.Row com data,
+    data_formatada, descricao, tipo, categoria, categoria_tipo, valor, compartilhado,
+    origem_destino e saldo_apos), 'saldo_inicial', 'saldo_final', 'total_entradas' e 'total_saidas'.
+    """
+    # Saldo de abertura: tudo o que foi efetivado antes de data_inicio (0 se não houver data)
+    inicial_centavos = saldo_em_centavos(conn, instituicao_id, data_inicio, inclusive=False) if data_inicio else 0
+    saldo_inicial = de_centavos(inicial_centavos)
+    periodo = ''
+    if data_inicio: periodo += ' AND {0}.dia_efetivacao >= date(:inicio)'
+    if data_fim: periodo += ' AND {0}.dia_efetivacao <= date(:fim)'
+    sql = SQL_EXTRATO.format(periodo_m=periodo.format('m'), periodo_t=periodo.format('t'))
+    movimentacoes = conn.execute(sql, {
+        'conta': instituicao_id, 'inicio': data_inicio, 'fim': data_fim, 'saldo_inicial': inicial_centavos,
+    }).fetchall()
+    if not movimentacoes:
+        return dict(movimentacoes=[], saldo_inicial=saldo_inicial, saldo_final=saldo_inicial,
+                    total_entradas=0.0, total_saidas=0.0)
+    ultima = movimentacoes[-1]
+    return dict(movimentacoes=movimentacoes, saldo_inicial=saldo_inicial, saldo_final=ultima['saldo_apos'],
+                total_entradas=de_centavos(ultima['entradas_centavos']),
+                total_saidas=de_centavos(-ultima['saidas_centavos']))
+
+# --- CUBO MENSAL DE MOVIMENTOS ---
+# Tabela resumo_mensal (criada em migracoes.py): soma e contagem por mês, categoria, conta, cartão,
+# compartilhado e status, mantida a cada escrita em movimentos. Os relatórios agregam o cubo,
+# então o custo depende de meses x categorias e não do número de lançamentos.
+def _data_limite(valor):
+    try:
+        return datetime.strptime(valor[:10], '%Y-%m-%d').date() if valor else None
+    except ValueError:
+        return None
+
+def resumo_mensal_periodo(data_inicio=None, data_fim=None, por='movimento'):
+    """
+    Subconsulta (sql, params) com as colunas do cubo restritas ao período [data_inicio, data_fim].
+    por='movimento' filtra pela data do movimento (coluna mes); por='efetivacao' pelo dia da
+    efetivação (coluna mes_efetivacao, só efetivados). Meses inteiros dentro do período saem do
+    cubo; os meses das pontas, cortados no meio, são agregados de movimentos filtrando por dia.
+    """
+    coluna_mes, coluna_dia = ('mes', 'data_movimento') if por == 'movimento' else ('mes_efetivacao', 'dia_efetivacao')
+    filtros_cubo = [] if por == 'movimento' else ["mes_efetivacao <> ''"]
+    params_cubo = []
+    pontas = []  # (filtro, params) dos trechos de mês agregados direto de movimentos
+
+    # Limite vazio ou que não é uma data (vem direto da query string) é ignorado
+    inicio, fim = _data_limite(data_inicio), _data_limite(data_fim)
+    if inicio is None: data_inicio = None
+    if fim is None: data_fim = None
+    # Primeiro e último mês inteiros do período
+    primeiro_mes = inicio.replace(day=1) if inicio else None
+    if inicio and inicio.day != 1:
+        primeiro_mes = (primeiro_mes + timedelta(days=32)).replace(day=1)
+    ultimo_mes = fim.replace(day=1) if fim else None
+    if fim and (fim + timedelta(days=1)).day != 1:
+        ultimo_mes = (ultimo_mes - timedelta(days=1)).replace(day=1)
+
+    if primeiro_mes and ultimo_mes and primeiro_mes > ultimo_mes:
+        # Nenhum mês inteiro: o período todo sai de movimentos
+        filtros_cubo.append('0')
+        pontas.append((f'{coluna_dia} >= ? AND {coluna_dia} <= ?', [data_inicio, data_fim]))
+    else:
+        if primeiro_mes:
+            filtros_cubo.append(f'{coluna_mes} >= ?'); params_cubo.append(primeiro_mes.strftime('%Y-%m'))
+            if primeiro_mes != inicio:
+                pontas.append((f'{coluna_dia} >= ? AND {coluna_dia} < ?', [data_inicio, primeiro_mes.strftime('%Y-%m-%d')]))
+        if ultimo_mes:
+            filtros_cubo.append(f'{coluna_mes} <= ?'); params_cubo.append(ultimo_mes.strftime('%Y-%m'))
+            depois_ultimo_mes = (ultimo_mes + timedelta(days=32)).replace(day=1)
+            if depois_ultimo_mes != fim + timedelta(days=1):
+                pontas.append((f'{coluna_dia} >= ? AND {coluna_dia} <= ?', [depois_ultimo_mes.strftime('%Y-%m-%d'), data_fim]))
+
+    sql = f"SELECT * FROM resumo_mensal WHERE {' AND '.join(filtros_cubo) or '1 = 1'}"
+    params = params_cubo
+    for filtro, params_ponta in pontas:
+        sql += f' UNION ALL {agregacao_resumo_mensal(filtro)}'
+        params = params + params_ponta
+    return sql, params
+
 @app.route('/')
 def index(): return redirect(url_for('dashboard')) # Rota principal vai para o dashboard
 
@@ -318,8 +1100,11 @@ def edit_operacao(id):
         if not descricao or not natureza: flash('Descrição e Natureza são obrigatórios.', 'error')
         else:
             try:
-                conn.execute('UPDATE operacoes SET descricao = ?, natureza = ? WHERE id = ?', (descricao, natureza, id))
-                conn.commit()
+                # A natureza decide se a operação soma ou subtrai nas posições: estorna e reaplica
+                with transacao_escrita(conn):
+                    somar_posicoes_investimentos(conn, 'i.operacao_id = ?', (id,), sinal=-1)
+                    conn.execute('UPDATE operacoes SET descricao = ?, natureza = ? WHERE id = ?', (descricao, natureza, id))
+                    somar_posicoes_investimentos(conn, 'i.operacao_id = ?', (id,))
                 return redirect(url_for('operacoes'))
             except sqlite3.IntegrityError: flash('Já existe uma operação com essa descrição.', 'error')
     operacao = conn.execute('SELECT * FROM operacoes WHERE id = ?', (id,)).fetchone()
@@ -342,38 +1127,97 @@ def delete_operacao(id):
 
 # --- ROTAS MOVIMENTOS ---
 # ... (código existente sem alterações) ...
-@app.route('/movimentos')
-def movimentos():
-    conn = get_db_connection()
-    data_inicio = request.args.get('data_inicio')
-    data_fim = request.args.get('data_fim')
-    base_query = '''
+MOVIMENTOS_POR_PAGINA = 100
+
+def _filtros_movimentos(args):
+    """Monta as cláusulas WHERE da listagem/exportação de movimentos a partir da query string."""
+    where_clauses, params = [], []
+    if args.get('data_inicio'): where_clauses.append("m.data_movimento >= ?"); params.append(args['data_inicio'])
+    if args.get('data_fim'): where_clauses.append("m.data_movimento <= ?"); params.append(args['data_fim'])
+    if args.get('categoria_id'): where_clauses.append("m.categoria_id = ?"); params.append(args['categoria_id'])
+    if args.get('instituicao_id'): where_clauses.append("m.instituicao_id = ?"); params.append(args['instituicao_id'])
+    if args.get('cartao_id'):
+        if args['cartao_id'] == 'nenhum': where_clauses.append("m.cartao_id IS NULL")
+        else: where_clauses.append("m.cartao_id = ?"); params.append(args['cartao_id'])
+    if args.get('status'): where_clauses.append("m.status = ?"); params.append(args['status'])
+    if args.get('compartilhado'): where_clauses.append("m.compartilhado = ?"); params.append(args['compartilhado'])
+    if args.get('q'): where_clauses.append("m.descricao LIKE ?"); params.append(f"%{args['q'].strip()}%")
+    return where_clauses, params
+
+def buscar_pagina_movimentos(conn, args, limite=MOVIMENTOS_POR_PAGINA):
+    """
+    Página de movimentos ordenada por (data_movimento, id) decrescente, paginada por keyset:
+    a próxima página começa logo após o cursor (cursor_data, cursor_id) da última linha recebida.
+    Retorna (linhas, cursor_seguinte) — cursor_seguinte é None na última página.
+    """
+    where_clauses, params = _filtros_movimentos(args)
+    cursor_data = args.get('cursor_data')
+    cursor_id = args.get('cursor_id', type=int)
+    if cursor_data and cursor_id:
+        # Comparação de row values: o SQLite usa idx_movimentos_data para saltar direto ao cursor
+        where_clauses.append("(m.data_movimento, m.id) < (?, ?)")
+        params.extend([cursor_data, cursor_id])
+    sql = '''
         SELECT
-            m.id, strftime('%d/%m/%Y', m.data_movimento) as data_mov_formatada,
+            m.id, m.data_movimento, strftime('%d/%m/%Y', m.data_movimento) as data_mov_formatada,
             strftime('%d/%m/%Y', m.data_efetivacao) as data_efet_formatada,
             m.descricao, m.valor, m.status, m.compartilhado,
-            c.descricao as categoria_nome, cat.tipo as categoria_tipo,
+            c.descricao as categoria_nome, c.tipo as categoria_tipo,
             i.descricao as instituicao_nome, cc.descricao as cartao_nome
         FROM movimentos m
         JOIN categorias c ON m.categoria_id = c.id
-        JOIN categorias cat ON m.categoria_id = cat.id
         JOIN instituicoes i ON m.instituicao_id = i.id
         LEFT JOIN cartoes_credito cc ON m.cartao_id = cc.id'''
-    params = []
-    where_clauses = []
-    if data_inicio: where_clauses.append("m.data_movimento >= ?"); params.append(data_inicio)
-    if data_fim: where_clauses.append("m.data_movimento <= ?"); params.append(data_fim)
-    if where_clauses: base_query += " WHERE " + " AND ".join(where_clauses)
-    base_query += " ORDER BY m.data_movimento DESC, m.id DESC"
-    movimentos_list = conn.execute(base_query, params).fetchall()
+    if where_clauses: sql += " WHERE " + " AND ".join(where_clauses)
+    sql += " ORDER BY m.data_movimento DESC, m.id DESC LIMIT ?"
+    linhas = conn.execute(sql, params + [limite + 1]).fetchall()
+    cursor_seguinte = None
+    if len(linhas) > limite:
+        linhas = linhas[:limite]
+        cursor_seguinte = {'cursor_data': linhas[-1]['data_movimento'], 'cursor_id': linhas[-1]['id']}
+    return linhas, cursor_seguinte
+
+@app.route('/movimentos')
+def movimentos():
+    conn = get_db_connection()
+    movimentos_list, cursor_seguinte = buscar_pagina_movimentos(conn, request.args)
 
     categorias_list = conn.execute('SELECT * FROM categorias ORDER BY descricao').fetchall()
     instituicoes_list = conn.execute('SELECT * FROM instituicoes ORDER BY descricao').fetchall()
     cartoes_list = conn.execute('SELECT * FROM cartoes_credito ORDER BY descricao').fetchall()
     conn.close()
+    filtros = {k: request.args.get(k, '') for k in ('data_inicio', 'data_fim', 'categoria_id', 'instituicao_id',
+                                                     'cartao_id', 'status', 'compartilhado', 'q')}
     return render_template('movimentos.html', movimentos=movimentos_list, categorias=categorias_list,
                            instituicoes=instituicoes_list, cartoes=cartoes_list,
-                           data_inicio=data_inicio, data_fim=data_fim)
+                           data_inicio=filtros['data_inicio'], data_fim=filtros['data_fim'], filtros=filtros,
+                           cursor_seguinte=cursor_seguinte)
+
+@app.route('/api/movimentos')
+def api_movimentos():
+    """Mesma listagem de /movimentos em JSON, uma página por chamada (rolagem infinita)."""
+    conn = get_db_connection()
+    limite = min(max(request.args.get('limite', MOVIMENTOS_POR_PAGINA, type=int), 1), 500)
+    linhas, cursor_seguinte = buscar_pagina_movimentos(conn, request.args, limite)
+    conn.close()
+    return jsonify({
+        'movimentos': [{
+            'id': mov['id'],
+            'data_movimento': mov['data_movimento'],
+            'data_mov_formatada': mov['data_mov_formatada'],
+            'data_efet_formatada': mov['data_efet_formatada'],
+            'descricao': mov['descricao'],
+            'categoria_nome': mov['categoria_nome'],
+            'categoria_tipo': mov['categoria_tipo'],
+            'instituicao_nome': mov['instituicao_nome'],
+            'cartao_nome': mov['cartao_nome'],
+            'valor': mov['valor'],
+            'valor_formatado': format_brl(abs(mov['valor'])),
+            'status': mov['status'],
+            'compartilhado': mov['compartilhado']
+        } for mov in linhas],
+        'proximo': cursor_seguinte
+    })
 
 @app.route('/movimentos/add', methods=['POST'])
 def add_movimento():
@@ -390,17 +1234,19 @@ def add_movimento():
 
     if not all([data_movimento, descricao, categoria_id, instituicao_id, valor_str, status, compartilhado]):
          flash('Todos os campos marcados são obrigatórios.', 'error'); return redirect(url_for('movimentos'))
-    try: valor = float(valor_str)
+    try: valor_centavos = para_centavos(valor_str)
     except ValueError: flash('Valor inválido.', 'error'); return redirect(url_for('movimentos'))
 
     categoria_tipo = conn.execute('SELECT tipo FROM categorias WHERE id = ?', (categoria_id,)).fetchone()['tipo']
-    valor_final = abs(valor)
+    valor_final = abs(valor_centavos)
     if categoria_tipo == 'Despesa': valor_final = -valor_final
     if status == 'Efetivado' and not data_efetivacao: data_efetivacao = data_movimento
 
-    conn.execute('INSERT INTO movimentos (data_movimento, data_efetivacao, descricao, categoria_id, instituicao_id, cartao_id, valor, status, compartilhado) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
-                 (data_movimento, data_efetivacao, descricao, categoria_id, instituicao_id, cartao_id, valor_final, status, compartilhado))
-    conn.commit()
+    with transacao_escrita(conn):
+        cur = conn.execute('INSERT INTO movimentos (data_movimento, data_efetivacao, descricao, categoria_id, instituicao_id, cartao_id, valor_centavos, status, compartilhado) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                     (data_movimento, data_efetivacao, descricao, categoria_id, instituicao_id, cartao_id, valor_final, status, compartilhado))
+        ledger_movimento(conn, conn.execute('SELECT * FROM movimentos WHERE id = ?', (cur.lastrowid,)).fetchone())
+        somar_resumo_mensal(conn, 'id = ?', (cur.lastrowid,))
     conn.close()
     return redirect(url_for('movimentos'))
 
@@ -429,17 +1275,21 @@ def edit_movimento(id):
 
         if not all([data_movimento, descricao, categoria_id, instituicao_id, valor_str, status, compartilhado]):
              flash('Todos os campos são obrigatórios.', 'error'); return reload_edit_page()
-        try: valor = float(valor_str)
+        try: valor_centavos = para_centavos(valor_str)
         except ValueError: flash('Valor inválido.', 'error'); return reload_edit_page()
 
         categoria_tipo = conn.execute('SELECT tipo FROM categorias WHERE id = ?', (categoria_id,)).fetchone()['tipo']
-        valor_final = abs(valor)
+        valor_final = abs(valor_centavos)
         if categoria_tipo == 'Despesa': valor_final = -valor_final
         if status == 'Efetivado' and not data_efetivacao: data_efetivacao = data_movimento
 
-        conn.execute('UPDATE movimentos SET data_movimento = ?, data_efetivacao = ?, descricao = ?, categoria_id = ?, instituicao_id = ?, cartao_id = ?, valor = ?, status = ?, compartilhado = ? WHERE id = ?',
-                     (data_movimento, data_efetivacao, descricao, categoria_id, instituicao_id, cartao_id, valor_final, status, compartilhado, id))
-        conn.commit()
+        with transacao_escrita(conn):
+            ledger_movimento(conn, conn.execute('SELECT * FROM movimentos WHERE id = ?', (id,)).fetchone(), sinal=-1)
+            somar_resumo_mensal(conn, 'id = ?', (id,), sinal=-1)
+            conn.execute('UPDATE movimentos SET data_movimento = ?, data_efetivacao = ?, descricao = ?, categoria_id = ?, instituicao_id = ?, cartao_id = ?, valor_centavos = ?, status = ?, compartilhado = ? WHERE id = ?',
+                         (data_movimento, data_efetivacao, descricao, categoria_id, instituicao_id, cartao_id, valor_final, status, compartilhado, id))
+            ledger_movimento(conn, conn.execute('SELECT * FROM movimentos WHERE id = ?', (id,)).fetchone())
+            somar_resumo_mensal(conn, 'id = ?', (id,))
         conn.close()
         return redirect(url_for('movimentos'))
 
@@ -455,8 +1305,10 @@ def edit_movimento(id):
 @app.route('/movimentos/delete/<int:id>', methods=['POST'])
 def delete_movimento(id):
     conn = get_db_connection()
-    conn.execute('DELETE FROM movimentos WHERE id = ?', (id,))
-    conn.commit()
+    with transacao_escrita(conn):
+        ledger_movimento(conn, conn.execute('SELECT * FROM movimentos WHERE id = ?', (id,)).fetchone(), sinal=-1)
+        somar_resumo_mensal(conn, 'id = ?', (id,), sinal=-1)
+        conn.execute('DELETE FROM movimentos WHERE id = ?', (id,))
     conn.close()
     return redirect(url_for('movimentos'))
 
@@ -464,11 +1316,150 @@ def delete_movimento(id):
 # ADICIONE ESTAS ROTAS AO SEU app.py (após as rotas de movimentos existentes)
 # ==============================================================================
 
-from flask import send_file, make_response
+from flask import send_file, make_response, Response, stream_with_context
 import csv
+import itertools
 from io import StringIO, BytesIO
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+
+# ===== PLANILHAS EXCEL (openpyxl write-only + estilos nomeados) =====
+# O openpyxl só é importado quando a primeira planilha é gerada, não na inicialização do app
+FORMATO_MOEDA = '#,##0.00'
+
+@functools.cache
+def estilos_excel():
+    """Estilos de todas as exportações, montados uma vez; cada planilha registra só os que usa."""
+    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+    borda_fina = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+    centralizado = Alignment(horizontal='center', vertical='center')
+
+    def preenchimento(cor):
+        return PatternFill(start_color=cor, end_color=cor, fill_type="solid")
+
+    return {
+        'borda': dict(border=borda_fina),
+        'moeda': dict(number_format=FORMATO_MOEDA),
+        'negrito': dict(font=Font(bold=True)),
+        'negrito_11': dict(font=Font(bold=True, size=11)),
+        'negrito_12': dict(font=Font(bold=True, size=12)),
+        'total_rotulo': dict(font=Font(bold=True), alignment=Alignment(horizontal='right')),
+        # Movimentos
+        'movimentos_cabecalho': dict(font=Font(bold=True, color="FFFFFF", size=11), fill=preenchimento("4472C4"), alignment=centralizado, border=borda_fina),
+        'movimentos_receita': dict(font=Font(color="008000", bold=True), number_format=FORMATO_MOEDA, border=borda_fina),
+        'movimentos_despesa': dict(font=Font(color="FF0000", bold=True), number_format=FORMATO_MOEDA, border=borda_fina),
+        'movimentos_total': dict(font=Font(bold=True, size=12), fill=preenchimento("E7E6E6"), number_format=FORMATO_MOEDA, border=borda_fina),
+        # Resumo mensal
+        'resumo_cabecalho': dict(font=Font(bold=True, color="FFFFFF"), fill=preenchimento("4472C4"), alignment=Alignment(horizontal='center')),
+        'resumo_positivo': dict(font=Font(color="008000", bold=True), number_format=FORMATO_MOEDA),
+        'resumo_negativo': dict(font=Font(color="FF0000", bold=True), number_format=FORMATO_MOEDA),
+        # Extrato
+        'extrato_titulo': dict(font=Font(bold=True, size=16, color="1E293B")),
+        'extrato_subtitulo': dict(font=Font(bold=True, size=12, color="475569")),
+        'extrato_saldo': dict(font=Font(bold=True, color="1E293B"), number_format=FORMATO_MOEDA),
+        'extrato_entradas': dict(font=Font(color="059669", bold=True), number_format=FORMATO_MOEDA),
+        'extrato_saidas': dict(font=Font(color="DC2626", bold=True), number_format=FORMATO_MOEDA),
+        'extrato_saldo_final': dict(font=Font(bold=True, color="FFFFFF", size=12), fill=preenchimento("667EEA"), number_format=FORMATO_MOEDA),
+        'extrato_cabecalho': dict(font=Font(bold=True, color="FFFFFF", size=11), fill=preenchimento("10B981"), alignment=centralizado, border=borda_fina),
+        'extrato_rotulo': dict(font=Font(bold=True), border=borda_fina),
+        'extrato_saldo_inicial_linha': dict(font=Font(bold=True), fill=preenchimento("F0F9FF"), number_format=FORMATO_MOEDA, border=borda_fina),
+        'extrato_tipo': dict(font=Font(size=9), border=borda_fina),
+        'extrato_comp': dict(font=Font(size=9), alignment=Alignment(horizontal='center'), border=borda_fina),
+        'extrato_valor_entrada': dict(font=Font(color="059669", bold=True), number_format=FORMATO_MOEDA, border=borda_fina),
+        'extrato_valor_saida': dict(font=Font(color="DC2626", bold=True), number_format=FORMATO_MOEDA, border=borda_fina),
+        'extrato_saldo_linha': dict(font=Font(bold=True), number_format=FORMATO_MOEDA, border=borda_fina),
+        'extrato_final_fundo': dict(fill=preenchimento("667EEA"), border=borda_fina),
+        'extrato_final_rotulo': dict(font=Font(bold=True, color="FFFFFF", size=12), fill=preenchimento("667EEA"), border=borda_fina),
+        'extrato_final_valor': dict(font=Font(bold=True, color="FFFFFF", size=12), fill=preenchimento("667EEA"), number_format=FORMATO_MOEDA, border=borda_fina),
+        # Transferências e fluxo entre contas
+        'transferencias_cabecalho': dict(font=Font(bold=True, color="FFFFFF", size=11), fill=preenchimento("667EEA"), alignment=centralizado, border=borda_fina),
+        'transferencias_fatura': dict(font=Font(color="92400E", bold=True), fill=preenchimento("FEF3C7"), border=borda_fina),
+        'transferencias_para_investimento': dict(font=Font(color="1E40AF", bold=True), fill=preenchimento("DBEAFE"), border=borda_fina),
+        'transferencias_de_investimento': dict(font=Font(color="065F46", bold=True), fill=preenchimento("D1FAE5"), border=borda_fina),
+        'transferencias_valor': dict(font=Font(color="667EEA", bold=True), number_format=FORMATO_MOEDA, border=borda_fina),
+        'transferencias_efetivado': dict(font=Font(color="065F46", bold=True), fill=preenchimento("D1FAE5"), border=borda_fina),
+        'transferencias_pendente': dict(font=Font(color="92400E"), fill=preenchimento("FEF3C7"), border=borda_fina),
+        'transferencias_total': dict(font=Font(bold=True, size=12, color="667EEA"), fill=preenchimento("F0F0F0"), number_format=FORMATO_MOEDA, border=borda_fina),
+        'fluxo_cabecalho': dict(font=Font(bold=True, color="FFFFFF"), fill=preenchimento("667EEA"), alignment=Alignment(horizontal='center')),
+    }
+
+class PlanilhaExcel:
+    """Planilha em modo write-only: cada linha vai direto para o arquivo, com estilos nomeados
+    em vez de Font/Border novos por célula."""
+
+    def __init__(self, titulo, larguras, congelar=None):
+        from openpyxl import Workbook
+        from openpyxl.cell import Cell, WriteOnlyCell
+        self._Cell, self._WriteOnlyCell = Cell, WriteOnlyCell
+        self.wb = Workbook(write_only=True)
+        self.ws = self.wb.create_sheet(titulo)
+        # No modo write-only, larguras e painel congelado só valem se definidos antes da primeira linha
+        for coluna, largura in larguras.items():
+            self.ws.column_dimensions[coluna].width = largura
+        if congelar:
+            self.ws.freeze_panes = congelar
+        self.estilos = {}
+        self.linha_atual = 0
+
+    def celula(self, valor=None, estilo=None):
+        if not estilo:
+            return self._WriteOnlyCell(self.ws, value=valor)
+        estilo_array = self.estilos.get(estilo)
+        if estilo_array is None:
+            from openpyxl.styles import NamedStyle
+            from openpyxl.styles.fonts import DEFAULT_FONT
+            # Sem fonte própria, o estilo herda a fonte padrão da planilha (Calibri 11), como nas células comuns
+            named_style = NamedStyle(name=estilo, **{'font': DEFAULT_FONT, **estilos_excel()[estilo]})
+            self.wb.add_named_style(named_style)
+            estilo_array = self.estilos[estilo] = named_style.as_tuple()
+        # Mesmo efeito de cell.style = estilo, sem procurar o estilo pelo nome a cada célula
+        return self._Cell(self.ws, row=1, column=1, value=valor, style_array=estilo_array)
+
+    def linha(self, *valores):
+        """Acrescenta uma linha (valores simples ou células de celula()) e devolve o número dela."""
+        self.ws.append(valores)
+        self.linha_atual += 1
+        return self.linha_atual
+
+    def mesclar(self, intervalo):
+        self.ws.merged_cells.add(intervalo)
+
+    def resposta(self, filename):
+        output = BytesIO()
+        self.wb.save(output)
+        output.seek(0)
+        return send_file(
+            output,
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            as_attachment=True,
+            download_name=filename
+        )
+
+# Linhas lidas do cursor por vez nas exportações em streaming
+EXPORTACAO_LOTE = 1000
+
+def _lotes_cursor(cursor, tamanho=EXPORTACAO_LOTE):
+    """Lê o cursor em lotes de fetchmany, sem trazer o resultado inteiro para a memória."""
+    while True:
+        lote = cursor.fetchmany(tamanho)
+        if not lote: return
+        yield lote
+
+def _csv_streaming(cabecalho, lotes, formatar_linha, filename):
+    """Resposta CSV gerada lote a lote: o download começa logo e a memória não cresce com o histórico."""
+    def gerar():
+        buffer = StringIO()
+        writer = csv.writer(buffer, delimiter=';', quoting=csv.QUOTE_MINIMAL)
+        writer.writerow(cabecalho)
+        for lote in lotes:
+            writer.writerows(formatar_linha(linha) for linha in lote)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    # stream_with_context mantém o contexto (e a conexão do pool em g.db) vivo até o fim do download
+    response = Response(stream_with_context(gerar()))
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    response.headers['Content-Type'] = 'text/csv; charset=utf-8-sig'
+    return response
 
 # --- ROTA PARA EXPORTAR MOVIMENTOS ---
 @app.route('/movimentos/exportar')
@@ -478,18 +1469,15 @@ def exportar_movimentos():
     Parâmetros aceitos via query string:
     - formato: 'csv' ou 'excel' (padrão: csv)
     - data_inicio, data_fim: filtros de data (opcional)
-    - categoria_id, instituicao_id, status, compartilhado: filtros adicionais (opcional)
+    - categoria_id, instituicao_id, cartao_id, status, compartilhado, q: filtros adicionais (opcional),
+      os mesmos da listagem de /movimentos
     """
-    conn = get_db_connection()
+    conn = get_db_leitura()
     
     # Parâmetros de filtro
     formato = request.args.get('formato', 'csv').lower()
     data_inicio = request.args.get('data_inicio')
     data_fim = request.args.get('data_fim')
-    categoria_id = request.args.get('categoria_id')
-    instituicao_id = request.args.get('instituicao_id')
-    status = request.args.get('status')
-    compartilhado = request.args.get('compartilhado')
     
     # Monta query com filtros
     sql = '''
@@ -509,61 +1497,37 @@ def exportar_movimentos():
         JOIN categorias c ON m.categoria_id = c.id
         JOIN instituicoes i ON m.instituicao_id = i.id
         LEFT JOIN cartoes_credito cc ON m.cartao_id = cc.id
-        WHERE 1=1
     '''
     
-    params = []
-    
-    if data_inicio:
-        sql += ' AND m.data_movimento >= ?'
-        params.append(data_inicio)
-    
-    if data_fim:
-        sql += ' AND m.data_movimento <= ?'
-        params.append(data_fim)
-    
-    if categoria_id:
-        sql += ' AND m.categoria_id = ?'
-        params.append(categoria_id)
-    
-    if instituicao_id:
-        sql += ' AND m.instituicao_id = ?'
-        params.append(instituicao_id)
-    
-    if status:
-        sql += ' AND m.status = ?'
-        params.append(status)
-    
-    if compartilhado:
-        sql += ' AND m.compartilhado = ?'
-        params.append(compartilhado)
+    where_clauses, params = _filtros_movimentos(request.args)
+    if where_clauses:
+        sql += ' WHERE ' + ' AND '.join(where_clauses)
     
     sql += ' ORDER BY m.data_movimento DESC, m.id DESC'
     
-    # Busca dados
-    movimentos = conn.execute(sql, params).fetchall()
-    conn.close()
+    # Busca dados em lotes; o primeiro lote já diz se há algo para exportar
+    lotes = _lotes_cursor(conn.execute(sql, params))
+    primeiro_lote = next(lotes, None)
     
-    if not movimentos:
+    if not primeiro_lote:
+        conn.close()
         flash('Nenhum movimento encontrado para exportação.', 'warning')
         return redirect(url_for('movimentos'))
     
+    lotes = itertools.chain([primeiro_lote], lotes)
+    
     # Exporta no formato escolhido
     if formato == 'excel':
-        return _exportar_excel(movimentos, data_inicio, data_fim)
+        return _exportar_excel(lotes, data_inicio, data_fim)
     else:
-        return _exportar_csv(movimentos, data_inicio, data_fim)
+        return _exportar_csv(lotes, data_inicio, data_fim)
 
 
-def _exportar_csv(movimentos, data_inicio=None, data_fim=None):
-    """Exporta movimentos para CSV"""
-    
-    # Cria buffer de memória
-    output = StringIO()
-    writer = csv.writer(output, delimiter=';', quoting=csv.QUOTE_MINIMAL)
+def _exportar_csv(lotes, data_inicio=None, data_fim=None):
+    """Exporta movimentos para CSV (em streaming, a partir dos lotes do cursor)"""
     
     # Cabeçalho
-    writer.writerow([
+    cabecalho = [
         'ID',
         'Data Movimento',
         'Data Efetivação',
@@ -575,11 +1539,11 @@ def _exportar_csv(movimentos, data_inicio=None, data_fim=None):
         'Valor',
         'Status',
         'Compartilhado'
-    ])
+    ]
     
     # Dados
-    for mov in movimentos:
-        writer.writerow([
+    def formatar(mov):
+        return [
             mov['id'],
             mov['data_movimento'],
             mov['data_efetivacao'] or '',
@@ -591,10 +1555,7 @@ def _exportar_csv(movimentos, data_inicio=None, data_fim=None):
             f"{mov['valor']:.2f}".replace('.', ','),
             mov['status'],
             mov['compartilhado']
-        ])
-    
-    # Prepara resposta
-    output.seek(0)
+        ]
     
     # Nome do arquivo com período
     periodo = ''
@@ -607,72 +1568,14 @@ def _exportar_csv(movimentos, data_inicio=None, data_fim=None):
     
     filename = f"movimentos{periodo}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
     
-    response = make_response(output.getvalue())
-    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
-    response.headers['Content-Type'] = 'text/csv; charset=utf-8-sig'
-    
-    return response
+    return _csv_streaming(cabecalho, lotes, formatar, filename)
 
 
-def _exportar_excel(movimentos, data_inicio=None, data_fim=None):
-    """Exporta movimentos para Excel com formatação"""
-    
-    # Cria workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Movimentos"
-    
-    # Estilos
-    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF", size=11)
-    border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
-    
-    # Cabeçalho
-    headers = [
-        'ID', 'Data Movimento', 'Data Efetivação', 'Descrição',
-        'Categoria', 'Tipo', 'Instituição', 'Cartão',
-        'Valor', 'Status', 'Compartilhado'
-    ]
+def _exportar_excel(lotes, data_inicio=None, data_fim=None):
+    """Exporta movimentos para Excel com formatação (lotes do cursor gravados direto na planilha)"""
     
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_num, value=header)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        cell.border = border
-    
-    # Dados
-    for row_num, mov in enumerate(movimentos, 2):
-        ws.cell(row=row_num, column=1, value=mov['id']).border = border
-        ws.cell(row=row_num, column=2, value=mov['data_movimento']).border = border
-        ws.cell(row=row_num, column=3, value=mov['data_efetivacao'] or '').border = border
-        ws.cell(row=row_num, column=4, value=mov['descricao']).border = border
-        ws.cell(row=row_num, column=5, value=mov['categoria']).border = border
-        ws.cell(row=row_num, column=6, value=mov['categoria_tipo']).border = border
-        ws.cell(row=row_num, column=7, value=mov['instituicao']).border = border
-        ws.cell(row=row_num, column=8, value=mov['cartao'] or '').border = border
-        
-        # Valor com formatação
-        valor_cell = ws.cell(row=row_num, column=9, value=mov['valor'])
-        valor_cell.number_format = '#,##0.00'
-        valor_cell.border = border
-        
-        # Cor do valor baseado no tipo
-        if mov['categoria_tipo'] == 'Receita':
-            valor_cell.font = Font(color="008000", bold=True)  # Verde
-        else:
-            valor_cell.font = Font(color="FF0000", bold=True)  # Vermelho
-        
-        ws.cell(row=row_num, column=10, value=mov['status']).border = border
-        ws.cell(row=row_num, column=11, value=mov['compartilhado']).border = border
-    
-    # Ajusta largura das colunas
-    column_widths = {
+    # Larguras das colunas e primeira linha congelada
+    planilha = PlanilhaExcel("Movimentos", {
         'A': 8,   # ID
         'B': 15,  # Data Movimento
         'C': 15,  # Data Efetivação
@@ -684,31 +1587,43 @@ def _exportar_excel(movimentos, data_inicio=None, data_fim=None):
         'I': 15,  # Valor
         'J': 12,  # Status
         'K': 15   # Compartilhado
-    }
+    }, congelar='A2')
+    celula = planilha.celula
     
-    for col, width in column_widths.items():
-        ws.column_dimensions[col].width = width
+    # Cabeçalho
+    headers = [
+        'ID', 'Data Movimento', 'Data Efetivação', 'Descrição',
+        'Categoria', 'Tipo', 'Instituição', 'Cartão',
+        'Valor', 'Status', 'Compartilhado'
+    ]
+    planilha.linha(*(celula(header, 'movimentos_cabecalho') for header in headers))
     
-    # Congela primeira linha
-    ws.freeze_panes = 'A2'
+    # Dados
+    for lote in lotes:
+        for mov in lote:
+            # Cor do valor baseado no tipo
+            estilo_valor = 'movimentos_receita' if mov['categoria_tipo'] == 'Receita' else 'movimentos_despesa'
+            planilha.linha(
+                celula(mov['id'], 'borda'),
+                celula(mov['data_movimento'], 'borda'),
+                celula(mov['data_efetivacao'] or '', 'borda'),
+                celula(mov['descricao'], 'borda'),
+                celula(mov['categoria'], 'borda'),
+                celula(mov['categoria_tipo'], 'borda'),
+                celula(mov['instituicao'], 'borda'),
+                celula(mov['cartao'] or '', 'borda'),
+                celula(mov['valor'], estilo_valor),
+                celula(mov['status'], 'borda'),
+                celula(mov['compartilhado'], 'borda')
+            )
     
     # Adiciona totalizadores
-    ultima_linha = len(movimentos) + 2
-    
-    ws.cell(row=ultima_linha, column=8, value='TOTAL:').font = Font(bold=True)
-    ws.cell(row=ultima_linha, column=8).alignment = Alignment(horizontal='right')
-    
-    total_formula = f'=SUM(I2:I{ultima_linha-1})'
-    total_cell = ws.cell(row=ultima_linha, column=9, value=total_formula)
-    total_cell.font = Font(bold=True, size=12)
-    total_cell.number_format = '#,##0.00'
-    total_cell.fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
-    total_cell.border = border
-    
-    # Salva em buffer
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
+    ultima_linha = planilha.linha_atual + 1
+    planilha.linha(
+        *([None] * 7),
+        celula('TOTAL:', 'total_rotulo'),
+        celula(f'=SUM(I2:I{ultima_linha-1})', 'movimentos_total')
+    )
     
     # Nome do arquivo
     periodo = ''
@@ -721,12 +1636,7 @@ def _exportar_excel(movimentos, data_inicio=None, data_fim=None):
     
     filename = f"movimentos{periodo}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
     
-    return send_file(
-        output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        as_attachment=True,
-        download_name=filename
-    )
+    return planilha.resposta(filename)
 
 
 # --- ROTA PARA EXPORTAR RESUMO MENSAL ---
@@ -735,37 +1645,27 @@ def exportar_resumo_mensal():
     """
     Exporta resumo mensal consolidado (receitas, despesas, resultado)
     """
-    conn = get_db_connection()
+    conn = get_db_leitura()
     
     # Parâmetros
     data_inicio = request.args.get('data_inicio')
     data_fim = request.args.get('data_fim')
     formato = request.args.get('formato', 'excel').lower()
     
-    # Query para resumo mensal
-    sql = '''
+    # Query para resumo mensal, lida do cubo (somas exatas em centavos, convertidas para reais uma vez só)
+    sql_periodo, params = resumo_mensal_periodo(data_inicio, data_fim)
+    sql = f'''
         SELECT 
-            strftime('%Y-%m', m.data_movimento) as mes,
-            SUM(CASE WHEN c.tipo = 'Receita' THEN m.valor ELSE 0 END) as receitas,
-            SUM(CASE WHEN c.tipo = 'Despesa' THEN ABS(m.valor) ELSE 0 END) as despesas,
-            SUM(m.valor) as resultado
-        FROM movimentos m
-        JOIN categorias c ON m.categoria_id = c.id
-        WHERE m.status = 'Efetivado'
+            r.mes,
+            SUM(CASE WHEN c.tipo = 'Receita' THEN r.total_centavos ELSE 0 END) / 100.0 as receitas,
+            SUM(CASE WHEN c.tipo = 'Despesa' THEN ABS(r.total_centavos) ELSE 0 END) / 100.0 as despesas,
+            SUM(r.total_centavos) / 100.0 as resultado
+        FROM ({sql_periodo}) r
+        JOIN categorias c ON r.categoria_id = c.id
+        WHERE r.status = 'Efetivado'
+        GROUP BY r.mes ORDER BY r.mes
     '''
     
-    params = []
-    
-    if data_inicio:
-        sql += ' AND m.data_movimento >= ?'
-        params.append(data_inicio)
-    
-    if data_fim:
-        sql += ' AND m.data_movimento <= ?'
-        params.append(data_fim)
-    
-    sql += ' GROUP BY mes ORDER BY mes'
-    
     resumo = conn.execute(sql, params).fetchall()
     conn.close()
     
@@ -808,56 +1708,27 @@ def _exportar_resumo_csv(resumo, data_inicio=None, data_fim=None):
 
 def _exportar_resumo_excel(resumo, data_inicio=None, data_fim=None):
     """Exporta resumo mensal para Excel com gráfico"""
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Resumo Mensal"
-    
-    # Estilos
-    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF")
+    planilha = PlanilhaExcel("Resumo Mensal", {'A': 12, 'B': 15, 'C': 15, 'D': 15})
+    celula = planilha.celula
     
     # Cabeçalho
     headers = ['Mês', 'Receitas', 'Despesas', 'Resultado']
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_num, value=header)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal='center')
+    planilha.linha(*(celula(header, 'resumo_cabecalho') for header in headers))
     
     # Dados
-    for row_num, row in enumerate(resumo, 2):
-        ws.cell(row=row_num, column=1, value=row['mes'])
-        ws.cell(row=row_num, column=2, value=row['receitas']).number_format = '#,##0.00'
-        ws.cell(row=row_num, column=3, value=row['despesas']).number_format = '#,##0.00'
-        
-        resultado_cell = ws.cell(row=row_num, column=4, value=row['resultado'])
-        resultado_cell.number_format = '#,##0.00'
-        
+    for row in resumo:
         # Cor baseada no resultado
-        if row['resultado'] >= 0:
-            resultado_cell.font = Font(color="008000", bold=True)
-        else:
-            resultado_cell.font = Font(color="FF0000", bold=True)
-    
-    # Larguras
-    ws.column_dimensions['A'].width = 12
-    ws.column_dimensions['B'].width = 15
-    ws.column_dimensions['C'].width = 15
-    ws.column_dimensions['D'].width = 15
-    
-    # Salva
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
+        estilo_resultado = 'resumo_positivo' if row['resultado'] >= 0 else 'resumo_negativo'
+        planilha.linha(
+            row['mes'],
+            celula(row['receitas'], 'moeda'),
+            celula(row['despesas'], 'moeda'),
+            celula(row['resultado'], estilo_resultado)
+        )
     
     filename = f"resumo_mensal_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
     
-    return send_file(
-        output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        as_attachment=True,
-        download_name=filename
-    )
+    return planilha.resposta(filename)
 
 
 # --- ROTAS INVESTIMENTOS ---
@@ -919,28 +1790,31 @@ def add_investimento():
     try:
         quantidade = float(quantidade_str.replace(',', '.'))
         valor_unitario = float(valor_unitario_str.replace(',', '.'))
-        valor_total_bruto = float(valor_total_str.replace(',', '.'))
+        valor_total_bruto = para_centavos(valor_total_str)
         custos = float(custos_str.replace(',', '.')) if custos_str else 0.0
         taxas = float(taxas_str.replace(',', '.')) if taxas_str else 0.0
         irrf = float(irrf_str.replace(',', '.')) if irrf_str else 0.0
         taxa_negociada = float(taxa_negociada_str.replace(',', '.')) if taxa_negociada_str else None
+        # "nan" e "inf" passam pelo float(), mas não viram centavos: erro de conversão como os demais
+        custos_centavos, taxas_centavos, irrf_centavos = para_centavos(custos), para_centavos(taxas), para_centavos(irrf)
     except ValueError:
         flash('Erro ao converter valores numéricos. Use ponto ou vírgula como decimal.', 'error')
         return redirect(url_for('investimentos'))
 
     operacao_natureza = conn.execute('SELECT natureza FROM operacoes WHERE id = ?', (operacao_id,)).fetchone()['natureza']
-    valor_final_liquido = 0.0
-    if operacao_natureza == 'Saida': valor_final_liquido = -abs(valor_total_bruto + custos + taxas)
-    else: valor_final_liquido = abs(valor_total_bruto - custos - taxas - irrf)
+    # Líquido calculado em centavos; custos, taxas e IRRF continuam guardados em reais
+    if operacao_natureza == 'Saida': valor_final_liquido = -abs(valor_total_bruto + custos_centavos + taxas_centavos)
+    else: valor_final_liquido = abs(valor_total_bruto - custos_centavos - taxas_centavos - irrf_centavos)
 
     try:
-        conn.execute('''
-            INSERT INTO investimentos ( data_investimento, data_vencimento, ticker_id, operacao_id, moeda_id, instituicao_id,
-                quantidade, valor_unitario, valor_total, custos, taxas, irrf, taxa_negociada, indexador, observacao
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-            (data_investimento, data_vencimento, ticker_id, operacao_id, moeda_id, instituicao_id, quantidade, valor_unitario,
-             valor_final_liquido, custos, taxas, irrf, taxa_negociada, indexador, observacao))
-        conn.commit()
+        with transacao_escrita(conn):
+            cur = conn.execute('''
+                INSERT INTO investimentos ( data_investimento, data_vencimento, ticker_id, operacao_id, moeda_id, instituicao_id,
+                    quantidade, valor_unitario, valor_total_centavos, custos, taxas, irrf, taxa_negociada, indexador, observacao
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                (data_investimento, data_vencimento, ticker_id, operacao_id, moeda_id, instituicao_id, quantidade, valor_unitario,
+                 valor_final_liquido, custos, taxas, irrf, taxa_negociada, indexador, observacao))
+            somar_posicoes_investimentos(conn, 'i.id = ?', (cur.lastrowid,))
     except sqlite3.Error as e: flash(f"Erro DB: {e}", "error")
     finally: conn.close()
     return redirect(url_for('investimentos'))
@@ -985,26 +1859,30 @@ def edit_investimento(id):
         try:
             quantidade = float(quantidade_str.replace(',', '.'))
             valor_unitario = float(valor_unitario_str.replace(',', '.'))
-            valor_total_bruto = float(valor_total_str.replace(',', '.'))
+            valor_total_bruto = para_centavos(valor_total_str)
             custos = float(custos_str.replace(',', '.')) if custos_str else 0.0
             taxas = float(taxas_str.replace(',', '.')) if taxas_str else 0.0
             irrf = float(irrf_str.replace(',', '.')) if irrf_str else 0.0
             taxa_negociada = float(taxa_negociada_str.replace(',', '.')) if taxa_negociada_str else None
+            # "nan" e "inf" passam pelo float(), mas não viram centavos: erro de conversão como os demais
+            custos_centavos, taxas_centavos, irrf_centavos = para_centavos(custos), para_centavos(taxas), para_centavos(irrf)
         except ValueError: flash('Erro ao converter valores numéricos.', 'error'); return reload_edit_inv_page()
 
         operacao_natureza = conn.execute('SELECT natureza FROM operacoes WHERE id = ?', (operacao_id,)).fetchone()['natureza']
-        valor_final_liquido = 0.0
-        if operacao_natureza == 'Saida': valor_final_liquido = -abs(valor_total_bruto + custos + taxas)
-        else: valor_final_liquido = abs(valor_total_bruto - custos - taxas - irrf)
+        # Líquido calculado em centavos; custos, taxas e IRRF continuam guardados em reais
+        if operacao_natureza == 'Saida': valor_final_liquido = -abs(valor_total_bruto + custos_centavos + taxas_centavos)
+        else: valor_final_liquido = abs(valor_total_bruto - custos_centavos - taxas_centavos - irrf_centavos)
 
         try:
-            conn.execute('''
-                UPDATE investimentos SET data_investimento = ?, data_vencimento = ?, ticker_id = ?, operacao_id = ?, moeda_id = ?,
-                instituicao_id = ?, quantidade = ?, valor_unitario = ?, valor_total = ?, custos = ?, taxas = ?, irrf = ?,
-                taxa_negociada = ?, indexador = ?, observacao = ? WHERE id = ?''',
-                (data_investimento, data_vencimento, ticker_id, operacao_id, moeda_id, instituicao_id, quantidade, valor_unitario,
-                 valor_final_liquido, custos, taxas, irrf, taxa_negociada, indexador, observacao, id))
-            conn.commit()
+            with transacao_escrita(conn):
+                somar_posicoes_investimentos(conn, 'i.id = ?', (id,), sinal=-1)
+                conn.execute('''
+                    UPDATE investimentos SET data_investimento = ?, data_vencimento = ?, ticker_id = ?, operacao_id = ?, moeda_id = ?,
+                    instituicao_id = ?, quantidade = ?, valor_unitario = ?, valor_total_centavos = ?, custos = ?, taxas = ?, irrf = ?,
+                    taxa_negociada = ?, indexador = ?, observacao = ? WHERE id = ?''',
+                    (data_investimento, data_vencimento, ticker_id, operacao_id, moeda_id, instituicao_id, quantidade, valor_unitario,
+                     valor_final_liquido, custos, taxas, irrf, taxa_negociada, indexador, observacao, id))
+                somar_posicoes_investimentos(conn, 'i.id = ?', (id,))
         except sqlite3.Error as e: flash(f"Erro DB: {e}", "error")
         finally: conn.close()
         return redirect(url_for('investimentos'))
@@ -1024,12 +1902,50 @@ def edit_investimento(id):
 def delete_investimento(id):
     conn = get_db_connection()
     try:
-         conn.execute('DELETE FROM investimentos WHERE id = ?', (id,)); conn.commit()
+         with transacao_escrita(conn):
+             somar_posicoes_investimentos(conn, 'i.id = ?', (id,), sinal=-1)
+             conn.execute('DELETE FROM investimentos WHERE id = ?', (id,))
          flash('Investimento excluído.', 'success')
     except sqlite3.Error as e: flash(f'Erro ao excluir: {e}', 'error')
     finally: conn.close()
     return redirect(url_for('investimentos'))
 
+# --- COTAÇÕES ---
+@app.route('/precos', methods=['GET', 'POST'])
+def precos():
+    if request.method == 'POST':
+        arquivo = request.files.get('arquivo')
+        if not arquivo or arquivo.filename == '': flash('Nenhum ficheiro selecionado', 'error'); return redirect(request.url)
+        if not allowed_file(arquivo.filename): flash('Tipo de ficheiro inválido.', 'error'); return redirect(request.url)
+        try: df, descartadas = ler_arquivo_precos(io.BytesIO(arquivo.read()), arquivo.filename.lower())
+        except Exception as e: flash(f"Erro ao ler o ficheiro: {e}", 'error'); return redirect(request.url)
+
+        conn = get_db_connection()
+        try:
+            # Um só executemany: recarregar um período substitui os valores já gravados
+            with transacao_escrita(conn):
+                conn.executemany('''
+                    INSERT INTO precos (serie, data, valor) VALUES (?, ?, ?)
+                    ON CONFLICT (serie, data) DO UPDATE SET valor = excluded.valor''',
+                    df.itertuples(index=False, name=None))
+            mensagem = f"{len(df)} cotações de {df['serie'].nunique()} séries carregadas."
+            if descartadas: mensagem += f" {descartadas} linhas ignoradas (data, série ou valor inválidos)."
+            flash(mensagem, 'success')
+        except sqlite3.Error as e: flash(f"Erro ao gravar as cotações: {e}", 'error')
+        finally: conn.close()
+        return redirect(url_for('precos'))
+
+    conn = get_db_leitura()
+    series = conn.execute('''
+        SELECT p.serie, MIN(p.data) AS primeira, MAX(p.data) AS ultima, COUNT(*) AS cotacoes,
+               (SELECT u.valor FROM precos u WHERE u.serie = p.serie ORDER BY u.data DESC LIMIT 1) AS ultimo_valor
+        FROM precos p
+        GROUP BY p.serie
+        ORDER BY p.serie
+    ''').fetchall()
+    conn.close()
+    return render_template('precos.html', series=series)
+
 # --- ROTAS DE IMPORTAÇÃO ---
 # ... (código existente sem alterações) ...
 @app.route('/importar', methods=['GET', 'POST'])
@@ -1048,21 +1964,114 @@ def importar():
         else: flash('Tipo de ficheiro inválido.', 'error'); return redirect(request.url)
     return render_template('importar.html')
 
+# Formatos tentados em bloco, na ordem, antes de recorrer ao parser genérico linha a linha
+FORMATOS_DATA_IMPORTACAO = ['%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%d/%m/%Y', '%d-%m-%Y', '%d/%m/%y', '%d.%m.%Y']
+STATUS_VALIDOS = ['Pendente', 'Efetivado']
+COMPARTILHADO_VALIDOS = ['100% Silvia', '100% Nelson', '50/50']
+# Linhas válidas exibidas na revisão; as demais são importadas sem passar pelo navegador
+IMPORTACAO_LINHAS_PREVIA = 200
+
+def _coluna_texto(df, coluna, padrao=''):
+    """Coluna como texto sem espaços nas pontas (mesma conversão que str(valor).strip())."""
+    import pandas as pd
+    if coluna not in df.columns: return pd.Series(padrao, index=df.index, dtype=object)
+    # Categoria, conta, status... repetem poucos valores: limpa só os distintos e espalha pelos códigos
+    texto = df[coluna].astype(str)
+    # No pandas 3 o astype(str) deixa NaN, NaT e None como ausentes; str() os escreve 'nan', 'NaT' e 'None'
+    ausentes = texto.isna()
+    if ausentes.any(): texto = texto.astype(object).where(~ausentes, df[coluna][ausentes].map(str))
+    codigos, unicos = pd.factorize(texto)
+    return pd.Series(pd.Index(unicos, dtype=object).str.strip().to_numpy()[codigos], index=df.index, dtype=object)
+
+def _texto_e_numero(texto):
+    try: float(texto); return True
+    except ValueError: return False
+
+def _datas_importacao(df):
+    """Converte a coluna 'data' de uma só vez; devolve (datas formatadas, máscara de datas inválidas)."""
+    import pandas as pd
+    if 'data' not in df.columns:
+        return pd.Series('nan', index=df.index, dtype=object), pd.Series(True, index=df.index)
+    coluna = df['data']
+    texto = _coluna_texto(df, 'data')
+    if pd.api.types.is_datetime64_any_dtype(coluna):
+        datas = coluna
+    else:
+        # Células que já vêm como datas (planilhas) e texto ISO saem numa só chamada
+        datas = pd.to_datetime(coluna, errors='coerce', format='ISO8601')
+        for formato in FORMATOS_DATA_IMPORTACAO:
+            faltam = datas.isna()
+            if not faltam.any(): break
+            datas = datas.fillna(pd.to_datetime(texto[faltam], errors='coerce', format=formato))
+        # Só os formatos exóticos que sobraram passam pelo parser genérico, um a um
+        for idx in datas.index[datas.isna()]:
+            try:
+                data_obj = pd.to_datetime(texto[idx], errors='coerce', dayfirst=True)
+                if pd.isna(data_obj): data_obj = pd.to_datetime(texto[idx], errors='raise')
+                datas[idx] = data_obj
+            except Exception: pass
+    invalidas = datas.isna()
+    return datas.dt.strftime('%Y-%m-%d').where(~invalidas, texto), invalidas
+
+def validar_linhas_importacao(df, categorias_map, instituicoes_map, cartoes_map):
+    """Valida o DataFrame importado coluna a coluna; só as linhas com erro ganham mensagens.
+    Retorna (linhas para importacao_linhas, quantidade de linhas com erro)."""
+    import pandas as pd
+    data, data_invalida = _datas_importacao(df)
+    descricao = _coluna_texto(df, 'descricao')
+    categoria_nome = _coluna_texto(df, 'categoria')
+    conta_nome = _coluna_texto(df, 'conta')
+    cartao_nome = _coluna_texto(df, 'cartao')
+    cartao_nome = cartao_nome.mask(cartao_nome.str.lower() == 'nan', '')
+    valor_str = _coluna_texto(df, 'valor', '0').str.replace(',', '.', regex=False)
+    status = _coluna_texto(df, 'status').str.title()
+    compartilhado = _coluna_texto(df, 'compartilhado')
+
+    categoria_id = categoria_nome.map({nome: v[0] for nome, v in categorias_map.items()})
+    instituicao_id = conta_nome.map(instituicoes_map)
+    cartao_id = cartao_nome.map(cartoes_map)
+
+    # pd.to_numeric recusa parte do que float() aceita ('nan' de células vazias, '1_000'): só essas passam por float()
+    valor_invalido = pd.to_numeric(valor_str, errors='coerce').isna()
+    valor_invalido[valor_invalido] = ~valor_str[valor_invalido].map(_texto_e_numero).astype(bool)
+
+    # Uma máscara por regra, na ordem em que as mensagens aparecem na tela
+    regras = [
+        (data_invalida, "Data '{}' inválida.", data),
+        (categoria_id.isna(), "Categoria '{}' ?", categoria_nome),
+        (instituicao_id.isna(), "Conta '{}' ?", conta_nome),
+        ((cartao_nome != '') & cartao_id.isna(), "Cartão '{}' ?", cartao_nome),
+        (~status.isin(STATUS_VALIDOS), "Status '{}' ?", status),
+        (~compartilhado.isin(COMPARTILHADO_VALIDOS), "Compartilhado '{}' ?", compartilhado),
+        (valor_invalido, "Valor '{}' ?", valor_str),
+    ]
+    erros_por_linha = {}
+    for mascara, mensagem, valores in regras:
+        for posicao in mascara.to_numpy().nonzero()[0]:
+            erros_por_linha.setdefault(posicao, []).append(mensagem.format(valores.iat[posicao]))
+
+    ids = {k: v.astype('Int64').astype(object).where(v.notna(), None).tolist()
+           for k, v in (('categoria_id', categoria_id), ('instituicao_id', instituicao_id), ('cartao_id', cartao_id))}
+    erros = [None] * len(df)
+    for posicao, mensagens in erros_por_linha.items(): erros[posicao] = '\n'.join(mensagens)
+    # Tuplas na ordem das colunas de importacao_linhas, prontas para o executemany
+    linhas = list(zip(range(1, len(df) + 1), data.tolist(), descricao.tolist(),
+                      ids['categoria_id'], categoria_nome.tolist(), ids['instituicao_id'], conta_nome.tolist(),
+                      ids['cartao_id'], cartao_nome.tolist(), valor_str.tolist(), status.tolist(), compartilhado.tolist(), erros))
+    return linhas, len(erros_por_linha)
+
 @app.route('/importar/validar/<filename>', methods=['GET'])
 def validar_importacao(filename):
+    import pandas as pd
     filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
     if not os.path.exists(filepath): flash('Ficheiro não encontrado.', 'error'); return redirect(url_for('importar'))
 
     conn = get_db_connection()
-    categorias_db = conn.execute('SELECT id, descricao, tipo FROM categorias').fetchall()
-    instituicoes_db = conn.execute('SELECT id, descricao FROM instituicoes').fetchall()
-    cartoes_db = conn.execute('SELECT id, descricao FROM cartoes_credito').fetchall()
+    categorias_map = {c['descricao']: (c['id'], c['tipo']) for c in conn.execute('SELECT id, descricao, tipo FROM categorias')}
+    instituicoes_map = {i['descricao']: i['id'] for i in conn.execute('SELECT id, descricao FROM instituicoes')}
+    cartoes_map = {c['descricao']: c['id'] for c in conn.execute('SELECT id, descricao FROM cartoes_credito')}
     conn.close()
 
-    categorias_map = {c['descricao']: (c['id'], c['tipo']) for c in categorias_db}
-    instituicoes_map = {i['descricao']: i['id'] for i in instituicoes_db}
-    cartoes_map = {c['descricao']: c['id'] for c in cartoes_db}
-
     try:
         if filename.endswith('.csv'):
             try: df = pd.read_csv(filepath, sep=';', decimal=',')
@@ -1082,220 +2091,226 @@ def validar_importacao(filename):
 
     except Exception as e: flash(f"Erro ao ler o ficheiro: {e}", 'error'); return redirect(url_for('importar'))
 
-    dados_validados = []
-    has_errors = False
-    for index, row in df.iterrows():
-        linha_dados = {}
-        erros = []
-        data = str(row.get('data', '')).strip()
-        try:
-            if isinstance(row.get('data'), datetime): data = row.get('data').strftime('%Y-%m-%d')
-            else:
-                data_obj = pd.to_datetime(data, errors='coerce', dayfirst=True)
-                if pd.isna(data_obj): data_obj = pd.to_datetime(data, errors='raise')
-                data = data_obj.strftime('%Y-%m-%d')
-        except Exception: erros.append(f"Data '{data}' inválida."); has_errors = True
-
-        descricao = str(row.get('descricao', '')).strip()
-        categoria_nome = str(row.get('categoria', '')).strip()
-        conta_nome = str(row.get('conta', '')).strip()
-        cartao_nome = str(row.get('cartao', '')).strip()
-        if cartao_nome.lower() == 'nan': cartao_nome = ''
-
-        valor_str = str(row.get('valor', '0')).replace(',', '.').strip()
-        status = str(row.get('status', '')).strip().title()
-        compartilhado = str(row.get('compartilhado', '')).strip()
-
-        linha_dados['data'] = data
-        linha_dados['descricao'] = descricao
-        linha_dados['valor'] = valor_str
-        linha_dados['status'] = status
-        linha_dados['compartilhado'] = compartilhado
-        linha_dados['cartao_nome_raw'] = cartao_nome
-
-        if categoria_nome in categorias_map: linha_dados['categoria_id'] = categorias_map[categoria_nome][0]; linha_dados['categoria_nome'] = categoria_nome
-        else: erros.append(f"Categoria '{categoria_nome}' ?"); linha_dados['categoria_nome_invalido'] = categoria_nome; has_errors = True
-
-        if conta_nome in instituicoes_map: linha_dados['instituicao_id'] = instituicoes_map[conta_nome]; linha_dados['conta_nome'] = conta_nome
-        else: erros.append(f"Conta '{conta_nome}' ?"); linha_dados['conta_nome_invalido'] = conta_nome; has_errors = True
-
-        if cartao_nome:
-            if cartao_nome in cartoes_map: linha_dados['cartao_id'] = cartoes_map[cartao_nome]; linha_dados['cartao_nome'] = cartao_nome
-            else: erros.append(f"Cartão '{cartao_nome}' ?"); linha_dados['cartao_nome_invalido'] = cartao_nome; has_errors = True
-
-        if status not in ['Pendente', 'Efetivado']: erros.append(f"Status '{status}' ?"); linha_dados['status_invalido'] = status; has_errors = True
-        if compartilhado not in ['100% Silvia', '100% Nelson', '50/50']: erros.append(f"Compartilhado '{compartilhado}' ?"); linha_dados['compartilhado_invalido'] = compartilhado; has_errors = True
-        try: float(valor_str)
-        except ValueError: erros.append(f"Valor '{valor_str}' ?"); has_errors = True
-
-        linha_dados['erros'] = erros
-        dados_validados.append(linha_dados)
+    linhas, linhas_com_erro = validar_linhas_importacao(df, categorias_map, instituicoes_map, cartoes_map)
+
+    # As linhas validadas vão para o staging; a tela de revisão e a confirmação leem de lá
+    importacao_id = uuid.uuid4().hex
+    conn = get_db_connection()
+    try:
+        with transacao_escrita(conn):
+            # Sessões abandonadas (nem salvas nem canceladas) há mais de um dia
+            conn.execute("DELETE FROM importacoes WHERE criado_em < datetime('now', '-1 day')")
+            conn.execute('INSERT INTO importacoes (id, arquivo, total_linhas, linhas_com_erro) VALUES (?, ?, ?, ?)',
+                         (importacao_id, filename, len(linhas), linhas_com_erro))
+            conn.executemany('''
+                INSERT INTO importacao_linhas (importacao_id, linha, data_movimento, descricao, categoria_id, categoria_nome,
+                    instituicao_id, conta_nome, cartao_id, cartao_nome, valor, status, compartilhado, erros)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', ((importacao_id,) + linha for linha in linhas))
+    except sqlite3.Error as e: flash(f"Erro ao preparar a importação: {e}", 'error'); return redirect(url_for('importar'))
+    finally: conn.close()
+
+    os.remove(filepath)
+    return redirect(url_for('revisar_importacao', importacao_id=importacao_id))
+
+@app.route('/importar/revisar/<importacao_id>', methods=['GET'])
+def revisar_importacao(importacao_id):
+    conn = get_db_connection()
+    importacao = conn.execute('SELECT * FROM importacoes WHERE id = ?', (importacao_id,)).fetchone()
+    if not importacao:
+        conn.close(); flash('Importação não encontrada ou expirada. Envie o ficheiro novamente.', 'error'); return redirect(url_for('importar'))
+
+    # Todas as linhas com erro (precisam de correção) e só uma prévia das válidas
+    dados = conn.execute('''
+        SELECT * FROM importacao_linhas
+        WHERE importacao_id = ? AND (erros IS NOT NULL OR linha <= ?)
+        ORDER BY linha''', (importacao_id, IMPORTACAO_LINHAS_PREVIA)).fetchall()
+    categorias_db = conn.execute('SELECT id, descricao, tipo FROM categorias').fetchall()
+    instituicoes_db = conn.execute('SELECT id, descricao FROM instituicoes').fetchall()
+    cartoes_db = conn.execute('SELECT id, descricao FROM cartoes_credito').fetchall()
+    conn.close()
 
     return render_template('validar_importacao.html',
-                           dados=dados_validados, filename=filename, has_errors=has_errors,
+                           dados=dados, importacao=importacao, filename=importacao['arquivo'],
+                           has_errors=importacao['linhas_com_erro'] > 0, linhas_ocultas=importacao['total_linhas'] - len(dados),
+                           status_validos=STATUS_VALIDOS, compartilhado_validos=COMPARTILHADO_VALIDOS,
                            categorias_list=categorias_db, instituicoes_list=instituicoes_db, cartoes_list=cartoes_db)
 
+@app.route('/importar/cancelar/<importacao_id>', methods=['POST'])
+def cancelar_importacao(importacao_id):
+    conn = get_db_connection()
+    with transacao_escrita(conn): conn.execute('DELETE FROM importacoes WHERE id = ?', (importacao_id,))
+    conn.close()
+    flash('Importação cancelada.', 'success')
+    return redirect(url_for('importar'))
+
 @app.route('/importar/salvar', methods=['POST'])
 def salvar_importacao():
-    total_rows = int(request.form.get('total_rows', 0))
-    if total_rows == 0: flash("Nenhum dado para importar.", 'error'); return redirect(url_for('importar'))
-    filename = request.form.get('filename_original') # Recupera o nome do arquivo original
-
+    importacao_id = request.form.get('importacao_id')
     conn = get_db_connection()
+    importacao = conn.execute('SELECT * FROM importacoes WHERE id = ?', (importacao_id,)).fetchone()
+    if not importacao:
+        conn.close(); flash("Nenhum dado para importar.", 'error'); return redirect(url_for('importar'))
+
     try:
-        count_sucesso = 0
         categorias_tipos = {c['id']: c['tipo'] for c in conn.execute('SELECT id, tipo FROM categorias').fetchall()}
-
-        with conn:
-            for i in range(1, total_rows + 1):
-                data_movimento = request.form.get(f'data_{i}')
-                descricao = request.form.get(f'descricao_{i}')
-                categoria_id = request.form.get(f'categoria_id_{i}')
-                instituicao_id = request.form.get(f'instituicao_id_{i}')
-                cartao_id = request.form.get(f'cartao_id_{i}') or None
-                valor_str = request.form.get(f'valor_{i}')
-                status = request.form.get(f'status_{i}')
-                compartilhado = request.form.get(f'compartilhado_{i}')
-                data_efetivacao = data_movimento if status == 'Efetivado' else None
-
-                if not all([data_movimento, descricao, categoria_id, instituicao_id, valor_str, status, compartilhado]):
-                    flash(f"Linha {i} ignorada: dados em falta.", 'error'); continue
-                try: valor = float(valor_str)
-                except ValueError: flash(f"Linha {i} ({descricao}) ignorada: valor inválido.", 'error'); continue
-                try: categoria_id_int = int(categoria_id)
-                except (ValueError, TypeError): flash(f"Linha {i} ({descricao}) ignorada: ID de categoria inválido.", 'error'); continue
-
-                categoria_tipo = categorias_tipos.get(categoria_id_int)
-                if not categoria_tipo: flash(f"Linha {i} ({descricao}) ignorada: tipo de categoria não encontrado.", 'error'); continue
-
-                valor_final = abs(valor)
-                if categoria_tipo == 'Despesa': valor_final = -valor_final
-
-                conn.execute('INSERT INTO movimentos (data_movimento, data_efetivacao, descricao, categoria_id, instituicao_id, cartao_id, valor, status, compartilhado) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
-                             (data_movimento, data_efetivacao, descricao, categoria_id_int, instituicao_id, cartao_id, valor_final, status, compartilhado))
-                count_sucesso += 1
-
-        flash(f"{count_sucesso} de {total_rows} movimentos importados com sucesso!", 'success')
+        total_rows = importacao['total_linhas']
+        novos = []
+
+        for row in conn.execute('SELECT * FROM importacao_linhas WHERE importacao_id = ? ORDER BY linha', (importacao_id,)):
+            i = row['linha']
+            # O formulário só traz os campos corrigidos na tela de revisão (nome_{linha})
+            data_movimento = row['data_movimento']
+            descricao = row['descricao']
+            categoria_id = request.form.get(f'categoria_id_{i}') or row['categoria_id']
+            instituicao_id = request.form.get(f'instituicao_id_{i}') or row['instituicao_id']
+            cartao_id = request.form.get(f'cartao_id_{i}', row['cartao_id']) or None
+            valor_str = row['valor']
+            status = request.form.get(f'status_{i}') or row['status']
+            compartilhado = request.form.get(f'compartilhado_{i}') or row['compartilhado']
+            data_efetivacao = data_movimento if status == 'Efetivado' else None
+
+            if not all([data_movimento, descricao, categoria_id, instituicao_id, valor_str, status, compartilhado]):
+                flash(f"Linha {i} ignorada: dados em falta.", 'error'); continue
+            if status not in STATUS_VALIDOS or compartilhado not in COMPARTILHADO_VALIDOS:
+                flash(f"Linha {i} ({descricao}) ignorada: status ou compartilhado inválido.", 'error'); continue
+            try: valor_centavos = para_centavos(valor_str)
+            except ValueError: flash(f"Linha {i} ({descricao}) ignorada: valor inválido.", 'error'); continue
+            try: categoria_id_int = int(categoria_id)
+            except (ValueError, TypeError): flash(f"Linha {i} ({descricao}) ignorada: ID de categoria inválido.", 'error'); continue
+
+            categoria_tipo = categorias_tipos.get(categoria_id_int)
+            if not categoria_tipo: flash(f"Linha {i} ({descricao}) ignorada: tipo de categoria não encontrado.", 'error'); continue
+
+            valor_final = abs(valor_centavos)
+            if categoria_tipo == 'Despesa': valor_final = -valor_final
+
+            novos.append((data_movimento, data_efetivacao, descricao, categoria_id_int, instituicao_id, cartao_id, valor_final, status, compartilhado))
+
+        # Uma transação só: ou entra tudo e o staging é descartado, ou nada muda. Com o lock de escrita
+        # tomado desde o início, nenhum outro escritor insere entre o MAX(id) e o INSERT
+        with transacao_escrita(conn):
+            ultimo_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM movimentos').fetchone()[0]
+            conn.executemany('INSERT INTO movimentos (data_movimento, data_efetivacao, descricao, categoria_id, instituicao_id, cartao_id, valor_centavos, status, compartilhado) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', novos)
+            if novos:
+                somar_saldos_diarios(conn, 'id > ?', (ultimo_id,))
+                somar_resumo_mensal(conn, 'id > ?', (ultimo_id,))
+            conn.execute('DELETE FROM importacoes WHERE id = ?', (importacao_id,))
+
+        flash(f"{len(novos)} de {total_rows} movimentos importados com sucesso!", 'success')
 
     except sqlite3.Error as e: flash(f"Erro DB: {e}. Nenhuma linha salva.", 'error')
     except Exception as e: flash(f"Erro inesperado: {e}", 'error')
-    finally:
-        if filename:
-             filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-             if os.path.exists(filepath): os.remove(filepath)
-        conn.close()
+    finally: conn.close()
 
     return redirect(url_for('movimentos'))
 
 # --- ROTA RELATÓRIO FLUXO ---
 # ... (código existente sem alterações) ...
 @app.route('/relatorio/fluxo')
+@relatorio_em_cache
 def relatorio_fluxo():
-    conn = get_db_connection()
+    import pandas as pd
+    conn = get_db_leitura()
     data_inicio = request.args.get('data_inicio')
     data_fim = request.args.get('data_fim')
     filtro_compartilhado = request.args.get('compartilhado', 'Todos')
 
-    sql = '''
-        SELECT
-            m.data_movimento, m.data_efetivacao, m.valor, m.compartilhado, m.status,
-            c.descricao AS categoria, c.tipo AS categoria_tipo,
-            i.descricao AS instituicao, cc.descricao AS cartao
-        FROM movimentos m
-        JOIN categorias c ON m.categoria_id = c.id
-        JOIN instituicoes i ON m.instituicao_id = i.id
-        LEFT JOIN cartoes_credito cc ON m.cartao_id = cc.id
-        WHERE 1=1 '''
-    params = []
-    if filtro_compartilhado != 'Todos': sql += " AND m.compartilhado = ?"; params.append(filtro_compartilhado)
+    # Agregados do cubo mensal: fluxo pelo mês do movimento; bancos e cartões pelo mês da efetivação
+    filtro_comp = "" if filtro_compartilhado == 'Todos' else "AND r.compartilhado = ?"
+    params_comp = [] if filtro_compartilhado == 'Todos' else [filtro_compartilhado]
+    sql_periodo_movimento, params_periodo_movimento = resumo_mensal_periodo(data_inicio, data_fim)
+    sql_periodo_efetivacao, params_periodo_efetivacao = resumo_mensal_periodo(data_inicio, data_fim, por='efetivacao')
 
     try:
-        df_base = pd.read_sql_query(sql, conn, params=params, parse_dates=['data_movimento'])
+        tem_movimentos = conn.execute(f"SELECT 1 FROM resumo_mensal r WHERE 1=1 {filtro_comp} LIMIT 1", params_comp).fetchone()
+        df_fluxo_filtrado = pd.read_sql_query(f'''
+            SELECT c.tipo AS categoria_tipo, c.descricao AS categoria, r.mes AS MesAno, SUM(r.total_centavos) AS valor_centavos
+            FROM ({sql_periodo_movimento}) r
+            JOIN categorias c ON r.categoria_id = c.id
+            WHERE 1=1 {filtro_comp}
+            GROUP BY 1, 2, 3''', conn, params=params_periodo_movimento + params_comp)
+        all_months = sorted(df_fluxo_filtrado['MesAno'].unique()) if not df_fluxo_filtrado.empty else []
+        # Bancos e cartões só entram nos meses que aparecem no fluxo: o recorte é feito no SQL
+        meses_json = json.dumps(all_months)
+        df_banco_filtrado = pd.read_sql_query(f'''
+            SELECT i.descricao AS instituicao, r.mes_efetivacao AS MesAno, SUM(r.total_centavos) AS valor_centavos
+            FROM ({sql_periodo_efetivacao}) r
+            JOIN instituicoes i ON r.instituicao_id = i.id
+            WHERE r.status = 'Efetivado' AND r.cartao_id = 0 {filtro_comp}
+              AND r.mes_efetivacao IN (SELECT value FROM json_each(?))
+            GROUP BY 1, 2''', conn, params=params_periodo_efetivacao + params_comp + [meses_json])
+        df_cartao_filtrado = pd.read_sql_query(f'''
+            SELECT cc.descricao AS cartao, r.mes_efetivacao AS MesAno, SUM(r.total_centavos) AS valor_centavos
+            FROM ({sql_periodo_efetivacao}) r
+            JOIN cartoes_credito cc ON r.cartao_id = cc.id
+            WHERE 1=1 {filtro_comp}
+              AND r.mes_efetivacao IN (SELECT value FROM json_each(?))
+            GROUP BY 1, 2''', conn, params=params_periodo_efetivacao + params_comp + [meses_json])
         conn.close()
-        df_base['data_efetivacao'] = pd.to_datetime(df_base['data_efetivacao'], errors='coerce')
     except Exception as e:
         if conn: conn.close();
         flash(f"Erro ao buscar dados: {e}", "error")
         return render_template('relatorio_fluxo.html', tables={}, months=[], data_inicio=data_inicio, data_fim=data_fim, filtro_compartilhado=filtro_compartilhado, show_table=False)
 
-    if df_base.empty:
+    if not tem_movimentos:
         flash("Nenhum movimento encontrado.", "info")
         return render_template('relatorio_fluxo.html', tables={}, months=[], data_inicio=data_inicio, data_fim=data_fim, filtro_compartilhado=filtro_compartilhado, show_table=False)
 
-    df_fluxo_filtrado = df_base.copy()
-    df_banco_filtrado = df_base.copy()
-    df_cartao_filtrado = df_base.copy()
-
-    if data_inicio:
-        data_inicio_dt = pd.to_datetime(data_inicio)
-        df_fluxo_filtrado = df_fluxo_filtrado[df_fluxo_filtrado['data_movimento'] >= data_inicio_dt]
-        df_banco_filtrado = df_banco_filtrado[df_banco_filtrado['data_efetivacao'].notna() & (df_banco_filtrado['data_efetivacao'] >= data_inicio_dt)]
-        df_cartao_filtrado = df_cartao_filtrado[df_cartao_filtrado['data_efetivacao'].notna() & (df_cartao_filtrado['data_efetivacao'] >= data_inicio_dt)]
-    if data_fim:
-        data_fim_dt = pd.to_datetime(data_fim)
-        df_fluxo_filtrado = df_fluxo_filtrado[df_fluxo_filtrado['data_movimento'] <= data_fim_dt]
-        df_banco_filtrado = df_banco_filtrado[df_banco_filtrado['data_efetivacao'].notna() & (df_banco_filtrado['data_efetivacao'] <= data_fim_dt)]
-        df_cartao_filtrado = df_cartao_filtrado[df_cartao_filtrado['data_efetivacao'].notna() & (df_cartao_filtrado['data_efetivacao'] <= data_fim_dt)]
-
-    all_months = sorted(df_fluxo_filtrado['data_movimento'].dt.strftime('%Y-%m').unique()) if not df_fluxo_filtrado.empty else []
     all_cols_with_media = all_months + ['Média']
 
+    def pivotar(df, indice):
+        """Linhas (grupo, mês, soma) já agregadas no SQL -> uma linha por grupo e uma coluna por mês, mais a Média."""
+        pivot = df.set_index(indice + ['MesAno'])['valor_centavos'].unstack('MesAno', fill_value=0)
+        pivot = pivot.reindex(columns=all_months, fill_value=0)
+        pivot['Média'] = pivot[all_months].mean(axis=1)
+        return pivot
+
     pivot_fluxo = pd.DataFrame()
     resultado = pd.Series(0, index=all_cols_with_media)
     total_receitas = pd.Series(0, index=all_cols_with_media)
     total_despesas = pd.Series(0, index=all_cols_with_media)
 
     if not df_fluxo_filtrado.empty:
-        df_fluxo_filtrado['MesAno'] = df_fluxo_filtrado['data_movimento'].dt.strftime('%Y-%m')
-        pivot_fluxo = pd.pivot_table(df_fluxo_filtrado, values='valor', index=['categoria_tipo', 'categoria'], columns='MesAno', aggfunc='sum', fill_value=0)
-        pivot_fluxo = pivot_fluxo.reindex(columns=all_months, fill_value=0)
-        if not pivot_fluxo.empty:
-            pivot_fluxo['Média'] = pivot_fluxo[all_months].mean(axis=1) if all_months else 0
-            total_receitas = pivot_fluxo.loc['Receita'].sum() if 'Receita' in pivot_fluxo.index.get_level_values(0) else pd.Series(0, index=pivot_fluxo.columns)
-            total_despesas = pivot_fluxo.loc['Despesa'].sum() if 'Despesa' in pivot_fluxo.index.get_level_values(0) else pd.Series(0, index=pivot_fluxo.columns)
-            resultado = total_receitas + total_despesas
-
-    df_banco_final = df_banco_filtrado[(df_banco_filtrado['status'] == 'Efetivado') & (df_banco_filtrado['cartao'].isna()) & (df_banco_filtrado['data_efetivacao'].notna())]
+        pivot_fluxo = pivotar(df_fluxo_filtrado, ['categoria_tipo', 'categoria'])
+        total_receitas = pivot_fluxo.loc['Receita'].sum() if 'Receita' in pivot_fluxo.index.get_level_values(0) else pd.Series(0, index=pivot_fluxo.columns)
+        total_despesas = pivot_fluxo.loc['Despesa'].sum() if 'Despesa' in pivot_fluxo.index.get_level_values(0) else pd.Series(0, index=pivot_fluxo.columns)
+        resultado = total_receitas + total_despesas
+
     pivot_banco = pd.DataFrame()
     total_bancos = pd.Series(0, index=all_cols_with_media)
 
-    if not df_banco_final.empty:
-        df_banco_final['MesAno'] = df_banco_final['data_efetivacao'].dt.strftime('%Y-%m')
-        df_banco_final = df_banco_final[df_banco_final['MesAno'].isin(all_months)]
-        pivot_banco = pd.pivot_table(df_banco_final, values='valor', index='instituicao', columns='MesAno', aggfunc='sum', fill_value=0)
-        pivot_banco = pivot_banco.reindex(columns=all_months, fill_value=0)
-        if not pivot_banco.empty:
-            pivot_banco['Média'] = pivot_banco[all_months].mean(axis=1) if all_months else 0
-            total_bancos = pivot_banco.sum()
+    if not df_banco_filtrado.empty:
+        pivot_banco = pivotar(df_banco_filtrado, ['instituicao'])
+        total_bancos = pivot_banco.sum()
 
-    df_cartao_final = df_cartao_filtrado[df_cartao_filtrado['cartao'].notna() & df_cartao_filtrado['data_efetivacao'].notna()]
     pivot_cartao = pd.DataFrame()
     total_cartoes = pd.Series(0, index=all_cols_with_media)
 
-    if not df_cartao_final.empty:
-        df_cartao_final['MesAno'] = df_cartao_final['data_efetivacao'].dt.strftime('%Y-%m')
-        df_cartao_final = df_cartao_final[df_cartao_final['MesAno'].isin(all_months)]
-        pivot_cartao = pd.pivot_table(df_cartao_final, values='valor', index='cartao', columns='MesAno', aggfunc='sum', fill_value=0).abs()
-        pivot_cartao = pivot_cartao.reindex(columns=all_months, fill_value=0)
-        if not pivot_cartao.empty:
-            pivot_cartao['Média'] = pivot_cartao[all_months].mean(axis=1) if all_months else 0
-            total_cartoes = pivot_cartao.sum()
+    if not df_cartao_filtrado.empty:
+        df_cartao_filtrado['valor_centavos'] = df_cartao_filtrado['valor_centavos'].abs()
+        pivot_cartao = pivotar(df_cartao_filtrado, ['cartao'])
+        total_cartoes = pivot_cartao.sum()
+
+    # Pivôs e totais foram somados em centavos (int64); só aqui viram reais para exibição
+    pivot_fluxo, pivot_banco, pivot_cartao = pivot_fluxo / 100, pivot_banco / 100, pivot_cartao / 100
+    resultado, total_receitas, total_despesas = resultado / 100, total_receitas / 100, total_despesas / 100
+    total_bancos, total_cartoes = total_bancos / 100, total_cartoes / 100
 
     def prepare_total_dict(series_data):
         dict_data = series_data.to_dict()
         for col in all_cols_with_media:
             if col not in dict_data: dict_data[col] = 0
-        return {key: format_brl(value) for key, value in dict_data.items()}
+        return dict(zip(dict_data.keys(), format_brl_array(list(dict_data.values()))))
 
     tables = {
         'Resultado': prepare_total_dict(resultado),
-        'Receitas': pivot_fluxo.loc['Receita'].applymap(format_brl).reset_index().to_dict('records') if not pivot_fluxo.empty and 'Receita' in pivot_fluxo.index.get_level_values(0) else [],
+        'Receitas': format_brl_frame(pivot_fluxo.loc['Receita']).reset_index().to_dict('records') if not pivot_fluxo.empty and 'Receita' in pivot_fluxo.index.get_level_values(0) else [],
         'Total_Receitas': prepare_total_dict(total_receitas),
-        'Despesas': pivot_fluxo.loc['Despesa'].applymap(format_brl).reset_index().to_dict('records') if not pivot_fluxo.empty and 'Despesa' in pivot_fluxo.index.get_level_values(0) else [],
+        'Despesas': format_brl_frame(pivot_fluxo.loc['Despesa']).reset_index().to_dict('records') if not pivot_fluxo.empty and 'Despesa' in pivot_fluxo.index.get_level_values(0) else [],
         'Total_Despesas': prepare_total_dict(total_despesas),
-        'Saldos_Banco': pivot_banco.applymap(format_brl).reset_index().to_dict('records') if not pivot_banco.empty else [],
+        'Saldos_Banco': format_brl_frame(pivot_banco).reset_index().to_dict('records') if not pivot_banco.empty else [],
         'Total_Saldos_Banco': prepare_total_dict(total_bancos),
-        'Gastos_Cartao': pivot_cartao.applymap(format_brl).reset_index().to_dict('records') if not pivot_cartao.empty else [],
+        'Gastos_Cartao': format_brl_frame(pivot_cartao).reset_index().to_dict('records') if not pivot_cartao.empty else [],
         'Total_Gastos_Cartao': prepare_total_dict(total_cartoes)
     }
 
@@ -1316,7 +2331,7 @@ def relatorio_fluxo():
 
 @app.route('/relatorio/saldos')
 def relatorio_saldos():
-    conn = get_db_connection()
+    conn = get_db_leitura()
     data_saldo_str = request.args.get('data_saldo', date.today().strftime('%Y-%m-%d'))
     
     try: 
@@ -1326,52 +2341,17 @@ def relatorio_saldos():
         data_saldo = date.today()
         data_saldo_str = data_saldo.strftime('%Y-%m-%d')
 
-    # Query CORRIGIDA que considera movimentos E transferências
+    # Saldo de cada conta = último saldo acumulado do ledger até a data (busca pontual no índice)
     sql = ''' 
-        SELECT i.id, i.descricao AS instituicao, 
-               (
-                   -- 1. MOVIMENTOS: Soma receitas e despesas efetivadas (sem cartão)
-                   COALESCE(SUM(CASE 
-                       WHEN m.status = 'Efetivado' 
-                       AND m.cartao_id IS NULL 
-                       AND m.data_efetivacao IS NOT NULL 
-                       AND date(m.data_efetivacao) <= date(?) 
-                       THEN m.valor 
-                       ELSE 0 
-                   END), 0)
-                   
-                   +
-                   
-                   -- 2. TRANSFERÊNCIAS RECEBIDAS (entradas na conta)
-                   COALESCE(SUM(CASE 
-                       WHEN t.status = 'Efetivado' 
-                       AND t.conta_destino_id = i.id 
-                       AND t.data_efetivacao IS NOT NULL
-                       AND date(t.data_efetivacao) <= date(?) 
-                       THEN t.valor 
-                       ELSE 0 
-                   END), 0)
-                   
-                   -
-                   
-                   -- 3. TRANSFERÊNCIAS ENVIADAS (saídas da conta)
-                   COALESCE(SUM(CASE 
-                       WHEN t.status = 'Efetivado' 
-                       AND t.conta_origem_id = i.id 
-                       AND t.data_efetivacao IS NOT NULL
-                       AND date(t.data_efetivacao) <= date(?) 
-                       THEN t.valor 
-                       ELSE 0 
-                   END), 0)
-               ) AS saldo
+        SELECT i.id, i.descricao AS instituicao,
+               COALESCE((SELECT s.saldo_centavos FROM saldos_diarios s
+                         WHERE s.instituicao_id = i.id AND s.data <= date(?)
+                         ORDER BY s.data DESC LIMIT 1), 0) AS saldo_centavos
         FROM instituicoes i
-        LEFT JOIN movimentos m ON m.instituicao_id = i.id
-        LEFT JOIN transferencias t ON (t.conta_origem_id = i.id OR t.conta_destino_id = i.id)
-        GROUP BY i.descricao, i.id
         ORDER BY i.descricao
     '''
     
-    params = [data_saldo_str, data_saldo_str, data_saldo_str]
+    params = [data_saldo_str]
     saldos_list = []
     saldo_total = 0.0
     
@@ -1379,14 +2359,13 @@ def relatorio_saldos():
         saldos_calculados = conn.execute(sql, params).fetchall()
         conn.close()
         
-        # Monta a lista final com todos os bancos
+        # Monta a lista final com todos os bancos; o total é somado em centavos
         for saldo_row in saldos_calculados:
-            saldo = saldo_row['saldo']
             saldos_list.append({
                 'instituicao': saldo_row['instituicao'], 
-                'saldo': saldo
+                'saldo': de_centavos(saldo_row['saldo_centavos'])
             })
-            saldo_total += saldo
+        saldo_total = de_centavos(somar_centavos([row['saldo_centavos'] for row in saldos_calculados]))
             
     except Exception as e:
         if conn: 
@@ -1400,520 +2379,178 @@ def relatorio_saldos():
                            data_saldo=data_saldo_str, 
                            saldo_total=saldo_total)
 
-# ==============================================================================
-# ADICIONE esta nova rota ao seu app.py (após as outras rotas de relatório)
-# ==============================================================================
+# Limite de datas por chamada de /api/saldos (10 anos de dias, ou séculos de fins de mês)
+API_SALDOS_MAX_DATAS = 3660
 
-@app.route('/relatorio/extrato')
-def relatorio_extrato():
-    conn = get_db_connection()
-    
-    # Parâmetros de filtro
-    instituicao_id = request.args.get('instituicao_id', type=int)
-    data_inicio = request.args.get('data_inicio')
-    data_fim = request.args.get('data_fim')
-    
-    # Busca lista de instituições para o filtro
-    instituicoes_list = conn.execute('SELECT * FROM instituicoes ORDER BY descricao').fetchall()
-    
-    if not instituicao_id:
+@app.route('/api/saldos')
+@relatorio_em_cache
+def api_saldos():
+    """
+    Saldos de todas as contas em várias datas, para gráficos e fechamentos:
+    /api/saldos?datas=2024-01-31,2024-02-29,... (AAAA-MM-DD, separadas por vírgula ou repetindo datas=).
+    """
+    textos = [t.strip() for valor in request.args.getlist('datas') for t in valor.split(',') if t.strip()]
+    if not textos:
+        return jsonify({'erro': 'Informe as datas em datas=AAAA-MM-DD,AAAA-MM-DD,...'}), 400
+    if len(textos) > API_SALDOS_MAX_DATAS:
+        return jsonify({'erro': f'No máximo {API_SALDOS_MAX_DATAS} datas por consulta.'}), 400
+    try:
+        datas = [datetime.strptime(t, '%Y-%m-%d').date() for t in textos]
+    except ValueError:
+        return jsonify({'erro': 'Data inválida: use o formato AAAA-MM-DD.'}), 400
+
+    conn = get_db_leitura()
+    contas, saldos = saldos_em_datas(conn, datas)
+    conn.close()
+    return jsonify({
+        'datas': [d.isoformat() for d in datas],
+        'contas': [{
+            'id': conta['id'],
+            'instituicao': conta['descricao'],
+            'saldos': [de_centavos(c) for c in linha]
+        } for conta, linha in zip(contas, saldos.tolist())],
+        # Total por data somado em centavos
+        'total': [de_centavos(c) for c in saldos.sum(axis=0).tolist()]
+    })
+
+@app.route('/api/patrimonio')
+@relatorio_em_cache
+def api_patrimonio():
+    """
+    Série do patrimônio para gráficos: /api/patrimonio?inicio=AAAA-MM-DD&fim=AAAA-MM-DD&periodo=mensal|diario.
+    Sem inicio a série começa no primeiro dado; sem fim vai até hoje. Investimentos entram ao custo.
+    """
+    periodo = request.args.get('periodo', 'mensal')
+    if periodo not in ('mensal', 'diario'):
+        return jsonify({'erro': 'periodo deve ser mensal ou diario.'}), 400
+    try:
+        inicio = datetime.strptime(request.args['inicio'], '%Y-%m-%d').date() if request.args.get('inicio') else None
+        fim = datetime.strptime(request.args['fim'], '%Y-%m-%d').date() if request.args.get('fim') else date.today()
+    except ValueError:
+        return jsonify({'erro': 'Data inválida: use o formato AAAA-MM-DD.'}), 400
+
+    conn = get_db_leitura()
+    inicio = inicio or serie_patrimonio.primeiro_dia(conn) or fim
+    if inicio > fim:
         conn.close()
-        return render_template('relatorio_extrato.html', 
-                             instituicoes=instituicoes_list,
-                             movimentacoes=[],
-                             saldo_inicial=0,
-                             saldo_final=0,
-                             total_entradas=0,
-                             total_saidas=0,
-                             instituicao_selecionada=None,
-                             data_inicio=data_inicio,
-                             data_fim=data_fim)
-    
-    # Busca nome da instituição selecionada
-    instituicao_selecionada = conn.execute(
-        'SELECT descricao FROM instituicoes WHERE id = ?', 
-        (instituicao_id,)
-    ).fetchone()
-    
-    # ===== 1. CALCULA SALDO INICIAL =====
-    saldo_inicial = 0.0
-    
-    if data_inicio:
-        # TEM data_inicio: calcula saldo de TUDO que aconteceu ANTES dessa data
-        sql_saldo_inicial = '''
-            SELECT 
-                -- Movimentos (receitas e despesas)
-                COALESCE(SUM(CASE 
-                    WHEN m.status = 'Efetivado' 
-                    AND m.cartao_id IS NULL 
-                    AND m.data_efetivacao IS NOT NULL 
-                    AND date(m.data_efetivacao) < date(?)
-                    AND m.instituicao_id = ?
-                    THEN m.valor 
-                    ELSE 0 
-                END), 0)
-                +
-                -- Transferências RECEBIDAS
-                COALESCE(SUM(CASE 
-                    WHEN t.status = 'Efetivado' 
-                    AND t.conta_destino_id = ?
-                    AND t.data_efetivacao IS NOT NULL
-                    AND date(t.data_efetivacao) < date(?)
-                    THEN t.valor 
-                    ELSE 0 
-                END), 0)
-                -
-                -- Transferências ENVIADAS
-                COALESCE(SUM(CASE 
-                    WHEN t.status = 'Efetivado' 
-                    AND t.conta_origem_id = ?
-                    AND t.data_efetivacao IS NOT NULL
-                    AND date(t.data_efetivacao) < date(?)
-                    THEN t.valor 
-                    ELSE 0 
-                END), 0) as saldo
-            FROM (SELECT 1) dummy
-            LEFT JOIN movimentos m ON 1=1
-            LEFT JOIN transferencias t ON 1=1
-        '''
-        
-        saldo_inicial_row = conn.execute(
-            sql_saldo_inicial, 
-            (data_inicio, instituicao_id, instituicao_id, data_inicio, 
-             instituicao_id, data_inicio)
-        ).fetchone()
-        
-        saldo_inicial = saldo_inicial_row['saldo'] if saldo_inicial_row else 0.0
-        
-    else:
-        # NÃO TEM data_inicio: saldo inicial é 0 (vai mostrar desde o primeiro movimento)
-        saldo_inicial = 0.0
-    
-    # ===== 2. BUSCA MOVIMENTAÇÕES NO PERÍODO =====
-    
-    # 2.1 - MOVIMENTOS (receitas e despesas)
-    sql_movimentos = '''
-        SELECT 
-            m.data_efetivacao as data,
-            m.descricao,
-            'Movimento' as tipo,
-            c.descricao as categoria,
-            c.tipo as categoria_tipo,
-            m.valor,
-            m.compartilhado,
-            NULL as conta_origem,
-            NULL as conta_destino
-        FROM movimentos m
-        JOIN categorias c ON m.categoria_id = c.id
-        WHERE m.instituicao_id = ?
-        AND m.status = 'Efetivado'
-        AND m.cartao_id IS NULL
-        AND m.data_efetivacao IS NOT NULL
-    '''
-    params_mov = [instituicao_id]
-    
-    if data_inicio:
-        sql_movimentos += ' AND date(m.data_efetivacao) >= date(?)'
-        params_mov.append(data_inicio)
-    if data_fim:
-        sql_movimentos += ' AND date(m.data_efetivacao) <= date(?)'
-        params_mov.append(data_fim)
-    
-    movimentos = conn.execute(sql_movimentos, params_mov).fetchall()
-    
-    # 2.2 - TRANSFERÊNCIAS RECEBIDAS
-    sql_transf_recebidas = '''
-        SELECT 
-            t.data_efetivacao as data,
-            t.descricao,
-            'Transferência Recebida' as tipo,
-            NULL as categoria,
-            NULL as categoria_tipo,
-            t.valor,
-            t.compartilhado,
-            io.descricao as conta_origem,
-            NULL as conta_destino
-        FROM transferencias t
-        JOIN instituicoes io ON t.conta_origem_id = io.id
-        WHERE t.conta_destino_id = ?
-        AND t.status = 'Efetivado'
-        AND t.data_efetivacao IS NOT NULL
-    '''
-    params_receb = [instituicao_id]
-    
-    if data_inicio:
-        sql_transf_recebidas += ' AND date(t.data_efetivacao) >= date(?)'
-        params_receb.append(data_inicio)
-    if data_fim:
-        sql_transf_recebidas += ' AND date(t.data_efetivacao) <= date(?)'
-        params_receb.append(data_fim)
-    
-    transf_recebidas = conn.execute(sql_transf_recebidas, params_receb).fetchall()
-    
-    # 2.3 - TRANSFERÊNCIAS ENVIADAS
-    sql_transf_enviadas = '''
-        SELECT 
-            t.data_efetivacao as data,
-            t.descricao,
-            'Transferência Enviada' as tipo,
-            NULL as categoria,
-            NULL as categoria_tipo,
-            -t.valor as valor,
-            t.compartilhado,
-            NULL as conta_origem,
-            CASE 
-                WHEN t.conta_destino_id IS NOT NULL THEN id.descricao
-                WHEN t.cartao_id IS NOT NULL THEN cc.descricao
-                ELSE 'Desconhecido'
-            END as conta_destino
-        FROM transferencias t
-        LEFT JOIN instituicoes id ON t.conta_destino_id = id.id
-        LEFT JOIN cartoes_credito cc ON t.cartao_id = cc.id
-        WHERE t.conta_origem_id = ?
-        AND t.status = 'Efetivado'
-        AND t.data_efetivacao IS NOT NULL
-    '''
-    params_env = [instituicao_id]
-    
-    if data_inicio:
-        sql_transf_enviadas += ' AND date(t.data_efetivacao) >= date(?)'
-        params_env.append(data_inicio)
-    if data_fim:
-        sql_transf_enviadas += ' AND date(t.data_efetivacao) <= date(?)'
-        params_env.append(data_fim)
-    
-    transf_enviadas = conn.execute(sql_transf_enviadas, params_env).fetchall()
-    
+        return jsonify({'erro': 'inicio deve ser anterior a fim.'}), 400
+    dias = dias_da_serie(inicio, fim, periodo)
+    bancos, investimentos = serie_patrimonio.valores(conn, dias)
     conn.close()
-    
-    # ===== 3. UNIFICA E ORDENA TODAS AS MOVIMENTAÇÕES =====
-    todas_movimentacoes = []
-    
-    # Converte para dicionário e adiciona
-    for mov in movimentos:
-        todas_movimentacoes.append({
-            'data': mov['data'],
-            'descricao': mov['descricao'],
-            'tipo': mov['tipo'],
-            'categoria': mov['categoria'],
-            'categoria_tipo': mov['categoria_tipo'],
-            'valor': mov['valor'],
-            'compartilhado': mov['compartilhado'],
-            'origem_destino': None
-        })
-    
-    for transf in transf_recebidas:
-        todas_movimentacoes.append({
-            'data': transf['data'],
-            'descricao': transf['descricao'],
-            'tipo': transf['tipo'],
-            'categoria': None,
-            'categoria_tipo': None,
-            'valor': transf['valor'],
-            'compartilhado': transf['compartilhado'],
-            'origem_destino': f"De: {transf['conta_origem']}"
-        })
-    
-    for transf in transf_enviadas:
-        todas_movimentacoes.append({
-            'data': transf['data'],
-            'descricao': transf['descricao'],
-            'tipo': transf['tipo'],
-            'categoria': None,
-            'categoria_tipo': None,
-            'valor': transf['valor'],
-            'compartilhado': transf['compartilhado'],
-            'origem_destino': f"Para: {transf['conta_destino']}"
-        })
-    
-    # Ordena por data
-    todas_movimentacoes.sort(key=lambda x: x['data'])
-    
-    # ===== 4. CALCULA SALDO PROGRESSIVO E TOTAIS =====
-    saldo_atual = saldo_inicial
-    total_entradas = 0.0
-    total_saidas = 0.0
-    
-    for mov in todas_movimentacoes:
-        if mov['valor'] > 0:
-            total_entradas += mov['valor']
-        else:
-            total_saidas += abs(mov['valor'])
-        
-        saldo_atual += mov['valor']
-        mov['saldo_apos'] = saldo_atual
-        
-        # Formata data para exibição
-        mov['data_formatada'] = datetime.strptime(mov['data'], '%Y-%m-%d').strftime('%d/%m/%Y')
-    
-    saldo_final = saldo_atual
-    
-    return render_template('relatorio_extrato.html',
-                         instituicoes=instituicoes_list,
-                         movimentacoes=todas_movimentacoes,
-                         saldo_inicial=saldo_inicial,
-                         saldo_final=saldo_final,
-                         total_entradas=total_entradas,
-                         total_saidas=total_saidas,
-                         instituicao_selecionada=instituicao_selecionada['descricao'] if instituicao_selecionada else None,
-                         instituicao_id=instituicao_id,
-                         data_inicio=data_inicio,
-                         data_fim=data_fim)
+    return jsonify({
+        'periodo': periodo,
+        'datas': [str(d) for d in dias],
+        'bancos': (bancos / 100).tolist(),
+        'investimentos': (investimentos / 100).tolist(),
+        'patrimonio': ((bancos + investimentos) / 100).tolist()
+    })
 
 # ==============================================================================
-# ADICIONE ESTAS ROTAS AO SEU app.py (após a rota relatorio_extrato existente)
+# ADICIONE esta nova rota ao seu app.py (após as outras rotas de relatório)
 # ==============================================================================
 
-# --- ROTA PARA EXPORTAR EXTRATO BANCÁRIO ---
-@app.route('/relatorio/extrato/exportar')
-def exportar_extrato():
-    """
-    Exporta extrato bancário completo para CSV ou Excel
-    Parâmetros:
-    - formato: 'csv' ou 'excel' (padrão: excel)
-    - instituicao_id: ID da conta bancária (obrigatório)
-    - data_inicio, data_fim: filtros de data (opcional)
-    """
-    
-    instituicao_id = request.args.get('instituicao_id', type=int)
-    
-    if not instituicao_id:
-        flash('Selecione uma conta bancária para exportar o extrato.', 'warning')
-        return redirect(url_for('relatorio_extrato'))
-    
-    conn = get_db_connection()
-    
-    # Parâmetros
-    formato = request.args.get('formato', 'excel').lower()
-    data_inicio = request.args.get('data_inicio')
-    data_fim = request.args.get('data_fim')
-    
-    # Busca nome da instituição
-    instituicao_selecionada = conn.execute(
-        'SELECT descricao FROM instituicoes WHERE id = ?', 
-        (instituicao_id,)
-    ).fetchone()
-    
-    if not instituicao_selecionada:
-        flash('Conta bancária não encontrada.', 'error')
-        conn.close()
-        return redirect(url_for('relatorio_extrato'))
-    
-    instituicao_nome = instituicao_selecionada['descricao']
-    
-    # ===== CALCULA SALDO INICIAL =====
-    saldo_inicial = 0.0
-    
-    if data_inicio:
-        sql_saldo_inicial = '''
-            SELECT 
-                COALESCE(SUM(CASE 
-                    WHEN m.status = 'Efetivado' 
-                    AND m.cartao_id IS NULL 
-                    AND m.data_efetivacao IS NOT NULL 
-                    AND date(m.data_efetivacao) < date(?)
-                    AND m.instituicao_id = ?
-                    THEN m.valor 
-                    ELSE 0 
-                END), 0)
-                +
-                COALESCE(SUM(CASE 
-                    WHEN t.status = 'Efetivado' 
-                    AND t.conta_destino_id = ?
-                    AND t.data_efetivacao IS NOT NULL
-                    AND date(t.data_efetivacao) < date(?)
-                    THEN t.valor 
-                    ELSE 0 
-                END), 0)
-                -
-                COALESCE(SUM(CASE 
-                    WHEN t.status = 'Efetivado' 
-                    AND t.conta_origem_id = ?
-                    AND t.data_efetivacao IS NOT NULL
-                    AND date(t.data_efetivacao) < date(?)
-                    THEN t.valor 
-                    ELSE 0 
-                END), 0) as saldo
-            FROM (SELECT 1) dummy
-            LEFT JOIN movimentos m ON 1=1
-            LEFT JOIN transferencias t ON 1=1
-        '''
-        
-        saldo_inicial_row = conn.execute(
-            sql_saldo_inicial, 
-            (data_inicio, instituicao_id, instituicao_id, data_inicio, 
-             instituicao_id, data_inicio)
-        ).fetchone()
-        
-        saldo_inicial = saldo_inicial_row['saldo'] if saldo_inicial_row else 0.0
-    
-    # ===== BUSCA MOVIMENTAÇÕES =====
-    
-    # Movimentos
-    sql_movimentos = '''
-        SELECT 
-            date(m.data_efetivacao) as data,
-            m.descricao,
-            'Movimento' as tipo,
-            c.descricao as categoria,
-            c.tipo as categoria_tipo,
-            m.valor,
-            m.compartilhado,
-            NULL as origem_destino
-        FROM movimentos m
-        JOIN categorias c ON m.categoria_id = c.id
-        WHERE m.instituicao_id = ?
-        AND m.status = 'Efetivado'
-        AND m.cartao_id IS NULL
-        AND m.data_efetivacao IS NOT NULL
-    '''
-    params_mov = [instituicao_id]
-    
-    if data_inicio:
-        sql_movimentos += ' AND date(m.data_efetivacao) >= date(?)'
-        params_mov.append(data_inicio)
-    if data_fim:
-        sql_movimentos += ' AND date(m.data_efetivacao) <= date(?)'
-        params_mov.append(data_fim)
-    
-    sql_movimentos += ' ORDER BY date(m.data_efetivacao)'
-    
-    movimentos = conn.execute(sql_movimentos, params_mov).fetchall()
-    
-    # Transferências Recebidas
-    sql_recebidas = '''
-        SELECT 
-            date(t.data_efetivacao) as data,
-            t.descricao,
-            'Transferência Recebida' as tipo,
-            NULL as categoria,
-            NULL as categoria_tipo,
-            t.valor,
-            t.compartilhado,
-            io.descricao as origem_destino
-        FROM transferencias t
-        JOIN instituicoes io ON t.conta_origem_id = io.id
-        WHERE t.conta_destino_id = ?
-        AND t.status = 'Efetivado'
-        AND t.data_efetivacao IS NOT NULL
-    '''
-    params_receb = [instituicao_id]
-    
-    if data_inicio:
-        sql_recebidas += ' AND date(t.data_efetivacao) >= date(?)'
-        params_receb.append(data_inicio)
-    if data_fim:
-        sql_recebidas += ' AND date(t.data_efetivacao) <= date(?)'
-        params_receb.append(data_fim)
-    
-    sql_recebidas += ' ORDER BY date(t.data_efetivacao)'
-    
-    transf_recebidas = conn.execute(sql_recebidas, params_receb).fetchall()
+@app.route('/relatorio/extrato')
+def relatorio_extrato():
+    conn = get_db_leitura()
     
-    # Transferências Enviadas
-    sql_enviadas = '''
-        SELECT 
-            date(t.data_efetivacao) as data,
-            t.descricao,
-            'Transferência Enviada' as tipo,
-            NULL as categoria,
-            NULL as categoria_tipo,
-            -t.valor as valor,
-            t.compartilhado,
-            CASE 
-                WHEN t.conta_destino_id IS NOT NULL THEN id.descricao
-                WHEN t.cartao_id IS NOT NULL THEN cc.descricao
-                ELSE 'Desconhecido'
-            END as origem_destino
-        FROM transferencias t
-        LEFT JOIN instituicoes id ON t.conta_destino_id = id.id
-        LEFT JOIN cartoes_credito cc ON t.cartao_id = cc.id
-        WHERE t.conta_origem_id = ?
-        AND t.status = 'Efetivado'
-        AND t.data_efetivacao IS NOT NULL
-    '''
-    params_env = [instituicao_id]
+    # Parâmetros de filtro
+    instituicao_id = request.args.get('instituicao_id', type=int)
+    data_inicio = request.args.get('data_inicio')
+    data_fim = request.args.get('data_fim')
     
-    if data_inicio:
-        sql_enviadas += ' AND date(t.data_efetivacao) >= date(?)'
-        params_env.append(data_inicio)
-    if data_fim:
-        sql_enviadas += ' AND date(t.data_efetivacao) <= date(?)'
-        params_env.append(data_fim)
+    # Busca lista de instituições para o filtro
+    instituicoes_list = conn.execute('SELECT * FROM instituicoes ORDER BY descricao').fetchall()
     
-    sql_enviadas += ' ORDER BY date(t.data_efetivacao)'
+    if not instituicao_id:
+        conn.close()
+        return render_template('relatorio_extrato.html', 
+                             instituicoes=instituicoes_list,
+                             movimentacoes=[],
+                             saldo_inicial=0,
+                             saldo_final=0,
+                             total_entradas=0,
+                             total_saidas=0,
+                             instituicao_selecionada=None,
+                             data_inicio=data_inicio,
+                             data_fim=data_fim)
     
-    transf_enviadas = conn.execute(sql_enviadas, params_env).fetchall()
+    # Busca nome da instituição selecionada
+    instituicao_selecionada = conn.execute(
+        'SELECT descricao FROM instituicoes WHERE id = ?', 
+        (instituicao_id,)
+    ).fetchone()
     
+    # Saldo inicial, lançamentos do período já ordenados com o saldo após cada um, e totais
+    extrato = extrato_conta(conn, instituicao_id, data_inicio, data_fim)
     conn.close()
     
-    # ===== UNIFICA E ORDENA =====
-    todas_movimentacoes = []
+    return render_template('relatorio_extrato.html',
+                         instituicoes=instituicoes_list,
+                         movimentacoes=extrato['movimentacoes'],
+                         saldo_inicial=extrato['saldo_inicial'],
+                         saldo_final=extrato['saldo_final'],
+                         total_entradas=extrato['total_entradas'],
+                         total_saidas=extrato['total_saidas'],
+                         instituicao_selecionada=instituicao_selecionada['descricao'] if instituicao_selecionada else None,
+                         instituicao_id=instituicao_id,
+                         data_inicio=data_inicio,
+                         data_fim=data_fim)
+
+# ==============================================================================
+# ADICIONE ESTAS ROTAS AO SEU app.py (após a rota relatorio_extrato existente)
+# ==============================================================================
+
+# --- ROTA PARA EXPORTAR EXTRATO BANCÁRIO ---
+@app.route('/relatorio/extrato/exportar')
+def exportar_extrato():
+    """
+    Exporta extrato bancário completo para CSV ou Excel
+    Parâmetros:
+    - formato: 'csv' ou 'excel' (padrão: excel)
+    - instituicao_id: ID da conta bancária (obrigatório)
+    - data_inicio, data_fim: filtros de data (opcional)
+    """
+    
+    instituicao_id = request.args.get('instituicao_id', type=int)
     
-    for mov in movimentos:
-        todas_movimentacoes.append({
-            'data': mov['data'],
-            'descricao': mov['descricao'],
-            'tipo': mov['tipo'],
-            'categoria': mov['categoria'],
-            'categoria_tipo': mov['categoria_tipo'],
-            'valor': mov['valor'],
-            'compartilhado': mov['compartilhado'],
-            'origem_destino': None
-        })
+    if not instituicao_id:
+        flash('Selecione uma conta bancária para exportar o extrato.', 'warning')
+        return redirect(url_for('relatorio_extrato'))
     
-    for transf in transf_recebidas:
-        todas_movimentacoes.append({
-            'data': transf['data'],
-            'descricao': transf['descricao'],
-            'tipo': transf['tipo'],
-            'categoria': None,
-            'categoria_tipo': None,
-            'valor': transf['valor'],
-            'compartilhado': transf['compartilhado'],
-            'origem_destino': f"De: {transf['origem_destino']}"
-        })
+    conn = get_db_leitura()
     
-    for transf in transf_enviadas:
-        todas_movimentacoes.append({
-            'data': transf['data'],
-            'descricao': transf['descricao'],
-            'tipo': transf['tipo'],
-            'categoria': None,
-            'categoria_tipo': None,
-            'valor': transf['valor'],
-            'compartilhado': transf['compartilhado'],
-            'origem_destino': f"Para: {transf['origem_destino']}"
-        })
+    # Parâmetros
+    formato = request.args.get('formato', 'excel').lower()
+    data_inicio = request.args.get('data_inicio')
+    data_fim = request.args.get('data_fim')
     
-    todas_movimentacoes.sort(key=lambda x: x['data'])
+    # Busca nome da instituição
+    instituicao_selecionada = conn.execute(
+        'SELECT descricao FROM instituicoes WHERE id = ?', 
+        (instituicao_id,)
+    ).fetchone()
     
-    # ===== CALCULA SALDOS E TOTAIS =====
-    saldo_atual = saldo_inicial
-    total_entradas = 0.0
-    total_saidas = 0.0
+    if not instituicao_selecionada:
+        flash('Conta bancária não encontrada.', 'error')
+        conn.close()
+        return redirect(url_for('relatorio_extrato'))
     
-    for mov in todas_movimentacoes:
-        if mov['valor'] > 0:
-            total_entradas += mov['valor']
-        else:
-            total_saidas += abs(mov['valor'])
-        
-        saldo_atual += mov['valor']
-        mov['saldo_apos'] = saldo_atual
+    instituicao_nome = instituicao_selecionada['descricao']
     
-    saldo_final = saldo_atual
+    # ===== EXTRATO (mesma consulta da tela) =====
+    extrato = extrato_conta(conn, instituicao_id, data_inicio, data_fim)
+    conn.close()
     
     # ===== EXPORTA =====
     if formato == 'excel':
         return _exportar_extrato_excel(
-            todas_movimentacoes, instituicao_nome, saldo_inicial, 
-            saldo_final, total_entradas, total_saidas, data_inicio, data_fim
+            extrato['movimentacoes'], instituicao_nome, extrato['saldo_inicial'],
+            extrato['saldo_final'], extrato['total_entradas'], extrato['total_saidas'], data_inicio, data_fim
         )
     else:
         return _exportar_extrato_csv(
-            todas_movimentacoes, instituicao_nome, saldo_inicial,
-            saldo_final, total_entradas, total_saidas, data_inicio, data_fim
+            extrato['movimentacoes'], instituicao_nome, extrato['saldo_inicial'],
+            extrato['saldo_final'], extrato['total_entradas'], extrato['total_saidas'], data_inicio, data_fim
         )
 
 
@@ -2001,45 +2638,21 @@ def _exportar_extrato_excel(movimentacoes, instituicao, saldo_inicial,
                             data_inicio=None, data_fim=None):
     """Exporta extrato bancário para Excel formatado"""
     
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Extrato Bancário"
-    
-    # Estilos
-    titulo_font = Font(bold=True, size=16, color="1E293B")
-    subtitulo_font = Font(bold=True, size=12, color="475569")
-    header_fill = PatternFill(start_color="10B981", end_color="10B981", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF", size=11)
-    
-    saldo_inicial_fill = PatternFill(start_color="F0F9FF", end_color="F0F9FF", fill_type="solid")
-    saldo_final_fill = PatternFill(start_color="667EEA", end_color="667EEA", fill_type="solid")
-    saldo_final_font = Font(bold=True, color="FFFFFF", size=12)
-    
-    receita_font = Font(color="059669", bold=True)
-    despesa_font = Font(color="DC2626", bold=True)
-    transferencia_font = Font(color="667EEA", bold=True)
-    
-    border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
+    # Cabeçalho e resumo ocupam as 12 primeiras linhas; a tabela começa na 13
+    inicio_dados = 13
+    planilha = PlanilhaExcel("Extrato Bancário", {
+        'A': 12, 'B': 35, 'C': 20, 'D': 20, 'E': 25, 'F': 8, 'G': 15, 'H': 15
+    }, congelar=f'A{inicio_dados}')
+    celula = planilha.celula
     
     # ===== CABEÇALHO DO EXTRATO =====
-    row = 1
-    
     # Título
-    titulo_cell = ws.cell(row=row, column=1, value="EXTRATO BANCÁRIO")
-    titulo_cell.font = titulo_font
-    ws.merge_cells(f'A{row}:I{row}')
-    row += 1
+    row = planilha.linha(celula("EXTRATO BANCÁRIO", 'extrato_titulo'))
+    planilha.mesclar(f'A{row}:I{row}')
     
     # Conta
-    ws.cell(row=row, column=1, value="Conta:").font = Font(bold=True)
-    ws.cell(row=row, column=2, value=instituicao)
-    ws.merge_cells(f'B{row}:I{row}')
-    row += 1
+    row = planilha.linha(celula("Conta:", 'negrito'), instituicao)
+    planilha.mesclar(f'B{row}:I{row}')
     
     # Período
     periodo = 'Todas as movimentações'
@@ -2050,105 +2663,44 @@ def _exportar_extrato_excel(movimentacoes, instituicao, saldo_inicial,
     elif data_fim:
         periodo = f'Até {data_fim}'
     
-    ws.cell(row=row, column=1, value="Período:").font = Font(bold=True)
-    ws.cell(row=row, column=2, value=periodo)
-    ws.merge_cells(f'B{row}:I{row}')
-    row += 2  # Linha em branco
+    row = planilha.linha(celula("Período:", 'negrito'), periodo)
+    planilha.mesclar(f'B{row}:I{row}')
+    planilha.linha()  # Linha em branco
     
     # ===== RESUMO =====
-    ws.cell(row=row, column=1, value="RESUMO").font = subtitulo_font
-    row += 1
-    
-    # Saldo Inicial
-    ws.cell(row=row, column=1, value="Saldo Inicial:").font = Font(bold=True)
-    saldo_ini_cell = ws.cell(row=row, column=2, value=saldo_inicial)
-    saldo_ini_cell.number_format = '#,##0.00'
-    saldo_ini_cell.font = Font(bold=True, color="1E293B")
-    row += 1
-    
-    # Total Entradas
-    ws.cell(row=row, column=1, value="Total Entradas (+):").font = Font(bold=True)
-    entrada_cell = ws.cell(row=row, column=2, value=total_entradas)
-    entrada_cell.number_format = '#,##0.00'
-    entrada_cell.font = receita_font
-    row += 1
-    
-    # Total Saídas
-    ws.cell(row=row, column=1, value="Total Saídas (-):").font = Font(bold=True)
-    saida_cell = ws.cell(row=row, column=2, value=total_saidas)
-    saida_cell.number_format = '#,##0.00'
-    saida_cell.font = despesa_font
-    row += 1
-    
-    # Saldo Final
-    ws.cell(row=row, column=1, value="Saldo Final:").font = Font(bold=True, size=12)
-    saldo_fin_cell = ws.cell(row=row, column=2, value=saldo_final)
-    saldo_fin_cell.number_format = '#,##0.00'
-    saldo_fin_cell.font = saldo_final_font
-    saldo_fin_cell.fill = saldo_final_fill
-    row += 2  # Linha em branco
+    planilha.linha(celula("RESUMO", 'extrato_subtitulo'))
+    planilha.linha(celula("Saldo Inicial:", 'negrito'), celula(saldo_inicial, 'extrato_saldo'))
+    planilha.linha(celula("Total Entradas (+):", 'negrito'), celula(total_entradas, 'extrato_entradas'))
+    planilha.linha(celula("Total Saídas (-):", 'negrito'), celula(total_saidas, 'extrato_saidas'))
+    planilha.linha(celula("Saldo Final:", 'negrito_12'), celula(saldo_final, 'extrato_saldo_final'))
+    planilha.linha()  # Linha em branco
     
     # ===== MOVIMENTAÇÕES =====
-    ws.cell(row=row, column=1, value="MOVIMENTAÇÕES").font = subtitulo_font
-    row += 1
+    planilha.linha(celula("MOVIMENTAÇÕES", 'extrato_subtitulo'))
     
     # Cabeçalho da tabela
     headers = [
         'Data', 'Descrição', 'Tipo', 'Categoria', 'Detalhes',
         'Comp.', 'Valor', 'Saldo'
     ]
-    
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=row, column=col_num, value=header)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        cell.border = border
-    
-    row += 1
-    inicio_dados = row
+    planilha.linha(*(celula(header, 'extrato_cabecalho') for header in headers))
     
     # Linha de Saldo Inicial
-    ws.cell(row=row, column=1, value='').border = border
-    saldo_desc = ws.cell(row=row, column=2, value='SALDO INICIAL')
-    saldo_desc.font = Font(bold=True)
-    saldo_desc.border = border
-    ws.merge_cells(f'B{row}:F{row}')
-    
-    for col in range(3, 7):
-        ws.cell(row=row, column=col).border = border
-    
-    ws.cell(row=row, column=7, value='').border = border
-    
-    saldo_ini_mov = ws.cell(row=row, column=8, value=saldo_inicial)
-    saldo_ini_mov.number_format = '#,##0.00'
-    saldo_ini_mov.font = Font(bold=True)
-    saldo_ini_mov.fill = saldo_inicial_fill
-    saldo_ini_mov.border = border
-    
-    row += 1
+    row = planilha.linha(
+        celula('', 'borda'),
+        celula('SALDO INICIAL', 'extrato_rotulo'),
+        *(celula(None, 'borda') for _ in range(3, 7)),
+        celula('', 'borda'),
+        celula(saldo_inicial, 'extrato_saldo_inicial_linha')
+    )
+    planilha.mesclar(f'B{row}:F{row}')
     
     # Dados das movimentações
     for mov in movimentacoes:
-        # Data
-        ws.cell(row=row, column=1, value=mov['data']).border = border
-        
-        # Descrição
-        ws.cell(row=row, column=2, value=mov['descricao']).border = border
-        
-        # Tipo
-        tipo_cell = ws.cell(row=row, column=3, value=mov['tipo'])
-        tipo_cell.border = border
-        tipo_cell.font = Font(size=9)
-        
         # Categoria
         categoria_texto = mov['categoria'] or ''
         if mov['categoria_tipo']:
             categoria_texto += f" ({mov['categoria_tipo']})"
-        ws.cell(row=row, column=4, value=categoria_texto).border = border
-        
-        # Detalhes
-        ws.cell(row=row, column=5, value=mov['origem_destino'] or '').border = border
         
         # Compartilhado (abreviado)
         comp_abrev = mov['compartilhado']
@@ -2159,68 +2711,26 @@ def _exportar_extrato_excel(movimentacoes, instituicao, saldo_inicial,
         else:
             comp_abrev = '50/50'
         
-        comp_cell = ws.cell(row=row, column=6, value=comp_abrev)
-        comp_cell.border = border
-        comp_cell.alignment = Alignment(horizontal='center')
-        comp_cell.font = Font(size=9)
-        
-        # Valor
-        valor_cell = ws.cell(row=row, column=7, value=mov['valor'])
-        valor_cell.number_format = '#,##0.00'
-        valor_cell.border = border
-        
-        if mov['valor'] > 0:
-            valor_cell.font = receita_font
-        else:
-            valor_cell.font = despesa_font
-        
-        # Saldo
-        saldo_cell = ws.cell(row=row, column=8, value=mov['saldo_apos'])
-        saldo_cell.number_format = '#,##0.00'
-        saldo_cell.border = border
-        saldo_cell.font = Font(bold=True)
-        
-        row += 1
+        planilha.linha(
+            celula(mov['data'], 'borda'),
+            celula(mov['descricao'], 'borda'),
+            celula(mov['tipo'], 'extrato_tipo'),
+            celula(categoria_texto, 'borda'),
+            celula(mov['origem_destino'] or '', 'borda'),
+            celula(comp_abrev, 'extrato_comp'),
+            celula(mov['valor'], 'extrato_valor_entrada' if mov['valor'] > 0 else 'extrato_valor_saida'),
+            celula(mov['saldo_apos'], 'extrato_saldo_linha')
+        )
     
     # Linha de Saldo Final
-    ws.cell(row=row, column=1, value='').border = border
-    saldo_fin_desc = ws.cell(row=row, column=2, value='SALDO FINAL')
-    saldo_fin_desc.font = saldo_final_font
-    saldo_fin_desc.fill = saldo_final_fill
-    saldo_fin_desc.border = border
-    ws.merge_cells(f'B{row}:F{row}')
-    
-    for col in range(3, 7):
-        cell = ws.cell(row=row, column=col)
-        cell.border = border
-        cell.fill = saldo_final_fill
-    
-    ws.cell(row=row, column=7, value='').border = border
-    ws.cell(row=row, column=7).fill = saldo_final_fill
-    
-    saldo_fin_mov = ws.cell(row=row, column=8, value=saldo_final)
-    saldo_fin_mov.number_format = '#,##0.00'
-    saldo_fin_mov.font = saldo_final_font
-    saldo_fin_mov.fill = saldo_final_fill
-    saldo_fin_mov.border = border
-    
-    # Larguras das colunas
-    ws.column_dimensions['A'].width = 12
-    ws.column_dimensions['B'].width = 35
-    ws.column_dimensions['C'].width = 20
-    ws.column_dimensions['D'].width = 20
-    ws.column_dimensions['E'].width = 25
-    ws.column_dimensions['F'].width = 8
-    ws.column_dimensions['G'].width = 15
-    ws.column_dimensions['H'].width = 15
-    
-    # Congela primeira linha da tabela
-    ws.freeze_panes = f'A{inicio_dados}'
-    
-    # Salva
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
+    row = planilha.linha(
+        celula('', 'borda'),
+        celula('SALDO FINAL', 'extrato_final_rotulo'),
+        *(celula(None, 'extrato_final_fundo') for _ in range(3, 7)),
+        celula('', 'extrato_final_fundo'),
+        celula(saldo_final, 'extrato_final_valor')
+    )
+    planilha.mesclar(f'B{row}:F{row}')
     
     # Nome do arquivo
     periodo_nome = ''
@@ -2234,40 +2744,35 @@ def _exportar_extrato_excel(movimentacoes, instituicao, saldo_inicial,
     instituicao_limpa = instituicao.replace(' ', '_').replace('/', '_')
     filename = f"extrato_{instituicao_limpa}{periodo_nome}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
     
-    return send_file(
-        output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        as_attachment=True,
-        download_name=filename
-    )
+    return planilha.resposta(filename)
 
 # --- ROTAS PLACEHOLDER para Dashboards e Relatórios Futuros ---
 @app.route('/dashboard')
 def dashboard():
     # Lógica futura do Dashboard Principal
     # Calculos básicos para o dashboard
-    conn = get_db_connection()
+    conn = get_db_leitura()
     try:
         # 1. Saldo Bancário Atual (simplificado)
-        sql_saldo = ''' SELECT SUM(m.valor) AS saldo_total
+        sql_saldo = ''' SELECT SUM(m.valor_centavos) / 100.0 AS saldo_total
                        FROM movimentos m
                        WHERE m.status = 'Efetivado' AND m.cartao_id IS NULL AND m.data_efetivacao IS NOT NULL
-                         AND date(m.data_efetivacao) <= ? '''
+                         AND m.dia_efetivacao <= date(?) '''
         saldo_bancario_total = conn.execute(sql_saldo, [date.today().strftime('%Y-%m-%d')]).fetchone()['saldo_total'] or 0.0
 
         # 2. Receita vs Despesa (Últimos 6 meses)
         hoje = date.today()
         seis_meses_atras = (hoje - timedelta(days=180)).strftime('%Y-%m-01') # Primeiro dia, 6 meses atrás aprox.
 
-        sql_receita_despesa = '''
-            SELECT strftime('%Y-%m', data_movimento) AS MesAno,
-                   SUM(CASE WHEN c.tipo = 'Receita' THEN m.valor ELSE 0 END) as Receita,
-                   SUM(CASE WHEN c.tipo = 'Despesa' THEN m.valor ELSE 0 END) as Despesa
-            FROM movimentos m JOIN categorias c ON m.categoria_id = c.id
-            WHERE data_movimento >= ?
+        sql_periodo, params_periodo = resumo_mensal_periodo(seis_meses_atras)
+        sql_receita_despesa = f'''
+            SELECT r.mes AS MesAno,
+                   SUM(CASE WHEN c.tipo = 'Receita' THEN r.total_centavos ELSE 0 END) / 100.0 as Receita,
+                   SUM(CASE WHEN c.tipo = 'Despesa' THEN r.total_centavos ELSE 0 END) / 100.0 as Despesa
+            FROM ({sql_periodo}) r JOIN categorias c ON r.categoria_id = c.id
             GROUP BY MesAno ORDER BY MesAno DESC LIMIT 6
         '''
-        receita_despesa_data = conn.execute(sql_receita_despesa, [seis_meses_atras]).fetchall()
+        receita_despesa_data = conn.execute(sql_receita_despesa, params_periodo).fetchall()
         # Preparar dados para Chart.js
         labels_rd = [row['MesAno'] for row in receita_despesa_data]
         receitas_rd = [row['Receita'] for row in receita_despesa_data]
@@ -2276,24 +2781,25 @@ def dashboard():
 
         # 3. Gastos por Categoria (Top 5, Últimos 30 dias)
         trinta_dias_atras = (hoje - timedelta(days=30)).strftime('%Y-%m-%d')
-        sql_top_cat = '''
-            SELECT c.descricao as Categoria, SUM(ABS(m.valor)) as Total
-            FROM movimentos m JOIN categorias c ON m.categoria_id = c.id
-            WHERE c.tipo = 'Despesa' AND m.data_movimento >= ?
+        sql_periodo, params_periodo = resumo_mensal_periodo(trinta_dias_atras)
+        sql_top_cat = f'''
+            SELECT c.descricao as Categoria, SUM(ABS(r.total_centavos)) / 100.0 as Total
+            FROM ({sql_periodo}) r JOIN categorias c ON r.categoria_id = c.id
+            WHERE c.tipo = 'Despesa'
             GROUP BY Categoria ORDER BY Total DESC LIMIT 5
         '''
-        top_categorias_data = conn.execute(sql_top_cat, [trinta_dias_atras]).fetchall()
+        top_categorias_data = conn.execute(sql_top_cat, params_periodo).fetchall()
         labels_cat = [row['Categoria'] for row in top_categorias_data]
         valores_cat = [row['Total'] for row in top_categorias_data]
 
         # 4. Distribuição Compartilhado (Últimos 30 dias)
-        sql_compartilhado = '''
-            SELECT compartilhado, SUM(ABS(m.valor)) as Total
-            FROM movimentos m JOIN categorias c ON m.categoria_id = c.id
-            WHERE c.tipo = 'Despesa' AND m.data_movimento >= ?
-            GROUP BY compartilhado ORDER BY Total DESC
+        sql_compartilhado = f'''
+            SELECT r.compartilhado, SUM(ABS(r.total_centavos)) / 100.0 as Total
+            FROM ({sql_periodo}) r JOIN categorias c ON r.categoria_id = c.id
+            WHERE c.tipo = 'Despesa'
+            GROUP BY r.compartilhado ORDER BY Total DESC
         '''
-        compartilhado_data = conn.execute(sql_compartilhado, [trinta_dias_atras]).fetchall()
+        compartilhado_data = conn.execute(sql_compartilhado, params_periodo).fetchall()
         labels_comp = [row['compartilhado'] for row in compartilhado_data]
         valores_comp = [row['Total'] for row in compartilhado_data]
 
@@ -2331,96 +2837,53 @@ def dashboard():
 # ==============================================================================
 
 @app.route('/dashboard/investimentos')
+@relatorio_em_cache
 def dashboard_investimentos():
-    conn = get_db_connection()
+    import pandas as pd
+    conn = get_db_leitura()
     
-    # ===== 1. BUSCAR TODAS AS OPERAÇÕES DE INVESTIMENTOS =====
-    sql_investimentos = '''
+    # ===== 1. POSIÇÃO ATUAL POR ATIVO =====
+    # Tabela posicoes_investimentos (mantida a cada escrita em investimentos): uma linha por
+    # ticker, instituição e moeda; aqui somadas por ticker, só os ativos ainda em carteira
+    sql_posicoes = '''
         SELECT 
-            i.id,
-            i.data_investimento,
-            i.quantidade,
-            i.valor_unitario,
-            i.valor_total,
-            i.custos,
-            i.taxas,
-            i.irrf,
             t.descricao as ticker,
             t.classe,
-            t.tipo,
-            o.descricao as operacao,
-            o.natureza,
-            m.codigo as moeda
-        FROM investimentos i
-        JOIN tickers t ON i.ticker_id = t.id
-        JOIN operacoes o ON i.operacao_id = o.id
-        JOIN moedas m ON i.moeda_id = m.id
-        ORDER BY i.data_investimento
+            SUM(p.quantidade) as quantidade,
+            SUM(p.valor_investido_centavos) as valor_investido_centavos
+        FROM posicoes_investimentos p
+        JOIN tickers t ON p.ticker_id = t.id
+        GROUP BY p.ticker_id
+        HAVING ROUND(SUM(p.quantidade), 10) > 0
+        ORDER BY t.descricao
     '''
     
-    investimentos_raw = conn.execute(sql_investimentos).fetchall()
-    
-    # ===== 2. CALCULAR POSIÇÃO ATUAL POR ATIVO =====
-    # Agrupa por ticker e calcula saldo de quantidade e valor
     posicoes = {}
+    for pos in conn.execute(sql_posicoes).fetchall():
+        posicoes[pos['ticker']] = {
+            'ticker': pos['ticker'],
+            'classe': pos['classe'],
+            'quantidade': pos['quantidade'],
+            'valor_investido': de_centavos(pos['valor_investido_centavos'])
+        }
     
-    for inv in investimentos_raw:
-        ticker = inv['ticker']
-        classe = inv['classe']
-        natureza = inv['natureza']
-        quantidade = inv['quantidade']
-        valor_total = inv['valor_total']
-        
-        if ticker not in posicoes:
-            posicoes[ticker] = {
-                'ticker': ticker,
-                'classe': classe,
-                'quantidade': 0,
-                'valor_investido': 0,
-                'operacoes': []
-            }
-        
-        # Se é entrada (compra), soma; se é saída (venda), subtrai
-        if natureza == 'Entrada':
-            posicoes[ticker]['quantidade'] += quantidade
-            posicoes[ticker]['valor_investido'] += abs(valor_total)
-        else:  # Saida
-            posicoes[ticker]['quantidade'] -= quantidade
-            posicoes[ticker]['valor_investido'] -= abs(valor_total)
-        
-        posicoes[ticker]['operacoes'].append(inv)
-    
-    # Remove ativos com quantidade zero (vendidos completamente)
-    posicoes = {k: v for k, v in posicoes.items() if v['quantidade'] > 0}
-    
-    # ===== 3. CALCULAR KPIs PRINCIPAIS =====
+    # ===== 2. CALCULAR KPIs PRINCIPAIS =====
     patrimonio_total = sum(pos['valor_investido'] for pos in posicoes.values())
     num_ativos = len(posicoes)
     
-    # SIMULAÇÃO: Para rentabilidade real, você precisaria do preço atual
-    # Por enquanto, vamos usar uma simulação baseada em dados históricos
-    # Em produção, você conectaria com uma API de cotações
-    
-    # Simulação de valorização por classe de ativo
-    valorizacao_simulada = {
-        'Ações': 1.15,  # 15% de valorização
-        'FII': 1.10,     # 10% de valorização
-        'Renda Fixa': 1.12,  # 12% de valorização
-        'Criptomoeda': 1.20  # 20% de valorização
-    }
-    
-    valor_atual_total = 0
-    for pos in posicoes.values():
-        classe = pos['classe']
-        fator = valorizacao_simulada.get(classe, 1.0)
-        pos['valor_atual'] = pos['valor_investido'] * fator
-        pos['rentabilidade'] = ((pos['valor_atual'] / pos['valor_investido']) - 1) * 100 if pos['valor_investido'] > 0 else 0
-        pos['preco_medio'] = pos['valor_investido'] / pos['quantidade'] if pos['quantidade'] > 0 else 0
-        valor_atual_total += pos['valor_atual']
+    # Valor de mercado pela última cotação carregada em /precos, todas as posições de uma vez
+    hoje = date.today()
+    lista = list(posicoes.values())
+    valor_atual, rentabilidade, preco_medio, tem_cotacao = marcar_a_mercado(
+        conn, [p['ticker'] for p in lista], [p['quantidade'] for p in lista], [p['valor_investido'] for p in lista], hoje)
+    for pos, atual, rent, medio, cotado in zip(lista, valor_atual.tolist(), rentabilidade.tolist(),
+                                               preco_medio.tolist(), tem_cotacao.tolist()):
+        pos.update(valor_atual=atual, rentabilidade=rent, preco_medio=medio, tem_cotacao=cotado)
+    valor_atual_total = float(valor_atual.sum())
     
     rentabilidade_total = ((valor_atual_total / patrimonio_total) - 1) * 100 if patrimonio_total > 0 else 0
     
-    # ===== 4. ALOCAÇÃO POR CLASSE =====
+    # ===== 3. ALOCAÇÃO POR CLASSE =====
     alocacao_por_classe = {}
     for pos in posicoes.values():
         classe = pos['classe']
@@ -2431,7 +2894,7 @@ def dashboard_investimentos():
     alocacao_labels = list(alocacao_por_classe.keys())
     alocacao_valores = list(alocacao_por_classe.values())
     
-    # ===== 5. TOP 5 ATIVOS POR RENTABILIDADE =====
+    # ===== 4. TOP 5 ATIVOS POR RENTABILIDADE =====
     lista_posicoes = list(posicoes.values())
     lista_posicoes.sort(key=lambda x: x['rentabilidade'], reverse=True)
     top_5_ativos = lista_posicoes[:5]
@@ -2439,37 +2902,27 @@ def dashboard_investimentos():
     top_5_labels = [p['ticker'] for p in top_5_ativos]
     top_5_valores = [p['rentabilidade'] for p in top_5_ativos]
     
-    # ===== 6. EVOLUÇÃO DO PATRIMÔNIO (últimos 12 meses) =====
-    # Calcula patrimônio acumulado mês a mês
-    data_12_meses = (datetime.now() - pd.DateOffset(months=12)).strftime('%Y-%m-%d')
-    
-    sql_evolucao = '''
-        SELECT 
-            strftime('%Y-%m', i.data_investimento) as mes,
-            SUM(CASE WHEN o.natureza = 'Entrada' THEN i.valor_total ELSE -i.valor_total END) as valor_liquido
-        FROM investimentos i
-        JOIN operacoes o ON i.operacao_id = o.id
-        WHERE i.data_investimento >= ?
-        GROUP BY mes
-        ORDER BY mes
-    '''
-    
-    df_evolucao = pd.read_sql_query(sql_evolucao, conn, params=[data_12_meses])
+    # ===== 5. EVOLUÇÃO DO PATRIMÔNIO (últimos 12 meses) =====
+    # Posição investida (ao custo) no fim de cada mês, da série do patrimônio; o mês atual vai até hoje
+    dias_evolucao = dias_da_serie((hoje - pd.DateOffset(months=11)).date(), hoje, 'mensal')
+    _, investido = serie_patrimonio.valores(conn, dias_evolucao)
     
-    if not df_evolucao.empty:
-        df_evolucao['acumulado'] = df_evolucao['valor_liquido'].cumsum()
-        evolucao_labels = [datetime.strptime(m, '%Y-%m').strftime('%b/%y') for m in df_evolucao['mes'].tolist()]
-        evolucao_valores = df_evolucao['acumulado'].tolist()
+    if investido.any():
+        evolucao_labels = [d.item().strftime('%b/%y') for d in dias_evolucao]
+        evolucao_valores = (investido / 100).tolist()
     else:
         evolucao_labels = []
         evolucao_valores = []
     
+    # ===== 6. BENCHMARKS (últimos 12 meses) =====
+    benchmarks = variacao_benchmarks(conn, (hoje - pd.DateOffset(months=12)).date(), hoje)
+    
     # ===== 7. DIVIDENDOS RECEBIDOS =====
     # Busca operações de dividendos (você precisa ter uma operação tipo "Dividendo")
     sql_dividendos = '''
         SELECT 
             strftime('%Y-%m', i.data_investimento) as mes,
-            SUM(ABS(i.valor_total)) as total
+            SUM(ABS(i.valor_total_centavos)) / 100.0 as total
         FROM investimentos i
         JOIN operacoes o ON i.operacao_id = o.id
         WHERE o.descricao LIKE '%Dividendo%' OR o.descricao LIKE '%Rendimento%'
@@ -2503,7 +2956,8 @@ def dashboard_investimentos():
             'valor_atual': format_brl(pos['valor_atual']),
             'rentabilidade': f"{pos['rentabilidade']:.1f}%",
             'rentabilidade_num': pos['rentabilidade'],
-            'percentual_carteira': f"{percentual_carteira:.1f}%"
+            'percentual_carteira': f"{percentual_carteira:.1f}%",
+            'tem_cotacao': pos['tem_cotacao']
         })
     
     conn.close()
@@ -2532,14 +2986,12 @@ def dashboard_investimentos():
         
         'tabela_posicoes': tabela_posicoes,
         
-        # Benchmarks (você pode atualizar esses valores periodicamente)
-        'cdi_12m': 13.65,
-        'ipca_12m': 4.51,
-        'ibov_12m': 12.8,
+        # Benchmarks (séries CDI, IPCA e IBOV de /precos)
+        **benchmarks,
         
         # Status vs benchmarks
-        'vs_cdi': rentabilidade_total - 13.65,
-        'vs_ibov': rentabilidade_total - 12.8
+        'vs_cdi': rentabilidade_total - benchmarks['cdi_12m'],
+        'vs_ibov': rentabilidade_total - benchmarks['ibov_12m']
     }
     
     return render_template('dashboard_investimentos.html', **dados)
@@ -2549,35 +3001,52 @@ def dashboard_investimentos():
 # ==============================================================================
 
 @app.route('/relatorio/tendencias')
+@relatorio_em_cache
 def relatorio_tendencias():
-    conn = get_db_connection()
+    import pandas as pd
+    conn = get_db_leitura()
     
     # Parâmetros de filtro
     periodo_meses = int(request.args.get('periodo', 12))
     compartilhado = request.args.get('compartilhado', 'Todos')
     
     # Filtro de compartilhado
-    where_compartilhado = "" if compartilhado == 'Todos' else f"AND m.compartilhado = '{compartilhado}'"
+    where_compartilhado = "" if compartilhado == 'Todos' else "AND r.compartilhado = ?"
+    params_compartilhado = [] if compartilhado == 'Todos' else [compartilhado]
     
     hoje = datetime.now()
     data_inicio = (hoje - pd.DateOffset(months=periodo_meses)).strftime('%Y-%m-%d')
-    
-    # ===== 1. BUSCAR MOVIMENTOS EFETIVADOS =====
-    sql_movimentos = f'''
-        SELECT 
-            m.data_movimento,
-            m.valor,
-            c.descricao as categoria,
-            c.tipo
-        FROM movimentos m
-        JOIN categorias c ON m.categoria_id = c.id
-        WHERE m.status = 'Efetivado'
-        AND m.data_movimento >= ?
-        {where_compartilhado}
-        ORDER BY m.data_movimento
-    '''
-    
-    df = pd.read_sql_query(sql_movimentos, conn, params=[data_inicio], parse_dates=['data_movimento'])
+    # Os recortes de 3 e 12 meses comparam com o instante atual, então começam no dia seguinte
+    inicio_3_meses = max(data_inicio, ((hoje - pd.DateOffset(months=3)).date() + timedelta(days=1)).strftime('%Y-%m-%d'))
+    inicio_12_meses = max(data_inicio, ((hoje - pd.DateOffset(months=12)).date() + timedelta(days=1)).strftime('%Y-%m-%d'))
+    
+    # ===== 1. TOTAIS MENSAIS EFETIVADOS POR CATEGORIA (cubo mensal) =====
+    def totais_mensais(desde):
+        sql_periodo, params_periodo = resumo_mensal_periodo(desde)
+        return pd.read_sql_query(f'''
+            SELECT 
+                r.mes as mes_str,
+                c.descricao as categoria,
+                c.tipo,
+                SUM(r.total_centavos) as total_centavos,
+                SUM(r.quantidade) as quantidade
+            FROM ({sql_periodo}) r
+            JOIN categorias c ON r.categoria_id = c.id
+            WHERE r.status = 'Efetivado'
+            {where_compartilhado}
+            GROUP BY r.mes, c.descricao, c.tipo
+            ORDER BY r.mes
+        ''', conn, params=params_periodo + params_compartilhado)
+    
+    def despesas(df_totais):
+        df_despesas = df_totais[df_totais['tipo'] == 'Despesa'].copy()
+        df_despesas['valor'] = df_despesas['total_centavos'].abs() / 100
+        df_despesas['mes'] = pd.PeriodIndex(df_despesas['mes_str'], freq='M')
+        return df_despesas
+    
+    df = totais_mensais(data_inicio)
+    df_3_meses = totais_mensais(inicio_3_meses)
+    df_12_meses = totais_mensais(inicio_12_meses)
     conn.close()
     
     if df.empty:
@@ -2586,28 +3055,23 @@ def relatorio_tendencias():
                              periodo=periodo_meses,
                              compartilhado=compartilhado)
     
-    # Filtrar apenas despesas para análises
-    df_despesas = df[df['tipo'] == 'Despesa'].copy()
-    df_despesas['valor'] = df_despesas['valor'].abs()
-    df_despesas['mes'] = df_despesas['data_movimento'].dt.to_period('M')
-    df_despesas['mes_str'] = df_despesas['data_movimento'].dt.strftime('%Y-%m')
+    # Filtrar apenas despesas para análises (uma linha por mês e categoria)
+    df_despesas = despesas(df)
     
     # ===== 2. CALCULAR PREVISÃO PRÓXIMO MÊS =====
     media_mensal = df_despesas.groupby('mes')['valor'].sum().mean()
     desvio_padrao = df_despesas.groupby('mes')['valor'].sum().std()
     
     # Últimos 3 meses têm peso maior
-    ultimos_3_meses = df_despesas[df_despesas['data_movimento'] >= (hoje - pd.DateOffset(months=3))]
+    ultimos_3_meses = despesas(df_3_meses)
     media_recente = ultimos_3_meses.groupby('mes')['valor'].sum().mean() if not ultimos_3_meses.empty else media_mensal
     
     # Previsão: 70% peso na média recente, 30% na média geral
     previsao_proximo_mes = (media_recente * 0.7) + (media_mensal * 0.3)
     
     # ===== 3. EVOLUÇÃO POR CATEGORIA (últimos 12 meses) =====
-    df_12_meses = df_despesas[df_despesas['data_movimento'] >= (hoje - pd.DateOffset(months=12))]
-    
     pivot_categorias = pd.pivot_table(
-        df_12_meses,
+        despesas(df_12_meses),
         values='valor',
         index='categoria',
         columns='mes_str',
@@ -2653,11 +3117,12 @@ def relatorio_tendencias():
     # Gastos do mês atual por categoria
     gastos_mes_atual = df_despesas[df_despesas['mes'] == mes_atual].groupby('categoria')['valor'].sum()
     
-    # Média dos 6 meses anteriores
-    meses_anteriores = df_despesas[
+    # Média (por lançamento) dos 6 meses anteriores: soma / quantidade de lançamentos
+    somas_anteriores = df_despesas[
         (df_despesas['mes'] < mes_atual) & 
         (df_despesas['mes'] >= (mes_atual - 6))
-    ].groupby('categoria')['valor'].mean()
+    ].groupby('categoria')[['valor', 'quantidade']].sum()
+    meses_anteriores = somas_anteriores['valor'] / somas_anteriores['quantidade']
     
     # Calcular variação
     categorias_variacao = []
@@ -2684,8 +3149,8 @@ def relatorio_tendencias():
     top_reducao.reverse()
     
     # ===== 6. COMPARATIVO ANO A ANO =====
-    df_despesas['ano'] = df_despesas['data_movimento'].dt.year
-    df_despesas['mes_num'] = df_despesas['data_movimento'].dt.month
+    df_despesas['ano'] = df_despesas['mes'].dt.year
+    df_despesas['mes_num'] = df_despesas['mes'].dt.month
     
     anos_disponiveis = df_despesas['ano'].unique()
     
@@ -2713,6 +3178,7 @@ def relatorio_tendencias():
     comparativo_labels = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez']
     
     # ===== 7. ANÁLISE DETALHADA POR CATEGORIA =====
+    # Estatísticas sobre os totais mensais da categoria (média, menor e maior mês)
     analise_categorias = []
     
     for cat in totais_categoria.head(5).index:
@@ -2723,7 +3189,7 @@ def relatorio_tendencias():
         maximo = gastos_cat.max()
         variacao_pct = ((maximo - minimo) / media * 100) if media > 0 else 0
         
-        # Tendência: comparar primeiros 50% com últimos 50%
+        # Tendência: comparar primeiros 50% dos meses com últimos 50%
         meio = len(gastos_cat) // 2
         primeira_metade = gastos_cat.iloc[:meio].mean() if meio > 0 else 0
         segunda_metade = gastos_cat.iloc[meio:].mean() if meio > 0 else 0
@@ -2910,7 +3376,7 @@ def add_transferencia():
             return redirect(url_for('transferencias'))
     
     try:
-        valor = float(valor_str)
+        valor_centavos = para_centavos(valor_str)
     except ValueError:
         flash('Valor inválido.', 'error')
         return redirect(url_for('transferencias'))
@@ -2919,15 +3385,16 @@ def add_transferencia():
         data_efetivacao = data_transferencia
     
     try:
-        conn.execute('''
-            INSERT INTO transferencias 
-            (data_transferencia, data_efetivacao, descricao, conta_origem_id, conta_destino_id, 
-             cartao_id, valor, status, tipo_transferencia, compartilhado)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (data_transferencia, data_efetivacao, descricao, conta_origem_id, conta_destino_id,
-              cartao_id, valor, status, tipo_transferencia, compartilhado))
+        with transacao_escrita(conn):
+            cur = conn.execute('''
+                INSERT INTO transferencias 
+                (data_transferencia, data_efetivacao, descricao, conta_origem_id, conta_destino_id, 
+                 cartao_id, valor_centavos, status, tipo_transferencia, compartilhado)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (data_transferencia, data_efetivacao, descricao, conta_origem_id, conta_destino_id,
+                  cartao_id, valor_centavos, status, tipo_transferencia, compartilhado))
+            ledger_transferencia(conn, conn.execute('SELECT * FROM transferencias WHERE id = ?', (cur.lastrowid,)).fetchone())
         
-        conn.commit()
         flash('Transferência cadastrada com sucesso!', 'success')
     except sqlite3.Error as e:
         flash(f'Erro ao cadastrar transferência: {e}', 'error')
@@ -2967,7 +3434,7 @@ def edit_transferencia(id):
                 return redirect(url_for('edit_transferencia', id=id))
         
         try:
-            valor = float(valor_str)
+            valor_centavos = para_centavos(valor_str)
         except ValueError:
             flash('Valor inválido.', 'error')
             return redirect(url_for('edit_transferencia', id=id))
@@ -2975,16 +3442,18 @@ def edit_transferencia(id):
         if status == 'Efetivado' and not data_efetivacao:
             data_efetivacao = data_transferencia
         
-        conn.execute('''
-            UPDATE transferencias 
-            SET data_transferencia = ?, data_efetivacao = ?, descricao = ?, 
-                conta_origem_id = ?, conta_destino_id = ?, cartao_id = ?, valor = ?, 
-                status = ?, tipo_transferencia = ?, compartilhado = ?
-            WHERE id = ?
-        ''', (data_transferencia, data_efetivacao, descricao, conta_origem_id, conta_destino_id,
-              cartao_id, valor, status, tipo_transferencia, compartilhado, id))
+        with transacao_escrita(conn):
+            ledger_transferencia(conn, conn.execute('SELECT * FROM transferencias WHERE id = ?', (id,)).fetchone(), sinal=-1)
+            conn.execute('''
+                UPDATE transferencias 
+                SET data_transferencia = ?, data_efetivacao = ?, descricao = ?, 
+                    conta_origem_id = ?, conta_destino_id = ?, cartao_id = ?, valor_centavos = ?, 
+                    status = ?, tipo_transferencia = ?, compartilhado = ?
+                WHERE id = ?
+            ''', (data_transferencia, data_efetivacao, descricao, conta_origem_id, conta_destino_id,
+                  cartao_id, valor_centavos, status, tipo_transferencia, compartilhado, id))
+            ledger_transferencia(conn, conn.execute('SELECT * FROM transferencias WHERE id = ?', (id,)).fetchone())
         
-        conn.commit()
         conn.close()
         return redirect(url_for('transferencias'))
     
@@ -3005,8 +3474,9 @@ def edit_transferencia(id):
 def delete_transferencia(id):
     conn = get_db_connection()
     try:
-        conn.execute('DELETE FROM transferencias WHERE id = ?', (id,))
-        conn.commit()
+        with transacao_escrita(conn):
+            ledger_transferencia(conn, conn.execute('SELECT * FROM transferencias WHERE id = ?', (id,)).fetchone(), sinal=-1)
+            conn.execute('DELETE FROM transferencias WHERE id = ?', (id,))
         flash('Transferência excluída.', 'success')
     except sqlite3.Error as e:
         flash(f'Erro ao excluir: {e}', 'error')
@@ -3029,7 +3499,7 @@ def exportar_transferencias():
     - tipo_transferencia, status, compartilhado: filtros adicionais (opcional)
     - conta_origem_id, conta_destino_id: filtros por conta (opcional)
     """
-    conn = get_db_connection()
+    conn = get_db_leitura()
     
     # Parâmetros de filtro
     formato = request.args.get('formato', 'csv').lower()
@@ -3094,30 +3564,29 @@ def exportar_transferencias():
     
     sql += ' ORDER BY t.data_transferencia DESC, t.id DESC'
     
-    # Busca dados
-    transferencias = conn.execute(sql, params).fetchall()
-    conn.close()
+    # Busca dados em lotes; o primeiro lote já diz se há algo para exportar
+    lotes = _lotes_cursor(conn.execute(sql, params))
+    primeiro_lote = next(lotes, None)
     
-    if not transferencias:
+    if not primeiro_lote:
+        conn.close()
         flash('Nenhuma transferência encontrada para exportação.', 'warning')
         return redirect(url_for('transferencias'))
     
+    lotes = itertools.chain([primeiro_lote], lotes)
+    
     # Exporta no formato escolhido
     if formato == 'excel':
-        return _exportar_transferencias_excel(transferencias, data_inicio, data_fim)
+        return _exportar_transferencias_excel(lotes, data_inicio, data_fim)
     else:
-        return _exportar_transferencias_csv(transferencias, data_inicio, data_fim)
+        return _exportar_transferencias_csv(lotes, data_inicio, data_fim)
 
 
-def _exportar_transferencias_csv(transferencias, data_inicio=None, data_fim=None):
-    """Exporta transferências para CSV"""
-    
-    # Cria buffer de memória
-    output = StringIO()
-    writer = csv.writer(output, delimiter=';', quoting=csv.QUOTE_MINIMAL)
+def _exportar_transferencias_csv(lotes, data_inicio=None, data_fim=None):
+    """Exporta transferências para CSV (em streaming, a partir dos lotes do cursor)"""
     
     # Cabeçalho
-    writer.writerow([
+    cabecalho = [
         'ID',
         'Data Transferência',
         'Data Efetivação',
@@ -3129,10 +3598,10 @@ def _exportar_transferencias_csv(transferencias, data_inicio=None, data_fim=None
         'Valor',
         'Status',
         'Compartilhado'
-    ])
+    ]
     
     # Dados
-    for transf in transferencias:
+    def formatar(transf):
         # Define destino baseado no tipo
         destino = ''
         if transf['tipo_transferencia'] == 'Pagamento Fatura':
@@ -3140,7 +3609,7 @@ def _exportar_transferencias_csv(transferencias, data_inicio=None, data_fim=None
         else:
             destino = transf['conta_destino'] or ''
         
-        writer.writerow([
+        return [
             transf['id'],
             transf['data_transferencia'],
             transf['data_efetivacao'] or '',
@@ -3152,10 +3621,7 @@ def _exportar_transferencias_csv(transferencias, data_inicio=None, data_fim=None
             f"{transf['valor']:.2f}".replace('.', ','),
             transf['status'],
             transf['compartilhado']
-        ])
-    
-    # Prepara resposta
-    output.seek(0)
+        ]
     
     # Nome do arquivo com período
     periodo = ''
@@ -3168,103 +3634,14 @@ def _exportar_transferencias_csv(transferencias, data_inicio=None, data_fim=None
     
     filename = f"transferencias{periodo}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
     
-    response = make_response(output.getvalue())
-    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
-    response.headers['Content-Type'] = 'text/csv; charset=utf-8-sig'
-    
-    return response
+    return _csv_streaming(cabecalho, lotes, formatar, filename)
 
 
-def _exportar_transferencias_excel(transferencias, data_inicio=None, data_fim=None):
-    """Exporta transferências para Excel com formatação"""
-    
-    # Cria workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Transferências"
-    
-    # Estilos
-    header_fill = PatternFill(start_color="667EEA", end_color="667EEA", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF", size=11)
-    border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
-    
-    # Cabeçalho
-    headers = [
-        'ID', 'Data Transf.', 'Data Efetiv.', 'Descrição', 'Tipo',
-        'Conta Origem', 'Destino', 'Valor', 'Status', 'Compartilhado'
-    ]
-    
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_num, value=header)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        cell.border = border
-    
-    # Dados
-    for row_num, transf in enumerate(transferencias, 2):
-        # ID
-        ws.cell(row=row_num, column=1, value=transf['id']).border = border
-        
-        # Datas
-        ws.cell(row=row_num, column=2, value=transf['data_transferencia']).border = border
-        ws.cell(row=row_num, column=3, value=transf['data_efetivacao'] or '').border = border
-        
-        # Descrição
-        ws.cell(row=row_num, column=4, value=transf['descricao']).border = border
-        
-        # Tipo - com cores
-        tipo_cell = ws.cell(row=row_num, column=5, value=transf['tipo_transferencia'])
-        tipo_cell.border = border
-        
-        if transf['tipo_transferencia'] == 'Pagamento Fatura':
-            tipo_cell.fill = PatternFill(start_color="FEF3C7", end_color="FEF3C7", fill_type="solid")
-            tipo_cell.font = Font(color="92400E", bold=True)
-        elif transf['tipo_transferencia'] == 'Para Investimento':
-            tipo_cell.fill = PatternFill(start_color="DBEAFE", end_color="DBEAFE", fill_type="solid")
-            tipo_cell.font = Font(color="1E40AF", bold=True)
-        elif transf['tipo_transferencia'] == 'De Investimento':
-            tipo_cell.fill = PatternFill(start_color="D1FAE5", end_color="D1FAE5", fill_type="solid")
-            tipo_cell.font = Font(color="065F46", bold=True)
-        
-        # Conta Origem
-        ws.cell(row=row_num, column=6, value=transf['conta_origem']).border = border
-        
-        # Destino (conta ou cartão)
-        if transf['tipo_transferencia'] == 'Pagamento Fatura':
-            destino_valor = f"💳 {transf['cartao']}" if transf['cartao'] else ''
-        else:
-            destino_valor = transf['conta_destino'] or ''
-        
-        ws.cell(row=row_num, column=7, value=destino_valor).border = border
-        
-        # Valor com formatação
-        valor_cell = ws.cell(row=row_num, column=8, value=transf['valor'])
-        valor_cell.number_format = '#,##0.00'
-        valor_cell.border = border
-        valor_cell.font = Font(color="667EEA", bold=True)
-        
-        # Status
-        status_cell = ws.cell(row=row_num, column=9, value=transf['status'])
-        status_cell.border = border
-        
-        if transf['status'] == 'Efetivado':
-            status_cell.fill = PatternFill(start_color="D1FAE5", end_color="D1FAE5", fill_type="solid")
-            status_cell.font = Font(color="065F46", bold=True)
-        else:
-            status_cell.fill = PatternFill(start_color="FEF3C7", end_color="FEF3C7", fill_type="solid")
-            status_cell.font = Font(color="92400E")
-        
-        # Compartilhado
-        ws.cell(row=row_num, column=10, value=transf['compartilhado']).border = border
+def _exportar_transferencias_excel(lotes, data_inicio=None, data_fim=None):
+    """Exporta transferências para Excel com formatação (lotes do cursor gravados direto na planilha)"""
     
-    # Ajusta largura das colunas
-    column_widths = {
+    # Larguras das colunas e primeira linha congelada
+    planilha = PlanilhaExcel("Transferências", {
         'A': 8,   # ID
         'B': 14,  # Data Transf.
         'C': 14,  # Data Efetiv.
@@ -3275,51 +3652,65 @@ def _exportar_transferencias_excel(transferencias, data_inicio=None, data_fim=No
         'H': 15,  # Valor
         'I': 12,  # Status
         'J': 15   # Compartilhado
-    }
-    
-    for col, width in column_widths.items():
-        ws.column_dimensions[col].width = width
+    }, congelar='A2')
+    celula = planilha.celula
     
-    # Congela primeira linha
-    ws.freeze_panes = 'A2'
+    # Cabeçalho
+    headers = [
+        'ID', 'Data Transf.', 'Data Efetiv.', 'Descrição', 'Tipo',
+        'Conta Origem', 'Destino', 'Valor', 'Status', 'Compartilhado'
+    ]
+    planilha.linha(*(celula(header, 'transferencias_cabecalho') for header in headers))
     
-    # Adiciona totalizadores
-    ultima_linha = len(transferencias) + 2
+    # Tipo - com cores
+    estilos_tipo = {
+        'Pagamento Fatura': 'transferencias_fatura',
+        'Para Investimento': 'transferencias_para_investimento',
+        'De Investimento': 'transferencias_de_investimento',
+    }
     
-    ws.cell(row=ultima_linha, column=7, value='TOTAL TRANSFERIDO:').font = Font(bold=True)
-    ws.cell(row=ultima_linha, column=7).alignment = Alignment(horizontal='right')
+    # Dados (acumulando o total por tipo para as estatísticas)
+    tipos = {}
+    for lote in lotes:
+        for transf in lote:
+            tipo = transf['tipo_transferencia']
+            tipos[tipo] = tipos.get(tipo, 0) + transf['valor']
+            
+            # Destino (conta ou cartão)
+            if tipo == 'Pagamento Fatura':
+                destino_valor = f"💳 {transf['cartao']}" if transf['cartao'] else ''
+            else:
+                destino_valor = transf['conta_destino'] or ''
+            
+            planilha.linha(
+                celula(transf['id'], 'borda'),
+                celula(transf['data_transferencia'], 'borda'),
+                celula(transf['data_efetivacao'] or '', 'borda'),
+                celula(transf['descricao'], 'borda'),
+                celula(tipo, estilos_tipo.get(tipo, 'borda')),
+                celula(transf['conta_origem'], 'borda'),
+                celula(destino_valor, 'borda'),
+                celula(transf['valor'], 'transferencias_valor'),
+                celula(transf['status'], 'transferencias_efetivado' if transf['status'] == 'Efetivado' else 'transferencias_pendente'),
+                celula(transf['compartilhado'], 'borda')
+            )
     
-    total_formula = f'=SUM(H2:H{ultima_linha-1})'
-    total_cell = ws.cell(row=ultima_linha, column=8, value=total_formula)
-    total_cell.font = Font(bold=True, size=12, color="667EEA")
-    total_cell.number_format = '#,##0.00'
-    total_cell.fill = PatternFill(start_color="F0F0F0", end_color="F0F0F0", fill_type="solid")
-    total_cell.border = border
+    # Adiciona totalizadores
+    ultima_linha = planilha.linha_atual + 1
+    planilha.linha(
+        *([None] * 6),
+        celula('TOTAL TRANSFERIDO:', 'total_rotulo'),
+        celula(f'=SUM(H2:H{ultima_linha-1})', 'transferencias_total')
+    )
+    planilha.linha()
     
     # Adiciona estatísticas extras
-    stats_row = ultima_linha + 2
-    
-    ws.cell(row=stats_row, column=1, value='ESTATÍSTICAS:').font = Font(bold=True, size=11)
-    ws.merge_cells(f'A{stats_row}:J{stats_row}')
+    stats_row = planilha.linha(celula('ESTATÍSTICAS:', 'negrito_11'))
+    planilha.mesclar(f'A{stats_row}:J{stats_row}')
     
     # Total por tipo
-    tipos = {}
-    for transf in transferencias:
-        tipo = transf['tipo_transferencia']
-        if tipo not in tipos:
-            tipos[tipo] = 0
-        tipos[tipo] += transf['valor']
-    
-    stat_row = stats_row + 1
     for tipo, total in tipos.items():
-        ws.cell(row=stat_row, column=1, value=f'{tipo}:').font = Font(bold=True)
-        ws.cell(row=stat_row, column=2, value=total).number_format = '#,##0.00'
-        stat_row += 1
-    
-    # Salva em buffer
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
+        planilha.linha(celula(f'{tipo}:', 'negrito'), celula(total, 'moeda'))
     
     # Nome do arquivo
     periodo = ''
@@ -3332,12 +3723,7 @@ def _exportar_transferencias_excel(transferencias, data_inicio=None, data_fim=No
     
     filename = f"transferencias{periodo}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
     
-    return send_file(
-        output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        as_attachment=True,
-        download_name=filename
-    )
+    return planilha.resposta(filename)
 
 
 # --- ROTA PARA EXPORTAR FLUXO ENTRE CONTAS ---
@@ -3347,7 +3733,7 @@ def exportar_fluxo_contas():
     Exporta análise de fluxo entre contas
     Mostra quanto foi transferido de cada conta para cada conta
     """
-    conn = get_db_connection()
+    conn = get_db_leitura()
     
     # Parâmetros
     data_inicio = request.args.get('data_inicio')
@@ -3360,7 +3746,7 @@ def exportar_fluxo_contas():
             io.descricao as origem,
             id.descricao as destino,
             t.tipo_transferencia,
-            SUM(t.valor) as total,
+            SUM(t.valor_centavos) / 100.0 as total,
             COUNT(*) as quantidade
         FROM transferencias t
         JOIN instituicoes io ON t.conta_origem_id = io.id
@@ -3423,55 +3809,33 @@ def _exportar_fluxo_csv(fluxo, data_inicio=None, data_fim=None):
 
 def _exportar_fluxo_excel(fluxo, data_inicio=None, data_fim=None):
     """Exporta fluxo entre contas para Excel"""
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Fluxo Entre Contas"
-    
-    # Estilos
-    header_fill = PatternFill(start_color="667EEA", end_color="667EEA", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF")
+    planilha = PlanilhaExcel("Fluxo Entre Contas", {'A': 20, 'B': 20, 'C': 25, 'D': 15, 'E': 12})
+    celula = planilha.celula
     
     # Cabeçalho
     headers = ['Conta Origem', 'Destino', 'Tipo', 'Total', 'Quantidade']
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_num, value=header)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal='center')
+    planilha.linha(*(celula(header, 'fluxo_cabecalho') for header in headers))
     
     # Dados
-    for row_num, row in enumerate(fluxo, 2):
-        ws.cell(row=row_num, column=1, value=row['origem'])
-        ws.cell(row=row_num, column=2, value=row['destino'] or 'N/A')
-        ws.cell(row=row_num, column=3, value=row['tipo_transferencia'])
-        ws.cell(row=row_num, column=4, value=row['total']).number_format = '#,##0.00'
-        ws.cell(row=row_num, column=5, value=row['quantidade'])
-    
-    # Larguras
-    ws.column_dimensions['A'].width = 20
-    ws.column_dimensions['B'].width = 20
-    ws.column_dimensions['C'].width = 25
-    ws.column_dimensions['D'].width = 15
-    ws.column_dimensions['E'].width = 12
-    
-    # Salva
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
+    for row in fluxo:
+        planilha.linha(
+            row['origem'],
+            row['destino'] or 'N/A',
+            row['tipo_transferencia'],
+            celula(row['total'], 'moeda'),
+            row['quantidade']
+        )
     
     filename = f"fluxo_contas_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
     
-    return send_file(
-        output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        as_attachment=True,
-        download_name=filename
-    )
+    return planilha.resposta(filename)
 
 
 @app.route('/relatorio/cartoes')
+@relatorio_em_cache
 def relatorio_cartoes():
-    conn = get_db_connection()
+    import pandas as pd
+    conn = get_db_leitura()
     
     # Parâmetros de filtro
     mes_referencia = request.args.get('mes', datetime.now().strftime('%Y-%m'))
@@ -3496,8 +3860,14 @@ def relatorio_cartoes():
         else:
             data_fim = f"{hoje.year}-{hoje.month+1:02d}-01"
     
-    # Filtro de compartilhado
-    where_compartilhado = "" if compartilhado == 'Todos' else f"AND m.compartilhado = '{compartilhado}'"
+    # Filtro de compartilhado (como parâmetro da query)
+    where_compartilhado = "" if compartilhado == 'Todos' else "AND m.compartilhado = ?"
+    params_compartilhado = [] if compartilhado == 'Todos' else [compartilhado]
+    
+    # Últimos 6 meses (incluindo o atual) para o gráfico de evolução
+    meses_evolucao = [(datetime.now() - pd.DateOffset(months=i)).strftime('%Y-%m') for i in range(5, -1, -1)]
+    evolucao_inicio = f"{meses_evolucao[0]}-01"
+    evolucao_fim = (datetime.now() + pd.DateOffset(months=1)).strftime('%Y-%m-01')
     
     # ===== 1. BUSCAR CARTÕES =====
     cartoes_list = conn.execute('''
@@ -3509,41 +3879,48 @@ def relatorio_cartoes():
         ORDER BY c.descricao
     ''').fetchall()
     
-    # ===== 2. CALCULAR GASTOS POR CARTÃO NO MÊS =====
+    # ===== 2. GASTOS POR CARTÃO E MÊS =====
+    # Uma agregação por (cartão, mês) cobre o mês de referência e os 6 meses da evolução,
+    # em vez de uma query por cartão e outra por mês
+    sql_gastos = f'''
+        SELECT m.cartao_id, substr(m.data_movimento, 1, 7) as mes, SUM(ABS(m.valor_centavos)) as total_centavos
+        FROM movimentos m
+        WHERE m.cartao_id IS NOT NULL
+        AND ((m.data_movimento >= ? AND m.data_movimento < ?)
+             OR (m.data_movimento >= ? AND m.data_movimento < ?))
+        {where_compartilhado}
+        GROUP BY m.cartao_id, mes
+    '''
+    params_gastos = [data_inicio, data_fim, evolucao_inicio, evolucao_fim] + params_compartilhado
+    
     gastos_cartoes = {}
-    total_gasto_mes = 0.0
+    total_por_mes = {}
+    for linha in conn.execute(sql_gastos, params_gastos):
+        total_por_mes[linha['mes']] = total_por_mes.get(linha['mes'], 0) + linha['total_centavos']
+        if data_inicio <= f"{linha['mes']}-01" < data_fim:
+            gastos_cartoes[linha['cartao_id']] = gastos_cartoes.get(linha['cartao_id'], 0) + linha['total_centavos']
     
-    for cartao in cartoes_list:
-        sql_gastos = f'''
-            SELECT COALESCE(SUM(ABS(m.valor)), 0) as total
-            FROM movimentos m
-            WHERE m.cartao_id = ?
-            AND m.data_movimento >= ?
-            AND m.data_movimento < ?
-            {where_compartilhado}
-        '''
-        
-        gasto = conn.execute(sql_gastos, (cartao['id'], data_inicio, data_fim)).fetchone()['total']
-        gastos_cartoes[cartao['id']] = gasto
-        total_gasto_mes += gasto
+    # Totais somados em centavos; daqui em diante tudo em reais
+    total_gasto_mes = de_centavos(sum(gastos_cartoes.get(cartao['id'], 0) for cartao in cartoes_list))
+    total_por_mes = {mes: de_centavos(total) for mes, total in total_por_mes.items()}
+    gastos_cartoes = {cartao_id: de_centavos(total) for cartao_id, total in gastos_cartoes.items()}
     
     # ===== 3. CALCULAR PAGAMENTOS DO MÊS =====
-    pagamentos_cartoes = {}
-    
-    for cartao in cartoes_list:
-        sql_pagamentos = f'''
-            SELECT COALESCE(SUM(t.valor), 0) as total
-            FROM transferencias t
-            WHERE t.cartao_id = ?
-            AND t.tipo_transferencia = 'Pagamento Fatura'
-            AND t.status = 'Efetivado'
-            AND t.data_efetivacao >= ?
-            AND t.data_efetivacao < ?
-            {where_compartilhado.replace('m.', 't.')}
-        '''
-        
-        pagamento = conn.execute(sql_pagamentos, (cartao['id'], data_inicio, data_fim)).fetchone()['total']
-        pagamentos_cartoes[cartao['id']] = pagamento
+    sql_pagamentos = f'''
+        SELECT t.cartao_id, SUM(t.valor_centavos) / 100.0 as total
+        FROM transferencias t
+        WHERE t.cartao_id IS NOT NULL
+        AND t.tipo_transferencia = 'Pagamento Fatura'
+        AND t.status = 'Efetivado'
+        AND t.data_efetivacao >= ?
+        AND t.data_efetivacao < ?
+        {where_compartilhado.replace('m.', 't.')}
+        GROUP BY t.cartao_id
+    '''
+    pagamentos_cartoes = {
+        linha['cartao_id']: linha['total']
+        for linha in conn.execute(sql_pagamentos, [data_inicio, data_fim] + params_compartilhado)
+    }
     
     # ===== 4. MONTAR DADOS DOS CARTÕES =====
     limite_total = sum([c['limite'] for c in cartoes_list])
@@ -3552,8 +3929,8 @@ def relatorio_cartoes():
     
     cartoes_dados = []
     for cartao in cartoes_list:
-        gasto = gastos_cartoes[cartao['id']]
-        pagamento = pagamentos_cartoes[cartao['id']]
+        gasto = gastos_cartoes.get(cartao['id'], 0.0)
+        pagamento = pagamentos_cartoes.get(cartao['id'], 0.0)
         disponivel = cartao['limite'] - gasto
         utilizacao = (gasto / cartao['limite'] * 100) if cartao['limite'] > 0 else 0
         
@@ -3586,7 +3963,7 @@ def relatorio_cartoes():
     sql_categorias = f'''
         SELECT 
             cat.descricao as categoria,
-            SUM(ABS(m.valor)) as total
+            SUM(ABS(m.valor_centavos)) / 100.0 as total
         FROM movimentos m
         JOIN categorias cat ON m.categoria_id = cat.id
         WHERE m.cartao_id IS NOT NULL
@@ -3598,38 +3975,14 @@ def relatorio_cartoes():
         LIMIT 5
     '''
     
-    top_categorias = conn.execute(sql_categorias, (data_inicio, data_fim)).fetchall()
+    top_categorias = conn.execute(sql_categorias, [data_inicio, data_fim] + params_compartilhado).fetchall()
     categorias_labels = [c['categoria'] for c in top_categorias]
     categorias_valores = [float(c['total']) for c in top_categorias]
     
     # ===== 6. EVOLUÇÃO ÚLTIMOS 6 MESES =====
-    evolucao_data = []
-    for i in range(5, -1, -1):
-        mes_calculo = (datetime.now() - pd.DateOffset(months=i)).strftime('%Y-%m')
-        mes_inicio = f"{mes_calculo}-01"
-        ano_m, mes_m = mes_calculo.split('-')
-        if int(mes_m) == 12:
-            mes_fim = f"{int(ano_m)+1}-01-01"
-        else:
-            mes_fim = f"{ano_m}-{int(mes_m)+1:02d}-01"
-        
-        sql_evolucao = f'''
-            SELECT COALESCE(SUM(ABS(m.valor)), 0) as total
-            FROM movimentos m
-            WHERE m.cartao_id IS NOT NULL
-            AND m.data_movimento >= ?
-            AND m.data_movimento < ?
-            {where_compartilhado}
-        '''
-        
-        total = conn.execute(sql_evolucao, (mes_inicio, mes_fim)).fetchone()['total']
-        evolucao_data.append({
-            'mes': datetime.strptime(mes_calculo, '%Y-%m').strftime('%b/%y'),
-            'total': float(total)
-        })
-    
-    evolucao_labels = [d['mes'] for d in evolucao_data]
-    evolucao_valores = [d['total'] for d in evolucao_data]
+    # Sai da mesma agregação do passo 2
+    evolucao_labels = [datetime.strptime(mes_calculo, '%Y-%m').strftime('%b/%y') for mes_calculo in meses_evolucao]
+    evolucao_valores = [float(total_por_mes.get(mes_calculo, 0.0)) for mes_calculo in meses_evolucao]
     
     # ===== 7. PRÓXIMOS VENCIMENTOS =====
     hoje = datetime.now()
@@ -3695,7 +4048,7 @@ def teste_validar_saldos():
     Rota de teste para validar se os saldos estão sendo calculados corretamente.
     Use: /teste/validar_saldos?instituicao_id=X&data=YYYY-MM-DD
     """
-    conn = get_db_connection()
+    conn = get_db_leitura()
     
     # Se não passou instituicao_id, mostra a lista
     instituicao_id = request.args.get('instituicao_id', type=int)
@@ -3786,8 +4139,6 @@ def teste_validar_saldos():
     
     data_teste = request.args.get('data', date.today().strftime('%Y-%m-%d'))
     
-    conn = get_db_connection()
-    
     # Busca nome da instituição
     inst = conn.execute('SELECT descricao FROM instituicoes WHERE id = ?', (instituicao_id,)).fetchone()
     if not inst:
@@ -3799,7 +4150,7 @@ def teste_validar_saldos():
     # 1. MOVIMENTOS (receitas e despesas)
     sql_movimentos = '''
         SELECT 
-            date(m.data_efetivacao) as data,
+            m.dia_efetivacao as data,
             m.descricao,
             c.tipo,
             m.valor
@@ -3809,15 +4160,15 @@ def teste_validar_saldos():
         AND m.status = 'Efetivado'
         AND m.cartao_id IS NULL
         AND m.data_efetivacao IS NOT NULL
-        AND date(m.data_efetivacao) < date(?)
-        ORDER BY date(m.data_efetivacao)
+        AND m.dia_efetivacao < date(?)
+        ORDER BY m.dia_efetivacao
     '''
     movimentos = conn.execute(sql_movimentos, (instituicao_id, data_teste)).fetchall()
     
     # 2. TRANSFERÊNCIAS RECEBIDAS
     sql_recebidas = '''
         SELECT 
-            date(t.data_efetivacao) as data,
+            t.dia_efetivacao as data,
             t.descricao,
             'Recebida' as tipo,
             t.valor
@@ -3825,15 +4176,15 @@ def teste_validar_saldos():
         WHERE t.conta_destino_id = ?
         AND t.status = 'Efetivado'
         AND t.data_efetivacao IS NOT NULL
-        AND date(t.data_efetivacao) < date(?)
-        ORDER BY date(t.data_efetivacao)
+        AND t.dia_efetivacao < date(?)
+        ORDER BY t.dia_efetivacao
     '''
     recebidas = conn.execute(sql_recebidas, (instituicao_id, data_teste)).fetchall()
     
     # 3. TRANSFERÊNCIAS ENVIADAS
     sql_enviadas = '''
         SELECT 
-            date(t.data_efetivacao) as data,
+            t.dia_efetivacao as data,
             t.descricao,
             'Enviada' as tipo,
             -t.valor as valor
@@ -3841,8 +4192,8 @@ def teste_validar_saldos():
         WHERE t.conta_origem_id = ?
         AND t.status = 'Efetivado'
         AND t.data_efetivacao IS NOT NULL
-        AND date(t.data_efetivacao) < date(?)
-        ORDER BY date(t.data_efetivacao)
+        AND t.dia_efetivacao < date(?)
+        ORDER BY t.dia_efetivacao
     '''
     enviadas = conn.execute(sql_enviadas, (instituicao_id, data_teste)).fetchall()
     
@@ -4040,5 +4391,31 @@ def teste_validar_saldos():
     
     return html
 
+# ===== FÁBRICA DA APLICAÇÃO =====
+def create_app(config=None):
+    """
+    Aplica a configuração e prepara o app para servir. A ordem de precedência é:
+    1. os padrões definidos no módulo;
+    2. as variáveis de ambiente FINANCAS_* (por exemplo FINANCAS_DATABASE, FINANCAS_SECRET_KEY
+       ou FINANCAS_DB_POOL_TAMANHO=16);
+    3. o dicionário `config`.
+    Em seguida cria a pasta de uploads, refaz o pool, o cache e a série do patrimônio com a
+    configuração final e aplica as migrações pendentes.
+    As rotas continuam registradas no `app` do módulo. Cada processo abre as próprias conexões no
+    primeiro request, então o mesmo app serve vários workers e threads do gunicorn (ver wsgi.py).
+    """
+    global pool_conexoes, pool_leitura, cache_relatorios, serie_patrimonio
+    app.config.from_prefixed_env('FINANCAS')
+    if config: app.config.from_mapping(config)
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    pool_conexoes.fechar()
+    pool_leitura.fechar()
+    pool_conexoes = PoolConexoes(app.config['DB_POOL_TAMANHO'], app.config['DB_POOL_TIMEOUT'])
+    pool_leitura = PoolConexoes(app.config['DB_POOL_LEITURA_TAMANHO'], app.config['DB_POOL_TIMEOUT'], somente_leitura=True)
+    cache_relatorios = CacheRelatorios(app.config['CACHE_RELATORIOS_MAX_BYTES'])
+    serie_patrimonio = SeriePatrimonio()
+    init_db()
+    return app
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
\ No newline at end of file
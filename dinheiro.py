@@ -0,0 +1,39 @@
+"""
+Valores monetários em centavos inteiros.
+
+No banco, movimentos.valor_centavos, transferencias.valor_centavos, investimentos.valor_total_centavos
+e o ledger saldos_diarios guardam centavos (INTEGER). As colunas em reais (valor, valor_total) são
+colunas geradas a partir dos centavos e servem apenas para exibição. Somas e saldos são sempre
+calculados em centavos (SUM no SQLite ou int64 no NumPy) e convertidos para reais uma única vez, na saída.
+"""
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+CENTAVO = Decimal('0.01')
+
+def para_centavos(valor):
+    """
+    Converte um valor em reais (texto do formulário, int, float ou Decimal) em centavos (int).
+    Aceita vírgula ou ponto como separador decimal e arredonda meio centavo para longe do zero.
+    Levanta ValueError para valores vazios, inválidos ou não finitos.
+    """
+    if isinstance(valor, float):
+        valor = repr(valor)  # o menor texto que representa o float: 0.1 -> '0.1', não 0.1000000000000000055...
+    elif isinstance(valor, str):
+        valor = valor.strip().replace(',', '.')
+    try:
+        decimal = Decimal(valor)
+    except (InvalidOperation, TypeError):
+        raise ValueError(f'Valor monetário inválido: {valor!r}')
+    if not decimal.is_finite():
+        raise ValueError(f'Valor monetário inválido: {valor!r}')
+    return int(decimal.quantize(CENTAVO, rounding=ROUND_HALF_UP) * 100)
+
+def de_centavos(centavos):
+    """Centavos (int ou None) -> reais (float), para exibição e para o openpyxl. None vira 0.0."""
+    if centavos is None: return 0.0
+    return int(centavos) / 100
+
+def somar_centavos(centavos):
+    """Soma exata de uma sequência/array de centavos (int64); vazio soma 0."""
+    import numpy as np
+    return int(np.asarray(centavos, dtype=np.int64).sum())
@@ -0,0 +1,104 @@
+"""
+Formatação de valores em reais ("R$ 1.234,56").
+
+format_brl é a versão escalar (Jinja, dicionários de totais) e guarda os resultados recentes,
+já que os mesmos valores se repetem muito numa página. format_brl_array e format_brl_frame
+formatam arrays e DataFrames inteiros de uma vez, com operações do NumPy, e devolvem
+exatamente o mesmo texto que format_brl devolveria célula a célula.
+
+NumPy e pandas só são importados quando um array ou DataFrame é formatado: as páginas de
+cadastro usam apenas format_brl e não pagam a importação deles.
+"""
+import math
+import numbers
+import sys
+from functools import lru_cache
+
+def _ausente(value):
+    """pd.isna para um valor escalar. Se o pandas ainda não foi importado não existe pd.NA/NaT
+    para tratar, e basta reconhecer None e NaN."""
+    pd = sys.modules.get('pandas')
+    if pd is not None:
+        return pd.isna(value)
+    return value is None or (isinstance(value, numbers.Number) and value != value)
+
+def _format_brl(value):
+    if _ausente(value) or value == 0:
+         return "R$ 0,00"
+    try:
+         float_value = float(value)
+         if float_value == 0.0 and math.copysign(1.0, float_value) == -1.0:
+             return "R$ 0,00"
+         return f"R$ {float_value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    except (ValueError, TypeError):
+         return "Valor Inválido"
+
+_format_brl_cache = lru_cache(maxsize=8192)(_format_brl)
+
+def format_brl(value):
+    try:
+        return _format_brl_cache(value)
+    except TypeError:  # valor não hasheável: formata sem cache
+        return _format_brl(value)
+
+# Maior valor em centavos que o float64 representa sem perder unidades
+_CENTAVOS_MAX = 2.0 ** 53
+
+@lru_cache(maxsize=None)
+def _tabelas():
+    """Texto de cada grupo de milhar (0-999), com e sem zeros à esquerda, e dos centavos (00-99)."""
+    import numpy as np
+    return (np.array([str(i) for i in range(1000)]),
+            np.array([f'{i:03d}' for i in range(1000)]),
+            np.array([f',{i:02d}' for i in range(100)]))
+
+def format_brl_array(valores):
+    """
+    Formata um array (ou lista/Series) de valores e devolve um array de str com o mesmo formato.
+    NaN e zero viram "R$ 0,00". Valores não numéricos, infinitos ou exatamente no meio de dois
+    centavos (onde o arredondamento do f-string decide pelo valor binário) passam por format_brl.
+    """
+    import numpy as np
+    texto_grupo, texto_grupo_3, texto_centavos = _tabelas()
+    try:
+        x = np.asarray(valores, dtype=np.float64)
+    except (ValueError, TypeError):
+        originais = np.asarray(valores, dtype=object)
+        return np.array([format_brl(v) for v in originais.ravel()], dtype=object).reshape(originais.shape)
+    forma = x.shape
+    x = x.ravel()
+    with np.errstate(invalid='ignore'):
+        escala = x * 100
+        centavos = np.rint(escala)
+        distancia_meio = np.abs(np.abs(escala - np.trunc(escala)) - 0.5)
+        zero = np.isnan(x) | (x == 0)
+        exato = ~zero & np.isfinite(x) & (np.abs(centavos) < _CENTAVOS_MAX) & (distancia_meio > 1e-6 + np.abs(escala) * 1e-13)
+
+    c = np.where(exato, np.abs(centavos), 0).astype(np.int64)
+    inteiros, fracoes = np.divmod(c, 100)
+    # Monta o texto do grupo de milhar mais significativo para o menos significativo
+    grupos = [inteiros % 1000]
+    resto = inteiros // 1000
+    while resto.any():
+        grupos.append(resto % 1000)
+        resto //= 1000
+    texto = texto_grupo[grupos[-1]]
+    for k in range(len(grupos) - 2, -1, -1):
+        iniciado = inteiros >= 1000 ** (k + 1)
+        texto = np.where(iniciado, np.char.add(np.char.add(texto, '.'), texto_grupo_3[grupos[k]]), texto_grupo[grupos[k]])
+    sinal = np.where(x < 0, 'R$ -', 'R$ ')
+    resultado = np.char.add(np.char.add(sinal, texto), texto_centavos[fracoes])
+    resultado[zero] = "R$ 0,00"
+
+    fora = ~zero & ~exato
+    if fora.any():
+        originais = np.asarray(valores, dtype=object).ravel()
+        resultado = resultado.astype(object)
+        for i in np.flatnonzero(fora):
+            resultado[i] = format_brl(originais[i])
+    return resultado.reshape(forma)
+
+def format_brl_frame(df):
+    """Equivalente a df.map(format_brl), formatando todas as células de uma vez."""
+    import pandas as pd
+    return pd.DataFrame(format_brl_array(df.to_numpy()), index=df.index, columns=df.columns)
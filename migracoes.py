@@ -0,0 +1,596 @@
+"""
+Migrações versionadas do banco de dados.
+
+A versão aplicada fica gravada em PRAGMA user_version. Na inicialização o app chama
+aplicar_migracoes(), que roda em ordem (cada uma na sua transação) apenas as migrações
+com número maior que a versão atual. Para alterar o esquema, acrescente uma nova função
+ao final de MIGRACOES — nunca edite uma migração que já foi aplicada.
+
+A migração 1 reproduz o resultado de cria_banco.py + altera_banco.py + ajustar_transferencias.py,
+então bancos antigos e bancos novos chegam ao mesmo esquema.
+"""
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# TABELAS DERIVADAS (reconstruídas a partir das tabelas de lançamentos)
+# ==============================================================================
+
+def reconstruir_saldos_diarios(conn):
+    """Recalcula o ledger inteiro a partir de movimentos e transferências (usado na criação e nas migrações)."""
+    conn.execute('DELETE FROM saldos_diarios')
+    conn.execute('''
+        INSERT INTO saldos_diarios (instituicao_id, data, variacao_centavos, saldo_centavos)
+        SELECT conta, data, SUM(centavos), SUM(SUM(centavos)) OVER (PARTITION BY conta ORDER BY data)
+        FROM (
+            SELECT instituicao_id AS conta, date(data_efetivacao) AS data, valor_centavos AS centavos
+            FROM movimentos
+            WHERE status = 'Efetivado' AND cartao_id IS NULL AND data_efetivacao IS NOT NULL
+            UNION ALL
+            SELECT conta_destino_id, date(data_efetivacao), valor_centavos
+            FROM transferencias
+            WHERE status = 'Efetivado' AND data_efetivacao IS NOT NULL AND conta_destino_id IS NOT NULL
+            UNION ALL
+            SELECT conta_origem_id, date(data_efetivacao), -valor_centavos
+            FROM transferencias
+            WHERE status = 'Efetivado' AND data_efetivacao IS NOT NULL
+        )
+        GROUP BY conta, data
+    ''')
+
+def somar_saldos_diarios(conn, filtro='1 = 1', params=()):
+    """
+    Aplica ao ledger os movimentos que satisfazem 'filtro' (numa importação, os recém-inseridos) sem
+    reconstruí-lo: soma as variações agrupadas por (conta, dia) e desloca os saldos de cada conta só
+    a partir do primeiro dia alterado, partindo do saldo do dia anterior, que não muda.
+    """
+    movimentos = f'''
+        FROM movimentos
+        WHERE status = 'Efetivado' AND cartao_id IS NULL AND data_efetivacao IS NOT NULL AND ({filtro})
+    '''
+    conn.execute(f'''
+        INSERT INTO saldos_diarios (instituicao_id, data, variacao_centavos, saldo_centavos)
+        SELECT instituicao_id, date(data_efetivacao), SUM(valor_centavos), 0
+        {movimentos}
+        GROUP BY 1, 2
+        ON CONFLICT (instituicao_id, data) DO UPDATE SET variacao_centavos = variacao_centavos + excluded.variacao_centavos
+    ''', params)
+    conn.execute(f'''
+        WITH inicio AS (
+            SELECT conta, data, COALESCE((SELECT saldo_centavos FROM saldos_diarios
+                                          WHERE instituicao_id = conta AND data < inicio_conta.data
+                                          ORDER BY data DESC LIMIT 1), 0) AS saldo_anterior
+            FROM (SELECT instituicao_id AS conta, MIN(date(data_efetivacao)) AS data {movimentos} GROUP BY 1) AS inicio_conta
+        ), novo AS (
+            SELECT s.instituicao_id, s.data,
+                   i.saldo_anterior + SUM(s.variacao_centavos) OVER (PARTITION BY s.instituicao_id ORDER BY s.data) AS saldo
+            FROM saldos_diarios s JOIN inicio i ON s.instituicao_id = i.conta AND s.data >= i.data
+        )
+        UPDATE saldos_diarios SET saldo_centavos = novo.saldo
+        FROM novo
+        WHERE saldos_diarios.instituicao_id = novo.instituicao_id AND saldos_diarios.data = novo.data
+    ''', params)
+
+# Cubo mensal: soma e contagem de movimentos por (mês do movimento, mês da efetivação, categoria,
+# conta, cartão, compartilhado, status). Sem cartão grava cartao_id = 0 e sem efetivação
+# mes_efetivacao = '', para que a chave não tenha NULL e o ON CONFLICT funcione.
+CHAVE_RESUMO_MENSAL = 'mes, mes_efetivacao, categoria_id, instituicao_id, cartao_id, compartilhado, status'
+
+def agregacao_resumo_mensal(filtro='1 = 1', sinal=1):
+    """SELECT que agrega os movimentos que satisfazem 'filtro' nas chaves do cubo (multiplicados por 'sinal')."""
+    return f'''
+        SELECT strftime('%Y-%m', data_movimento) AS mes, COALESCE(strftime('%Y-%m', data_efetivacao), '') AS mes_efetivacao,
+               categoria_id, instituicao_id, COALESCE(cartao_id, 0) AS cartao_id, compartilhado, status,
+               {sinal} * SUM(valor_centavos) AS total_centavos, {sinal} * COUNT(*) AS quantidade
+        FROM movimentos
+        WHERE {filtro}
+        GROUP BY 1, 2, 3, 4, 5, 6, 7
+    '''
+
+def somar_resumo_mensal(conn, filtro='1 = 1', params=(), sinal=1):
+    """Acumula no cubo (sinal=1) ou estorna (sinal=-1) os movimentos que satisfazem 'filtro'."""
+    conn.execute(f'''
+        INSERT INTO resumo_mensal ({CHAVE_RESUMO_MENSAL}, total_centavos, quantidade)
+        {agregacao_resumo_mensal(filtro, sinal)}
+        ON CONFLICT ({CHAVE_RESUMO_MENSAL}) DO UPDATE SET
+            total_centavos = total_centavos + excluded.total_centavos,
+            quantidade = quantidade + excluded.quantidade
+    ''', params)
+    if sinal < 0:
+        conn.execute('DELETE FROM resumo_mensal WHERE quantidade = 0')
+
+def reconstruir_resumo_mensal(conn):
+    """Recalcula o cubo inteiro a partir de movimentos."""
+    conn.execute('DELETE FROM resumo_mensal')
+    somar_resumo_mensal(conn)
+
+# Posições de investimentos: quantidade, valor investido e número de operações por (ticker,
+# instituição, moeda). Compras (natureza 'Entrada') somam e as demais operações subtraem, como no
+# dashboard. Sem instituição grava instituicao_id = 0. A quantidade é arredondada a 10 casas a
+# cada soma, para que estornar uma operação devolva exatamente a quantidade anterior.
+CHAVE_POSICOES_INVESTIMENTOS = 'ticker_id, instituicao_id, moeda_id'
+
+def agregacao_posicoes_investimentos(filtro='1 = 1', sinal=1):
+    """SELECT que agrega os investimentos (alias i) que satisfazem 'filtro' nas chaves das posições."""
+    return f'''
+        SELECT i.ticker_id, COALESCE(i.instituicao_id, 0) AS instituicao_id, i.moeda_id,
+               ROUND({sinal} * SUM(CASE WHEN o.natureza = 'Entrada' THEN i.quantidade ELSE -i.quantidade END), 10) AS quantidade,
+               {sinal} * SUM(CASE WHEN o.natureza = 'Entrada' THEN ABS(i.valor_total_centavos)
+                                  ELSE -ABS(i.valor_total_centavos) END) AS valor_investido_centavos,
+               {sinal} * COUNT(*) AS operacoes
+        FROM investimentos i
+        JOIN operacoes o ON i.operacao_id = o.id
+        WHERE {filtro}
+        GROUP BY 1, 2, 3
+    '''
+
+def somar_posicoes_investimentos(conn, filtro='1 = 1', params=(), sinal=1):
+    """Acumula nas posições (sinal=1) ou estorna (sinal=-1) os investimentos que satisfazem 'filtro'."""
+    conn.execute(f'''
+        INSERT INTO posicoes_investimentos ({CHAVE_POSICOES_INVESTIMENTOS}, quantidade, valor_investido_centavos, operacoes)
+        {agregacao_posicoes_investimentos(filtro, sinal)}
+        ON CONFLICT ({CHAVE_POSICOES_INVESTIMENTOS}) DO UPDATE SET
+            quantidade = ROUND(quantidade + excluded.quantidade, 10),
+            valor_investido_centavos = valor_investido_centavos + excluded.valor_investido_centavos,
+            operacoes = operacoes + excluded.operacoes
+    ''', params)
+    if sinal < 0:
+        conn.execute('DELETE FROM posicoes_investimentos WHERE operacoes = 0')
+
+def reconstruir_posicoes_investimentos(conn):
+    """Recalcula todas as posições a partir de investimentos."""
+    conn.execute('DELETE FROM posicoes_investimentos')
+    somar_posicoes_investimentos(conn)
+
+# ==============================================================================
+# MIGRAÇÕES
+# ==============================================================================
+
+def _m001_esquema_base(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS instituicoes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        descricao TEXT NOT NULL UNIQUE
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS cartoes_credito (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        descricao TEXT NOT NULL,
+        instituicao_id INTEGER NOT NULL,
+        vencimento INTEGER NOT NULL,
+        limite REAL NOT NULL,
+        FOREIGN KEY (instituicao_id) REFERENCES instituicoes (id)
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS categorias (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        descricao TEXT NOT NULL UNIQUE,
+        tipo TEXT NOT NULL CHECK(tipo IN ('Receita', 'Despesa'))
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS tickers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        descricao TEXT NOT NULL UNIQUE,
+        classe TEXT NOT NULL,
+        tipo TEXT NOT NULL
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS moedas (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        codigo TEXT NOT NULL UNIQUE,
+        descricao TEXT NOT NULL
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS operacoes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        descricao TEXT NOT NULL UNIQUE,
+        natureza TEXT NOT NULL CHECK(natureza IN ('Entrada', 'Saida'))
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS movimentos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        data_movimento TEXT NOT NULL,
+        data_efetivacao TEXT,
+        descricao TEXT NOT NULL,
+        categoria_id INTEGER NOT NULL,
+        instituicao_id INTEGER NOT NULL,
+        cartao_id INTEGER,
+        valor REAL NOT NULL,
+        status TEXT NOT NULL CHECK(status IN ('Pendente', 'Efetivado')),
+        compartilhado TEXT NOT NULL CHECK(compartilhado IN ('100% Silvia', '100% Nelson', '50/50')),
+        FOREIGN KEY (categoria_id) REFERENCES categorias (id),
+        FOREIGN KEY (instituicao_id) REFERENCES instituicoes (id),
+        FOREIGN KEY (cartao_id) REFERENCES cartoes_credito (id)
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS investimentos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        data_investimento TEXT NOT NULL,
+        data_vencimento TEXT,
+        ticker_id INTEGER NOT NULL,
+        operacao_id INTEGER NOT NULL,
+        moeda_id INTEGER NOT NULL,
+        quantidade REAL NOT NULL,
+        valor_total REAL NOT NULL,
+        FOREIGN KEY (ticker_id) REFERENCES tickers (id),
+        FOREIGN KEY (operacao_id) REFERENCES operacoes (id),
+        FOREIGN KEY (moeda_id) REFERENCES moedas (id)
+    )''')
+
+    # Colunas acrescentadas por altera_banco.py
+    colunas_existentes = [col[1] for col in conn.execute('PRAGMA table_info(investimentos)').fetchall()]
+    for nome_coluna, definicao in [('custos', 'REAL DEFAULT 0'), ('taxas', 'REAL DEFAULT 0'),
+                                   ('irrf', 'REAL DEFAULT 0'), ('valor_unitario', 'REAL DEFAULT 0'),
+                                   ('instituicao_id', 'INTEGER REFERENCES instituicoes(id)'),
+                                   ('taxa_negociada', 'REAL'), ('indexador', 'TEXT'), ('observacao', 'TEXT')]:
+        if nome_coluna not in colunas_existentes:
+            conn.execute(f'ALTER TABLE investimentos ADD COLUMN {nome_coluna} {definicao}')
+
+    sql_transferencias = '''CREATE TABLE {nome} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        data_transferencia TEXT NOT NULL,
+        data_efetivacao TEXT,
+        descricao TEXT NOT NULL,
+        conta_origem_id INTEGER NOT NULL,
+        conta_destino_id INTEGER,
+        cartao_id INTEGER,
+        valor REAL NOT NULL,
+        status TEXT NOT NULL CHECK(status IN ('Pendente', 'Efetivado')),
+        tipo_transferencia TEXT NOT NULL CHECK(
+            tipo_transferencia IN ('Entre Contas', 'Para Investimento', 'De Investimento', 'Pagamento Fatura')
+        ),
+        investimento_id INTEGER,
+        compartilhado TEXT NOT NULL CHECK(
+            compartilhado IN ('100% Silvia', '100% Nelson', '50/50')
+        ),
+        FOREIGN KEY (conta_origem_id) REFERENCES instituicoes (id),
+        FOREIGN KEY (conta_destino_id) REFERENCES instituicoes (id),
+        FOREIGN KEY (cartao_id) REFERENCES cartoes_credito (id),
+        FOREIGN KEY (investimento_id) REFERENCES investimentos (id)
+    )'''
+    atual = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'transferencias'").fetchone()
+    if atual is None:
+        conn.execute(sql_transferencias.format(nome='transferencias'))
+    elif 'Pagamento Fatura' not in atual[0]:
+        # Mesma correção de ajustar_transferencias.py: recria a tabela com o CHECK atualizado
+        conn.execute(sql_transferencias.format(nome='transferencias_nova'))
+        conn.execute('''INSERT INTO transferencias_nova (
+                id, data_transferencia, data_efetivacao, descricao, conta_origem_id, conta_destino_id,
+                cartao_id, valor, status, tipo_transferencia, investimento_id, compartilhado)
+            SELECT id, data_transferencia, data_efetivacao, descricao, conta_origem_id, conta_destino_id,
+                cartao_id, valor, status, tipo_transferencia, investimento_id, compartilhado
+            FROM transferencias''')
+        conn.execute('DROP TABLE transferencias')
+        conn.execute('ALTER TABLE transferencias_nova RENAME TO transferencias')
+
+def _m002_saldos_diarios(conn):
+    # Uma linha por (conta, dia com movimentação): 'variacao' é o líquido do dia e
+    # 'saldo' o saldo acumulado ao fim do dia. Saldo numa data = última linha <= data.
+    existia = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'saldos_diarios'").fetchone()
+    conn.execute('''CREATE TABLE IF NOT EXISTS saldos_diarios (
+        instituicao_id INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        variacao REAL NOT NULL DEFAULT 0,
+        saldo REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (instituicao_id, data),
+        FOREIGN KEY (instituicao_id) REFERENCES instituicoes (id)
+    ) WITHOUT ROWID''')
+    if not existia:
+        _preencher_saldos_diarios_reais(conn)
+
+def _preencher_saldos_diarios_reais(conn):
+    # reconstruir_saldos_diarios() acompanha o esquema atual (centavos, migração 5); a migração 2
+    # roda sobre o esquema em reais e guarda a própria cópia do preenchimento da época
+    conn.execute('''
+        INSERT INTO saldos_diarios (instituicao_id, data, variacao, saldo)
+        SELECT conta, data, SUM(valor), SUM(SUM(valor)) OVER (PARTITION BY conta ORDER BY data)
+        FROM (
+            SELECT instituicao_id AS conta, date(data_efetivacao) AS data, valor
+            FROM movimentos
+            WHERE status = 'Efetivado' AND cartao_id IS NULL AND data_efetivacao IS NOT NULL
+            UNION ALL
+            SELECT conta_destino_id, date(data_efetivacao), valor
+            FROM transferencias
+            WHERE status = 'Efetivado' AND data_efetivacao IS NOT NULL AND conta_destino_id IS NOT NULL
+            UNION ALL
+            SELECT conta_origem_id, date(data_efetivacao), -valor
+            FROM transferencias
+            WHERE status = 'Efetivado' AND data_efetivacao IS NOT NULL
+        )
+        GROUP BY conta, data
+    ''')
+
+def _m003_indices(conn):
+    # Índices escolhidos a partir dos WHERE / ORDER BY usados nas rotas do app.py
+    indices = [
+        # /movimentos, exportações e relatórios por período: ORDER BY data_movimento DESC, id DESC
+        'CREATE INDEX IF NOT EXISTS idx_movimentos_data ON movimentos (data_movimento)',
+        # Resumo mensal / tendências / fluxo: status + período, cobrindo categoria e valor
+        'CREATE INDEX IF NOT EXISTS idx_movimentos_status_data ON movimentos (status, data_movimento, categoria_id, valor)',
+        # Extrato e saldos: movimentos efetivados fora do cartão de uma conta, por data de efetivação
+        '''CREATE INDEX IF NOT EXISTS idx_movimentos_conta_efetivacao ON movimentos (instituicao_id, data_efetivacao, valor)
+           WHERE status = 'Efetivado' AND cartao_id IS NULL''',
+        # Relatório de cartões: gastos por cartão no mês
+        'CREATE INDEX IF NOT EXISTS idx_movimentos_cartao_data ON movimentos (cartao_id, data_movimento, valor)',
+        # Checagens de uso antes de excluir categoria
+        'CREATE INDEX IF NOT EXISTS idx_movimentos_categoria ON movimentos (categoria_id)',
+        # Extrato: transferências enviadas / recebidas por conta
+        'CREATE INDEX IF NOT EXISTS idx_transferencias_origem ON transferencias (conta_origem_id, status, data_efetivacao)',
+        'CREATE INDEX IF NOT EXISTS idx_transferencias_destino ON transferencias (conta_destino_id, status, data_efetivacao)',
+        # Relatório de cartões: pagamentos de fatura por cartão
+        'CREATE INDEX IF NOT EXISTS idx_transferencias_cartao ON transferencias (cartao_id, tipo_transferencia, status, data_efetivacao, valor)',
+        # /transferencias e exportação: ORDER BY data_transferencia DESC, id DESC
+        'CREATE INDEX IF NOT EXISTS idx_transferencias_data ON transferencias (data_transferencia)',
+        # /investimentos e dashboard de investimentos
+        'CREATE INDEX IF NOT EXISTS idx_investimentos_data ON investimentos (data_investimento)',
+        'CREATE INDEX IF NOT EXISTS idx_investimentos_ticker ON investimentos (ticker_id)',
+    ]
+    for sql in indices:
+        conn.execute(sql)
+    conn.execute('ANALYZE')
+
+def _m004_importacoes(conn):
+    # Área de staging da importação: as linhas validadas ficam no banco entre a validação
+    # e a confirmação, e o formulário só devolve as correções feitas pelo usuário.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS importacoes (
+            id TEXT PRIMARY KEY,
+            arquivo TEXT NOT NULL,
+            criado_em TEXT NOT NULL DEFAULT (datetime('now')),
+            total_linhas INTEGER NOT NULL,
+            linhas_com_erro INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS importacao_linhas (
+            importacao_id TEXT NOT NULL REFERENCES importacoes (id) ON DELETE CASCADE,
+            linha INTEGER NOT NULL,
+            data_movimento TEXT,
+            descricao TEXT,
+            categoria_id INTEGER,
+            categoria_nome TEXT,
+            instituicao_id INTEGER,
+            conta_nome TEXT,
+            cartao_id INTEGER,
+            cartao_nome TEXT,
+            valor TEXT,
+            status TEXT,
+            compartilhado TEXT,
+            erros TEXT,
+            PRIMARY KEY (importacao_id, linha)
+        ) WITHOUT ROWID
+    ''')
+
+def _recriar_tabela(conn, nome, sql_criacao, colunas_destino, colunas_origem):
+    """Recria a tabela com o novo esquema copiando as linhas (mesmo procedimento da migração 1)."""
+    conn.execute(sql_criacao.format(nome=f'{nome}_nova'))
+    conn.execute(f'INSERT INTO {nome}_nova ({colunas_destino}) SELECT {colunas_origem} FROM {nome}')
+    # Preserva o AUTOINCREMENT: ids de linhas já excluídas não podem ser reaproveitados
+    sequencia = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (nome,)).fetchone()
+    conn.execute(f'DROP TABLE {nome}')
+    conn.execute(f'ALTER TABLE {nome}_nova RENAME TO {nome}')
+    if sequencia and not conn.execute('UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?',
+                                      (sequencia[0], nome)).rowcount:
+        conn.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (nome, sequencia[0]))
+
+def _m005_centavos(conn):
+    # Valores monetários passam a ser guardados em centavos (INTEGER). As colunas em reais
+    # continuam existindo como colunas geradas, então as leituras para exibição não mudam;
+    # somas e saldos usam as colunas em centavos (ver dinheiro.py).
+    # transferencias referencia investimentos: as tabelas são recriadas com as FKs desligadas
+    # (ver aplicar_migracoes), que confere as referências antes do COMMIT.
+    _recriar_tabela(conn, 'movimentos', '''CREATE TABLE {nome} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        data_movimento TEXT NOT NULL,
+        data_efetivacao TEXT,
+        descricao TEXT NOT NULL,
+        categoria_id INTEGER NOT NULL,
+        instituicao_id INTEGER NOT NULL,
+        cartao_id INTEGER,
+        valor_centavos INTEGER NOT NULL,
+        status TEXT NOT NULL CHECK(status IN ('Pendente', 'Efetivado')),
+        compartilhado TEXT NOT NULL CHECK(compartilhado IN ('100% Silvia', '100% Nelson', '50/50')),
+        valor REAL GENERATED ALWAYS AS (valor_centavos / 100.0) VIRTUAL,
+        FOREIGN KEY (categoria_id) REFERENCES categorias (id),
+        FOREIGN KEY (instituicao_id) REFERENCES instituicoes (id),
+        FOREIGN KEY (cartao_id) REFERENCES cartoes_credito (id)
+    )''',
+        'id, data_movimento, data_efetivacao, descricao, categoria_id, instituicao_id, cartao_id, valor_centavos, status, compartilhado',
+        'id, data_movimento, data_efetivacao, descricao, categoria_id, instituicao_id, cartao_id, CAST(round(valor * 100) AS INTEGER), status, compartilhado')
+    _recriar_tabela(conn, 'investimentos', '''CREATE TABLE {nome} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        data_investimento TEXT NOT NULL,
+        data_vencimento TEXT,
+        ticker_id INTEGER NOT NULL,
+        operacao_id INTEGER NOT NULL,
+        moeda_id INTEGER NOT NULL,
+        quantidade REAL NOT NULL,
+        valor_total_centavos INTEGER NOT NULL,
+        custos REAL DEFAULT 0,
+        taxas REAL DEFAULT 0,
+        irrf REAL DEFAULT 0,
+        valor_unitario REAL DEFAULT 0,
+        instituicao_id INTEGER REFERENCES instituicoes(id),
+        taxa_negociada REAL,
+        indexador TEXT,
+        observacao TEXT,
+        valor_total REAL GENERATED ALWAYS AS (valor_total_centavos / 100.0) VIRTUAL,
+        FOREIGN KEY (ticker_id) REFERENCES tickers (id),
+        FOREIGN KEY (operacao_id) REFERENCES operacoes (id),
+        FOREIGN KEY (moeda_id) REFERENCES moedas (id)
+    )''',
+        'id, data_investimento, data_vencimento, ticker_id, operacao_id, moeda_id, quantidade, valor_total_centavos, '
+        'custos, taxas, irrf, valor_unitario, instituicao_id, taxa_negociada, indexador, observacao',
+        'id, data_investimento, data_vencimento, ticker_id, operacao_id, moeda_id, quantidade, CAST(round(valor_total * 100) AS INTEGER), '
+        'custos, taxas, irrf, valor_unitario, instituicao_id, taxa_negociada, indexador, observacao')
+    _recriar_tabela(conn, 'transferencias', '''CREATE TABLE {nome} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        data_transferencia TEXT NOT NULL,
+        data_efetivacao TEXT,
+        descricao TEXT NOT NULL,
+        conta_origem_id INTEGER NOT NULL,
+        conta_destino_id INTEGER,
+        cartao_id INTEGER,
+        valor_centavos INTEGER NOT NULL,
+        status TEXT NOT NULL CHECK(status IN ('Pendente', 'Efetivado')),
+        tipo_transferencia TEXT NOT NULL CHECK(
+            tipo_transferencia IN ('Entre Contas', 'Para Investimento', 'De Investimento', 'Pagamento Fatura')
+        ),
+        investimento_id INTEGER,
+        compartilhado TEXT NOT NULL CHECK(
+            compartilhado IN ('100% Silvia', '100% Nelson', '50/50')
+        ),
+        valor REAL GENERATED ALWAYS AS (valor_centavos / 100.0) VIRTUAL,
+        FOREIGN KEY (conta_origem_id) REFERENCES instituicoes (id),
+        FOREIGN KEY (conta_destino_id) REFERENCES instituicoes (id),
+        FOREIGN KEY (cartao_id) REFERENCES cartoes_credito (id),
+        FOREIGN KEY (investimento_id) REFERENCES investimentos (id)
+    )''',
+        'id, data_transferencia, data_efetivacao, descricao, conta_origem_id, conta_destino_id, cartao_id, valor_centavos, '
+        'status, tipo_transferencia, investimento_id, compartilhado',
+        'id, data_transferencia, data_efetivacao, descricao, conta_origem_id, conta_destino_id, cartao_id, CAST(round(valor * 100) AS INTEGER), '
+        'status, tipo_transferencia, investimento_id, compartilhado')
+
+    # Ledger em centavos: recriado do zero a partir dos lançamentos
+    conn.execute('DROP TABLE IF EXISTS saldos_diarios')
+    conn.execute('''CREATE TABLE saldos_diarios (
+        instituicao_id INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        variacao_centavos INTEGER NOT NULL DEFAULT 0,
+        saldo_centavos INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (instituicao_id, data),
+        FOREIGN KEY (instituicao_id) REFERENCES instituicoes (id)
+    ) WITHOUT ROWID''')
+    reconstruir_saldos_diarios(conn)
+
+    # Os índices da migração 3 somem junto com as tabelas antigas; voltam cobrindo os centavos
+    indices = [
+        'CREATE INDEX idx_movimentos_data ON movimentos (data_movimento)',
+        'CREATE INDEX idx_movimentos_status_data ON movimentos (status, data_movimento, categoria_id, valor_centavos)',
+        '''CREATE INDEX idx_movimentos_conta_efetivacao ON movimentos (instituicao_id, data_efetivacao, valor_centavos)
+           WHERE status = 'Efetivado' AND cartao_id IS NULL''',
+        'CREATE INDEX idx_movimentos_cartao_data ON movimentos (cartao_id, data_movimento, valor_centavos)',
+        'CREATE INDEX idx_movimentos_categoria ON movimentos (categoria_id)',
+        'CREATE INDEX idx_transferencias_origem ON transferencias (conta_origem_id, status, data_efetivacao)',
+        'CREATE INDEX idx_transferencias_destino ON transferencias (conta_destino_id, status, data_efetivacao)',
+        'CREATE INDEX idx_transferencias_cartao ON transferencias (cartao_id, tipo_transferencia, status, data_efetivacao, valor_centavos)',
+        'CREATE INDEX idx_transferencias_data ON transferencias (data_transferencia)',
+        'CREATE INDEX idx_investimentos_data ON investimentos (data_investimento)',
+        'CREATE INDEX idx_investimentos_ticker ON investimentos (ticker_id)',
+    ]
+    for sql in indices:
+        conn.execute(sql)
+    conn.execute('ANALYZE')
+
+def _m006_dia_efetivacao(conn):
+    # date(data_efetivacao) normalizado numa coluna gerada e indexada: os filtros de saldo e extrato
+    # comparam a coluna com um intervalo (dia_efetivacao <= date(?)) e o SQLite faz busca por
+    # intervalo no índice, em vez de avaliar date() linha a linha numa varredura da tabela.
+    for tabela in ('movimentos', 'transferencias'):
+        conn.execute(f'ALTER TABLE {tabela} ADD COLUMN dia_efetivacao TEXT GENERATED ALWAYS AS (date(data_efetivacao)) VIRTUAL')
+    conn.execute('DROP INDEX IF EXISTS idx_movimentos_conta_efetivacao')
+    conn.execute('DROP INDEX IF EXISTS idx_transferencias_origem')
+    conn.execute('DROP INDEX IF EXISTS idx_transferencias_destino')
+    indices = [
+        # Extrato, saldos e dashboard: movimentos efetivados fora do cartão de uma conta, por dia
+        '''CREATE INDEX idx_movimentos_conta_dia ON movimentos (instituicao_id, dia_efetivacao, valor_centavos)
+           WHERE status = 'Efetivado' AND cartao_id IS NULL''',
+        # Extrato: transferências enviadas / recebidas por conta, por dia
+        'CREATE INDEX idx_transferencias_origem_dia ON transferencias (conta_origem_id, status, dia_efetivacao)',
+        'CREATE INDEX idx_transferencias_destino_dia ON transferencias (conta_destino_id, status, dia_efetivacao)',
+    ]
+    for sql in indices:
+        conn.execute(sql)
+    conn.execute('ANALYZE')
+
+def _m007_resumo_mensal(conn):
+    # Dashboard, fluxo, tendências e resumo mensal leem deste cubo em vez de reagregar movimentos
+    conn.execute('''CREATE TABLE resumo_mensal (
+        mes TEXT NOT NULL,
+        mes_efetivacao TEXT NOT NULL,
+        categoria_id INTEGER NOT NULL,
+        instituicao_id INTEGER NOT NULL,
+        cartao_id INTEGER NOT NULL,
+        compartilhado TEXT NOT NULL,
+        status TEXT NOT NULL,
+        total_centavos INTEGER NOT NULL,
+        quantidade INTEGER NOT NULL,
+        PRIMARY KEY (mes, mes_efetivacao, categoria_id, instituicao_id, cartao_id, compartilhado, status)
+    ) WITHOUT ROWID''')
+    conn.execute('CREATE INDEX idx_resumo_mensal_efetivacao ON resumo_mensal (mes_efetivacao)')
+    # Meses cortados pelo filtro de datas (pontas do período) são agregados direto de movimentos
+    conn.execute('CREATE INDEX idx_movimentos_dia_efetivacao ON movimentos (dia_efetivacao)')
+    reconstruir_resumo_mensal(conn)
+    conn.execute('ANALYZE')
+
+def _m008_posicoes_investimentos(conn):
+    # O dashboard de investimentos lê uma linha por posição em vez de repassar todas as operações
+    conn.execute('''CREATE TABLE posicoes_investimentos (
+        ticker_id INTEGER NOT NULL,
+        instituicao_id INTEGER NOT NULL,
+        moeda_id INTEGER NOT NULL,
+        quantidade REAL NOT NULL,
+        valor_investido_centavos INTEGER NOT NULL,
+        operacoes INTEGER NOT NULL,
+        preco_medio REAL GENERATED ALWAYS AS (
+            CASE WHEN quantidade > 0 THEN valor_investido_centavos / 100.0 / quantidade END) VIRTUAL,
+        PRIMARY KEY (ticker_id, instituicao_id, moeda_id)
+    ) WITHOUT ROWID''')
+    reconstruir_posicoes_investimentos(conn)
+
+def _m009_precos(conn):
+    # Cotações diárias dos tickers e números-índice dos benchmarks, carregados em lote por /precos
+    conn.execute('''CREATE TABLE precos (
+        serie TEXT NOT NULL,
+        data TEXT NOT NULL,
+        valor REAL NOT NULL,
+        PRIMARY KEY (serie, data)
+    ) WITHOUT ROWID''')
+
+MIGRACOES = [
+    (1, 'Esquema base (cadastros, movimentos, investimentos, transferências)', _m001_esquema_base),
+    (2, 'Ledger de saldos diários por conta', _m002_saldos_diarios),
+    (3, 'Índices para os filtros e ordenações dos relatórios', _m003_indices),
+    (4, 'Staging das importações de movimentos', _m004_importacoes),
+    (5, 'Valores monetários em centavos inteiros', _m005_centavos),
+    (6, 'Dia de efetivação normalizado e indexado', _m006_dia_efetivacao),
+    (7, 'Cubo mensal de movimentos', _m007_resumo_mensal),
+    (8, 'Posições de investimentos', _m008_posicoes_investimentos),
+    (9, 'Histórico de cotações e índices', _m009_precos),
+]
+
+def versao_atual(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def aplicar_migracoes(conn):
+    """Aplica, em ordem, as migrações ainda não aplicadas. Retorna a lista de versões aplicadas."""
+    aplicadas = []
+    # Migrações que recriam tabelas (DROP + RENAME) rodam com as FKs desligadas, como manda o
+    # procedimento do ALTER TABLE do SQLite: com elas ligadas, o DROP de uma tabela referenciada
+    # registra violações que o RENAME não desfaz. O PRAGMA não tem efeito dentro de transação,
+    # então é trocado antes do BEGIN; foreign_key_check confere as referências antes do COMMIT.
+    fks_ligadas = conn.execute('PRAGMA foreign_keys').fetchone()[0]
+    conn.execute('PRAGMA foreign_keys = OFF')
+    try:
+        for versao, descricao, migracao in MIGRACOES:
+            if versao <= versao_atual(conn):
+                continue
+            try:
+                # IMMEDIATE: com vários workers subindo juntos, só um migra; os outros esperam o lock
+                # e, ao entrar, encontram a versão já aplicada
+                conn.execute('BEGIN IMMEDIATE')
+                if versao <= versao_atual(conn):
+                    conn.execute('COMMIT')
+                    continue
+                # Referências órfãs que o banco já tinha (criado sem FKs) não impedem a migração
+                orfas = set(conn.execute('PRAGMA foreign_key_check'))
+                migracao(conn)
+                novas = set(conn.execute('PRAGMA foreign_key_check')) - orfas
+                if novas:
+                    tabela, rowid, referenciada, _ = min(novas, key=repr)
+                    raise sqlite3.IntegrityError(
+                        f'Migração {versao}: chave estrangeira inválida em {tabela} (rowid {rowid}) -> {referenciada}')
+                conn.execute(f'PRAGMA user_version = {versao}')
+                conn.execute('COMMIT')
+            except sqlite3.Error:
+                conn.execute('ROLLBACK')
+                raise
+            logger.info("Migração %s aplicada: %s", versao, descricao)
+            aplicadas.append(versao)
+    finally:
+        if fks_ligadas: conn.execute('PRAGMA foreign_keys = ON')
+    return aplicadas
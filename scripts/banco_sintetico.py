@@ -0,0 +1,104 @@
+"""
+Banco de dados sintético para os benchmarks de scripts/.
+
+Cria um arquivo novo, aplica as migrações e gera lançamentos aleatórios (reprodutíveis pela
+semente) espalhados pelos últimos `anos` anos, depois reconstrói as tabelas derivadas e roda
+ANALYZE. Também copia e migra um banco existente, para medir sobre dados reais sem alterar o
+original.
+"""
+import os
+import sqlite3
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migracoes import (aplicar_migracoes, reconstruir_saldos_diarios, reconstruir_resumo_mensal,
+                       reconstruir_posicoes_investimentos)
+
+COMPARTILHADOS = ['100% Silvia', '100% Nelson', '50/50']
+
+def copiar_banco(origem, destino):
+    """Copia o banco pela API de backup (inclui o que ainda está no WAL) e migra a cópia."""
+    conn_origem = sqlite3.connect(f'file:{origem}?mode=ro', uri=True)
+    conn = sqlite3.connect(destino)
+    conn_origem.backup(conn)
+    conn_origem.close()
+    aplicar_migracoes(conn)
+    conn.execute('ANALYZE')
+    conn.close()
+    return destino
+
+def criar_banco_sintetico(caminho, movimentos=400000, transferencias=50000, contas=4, categorias=80, anos=5,
+                          semente=42):
+    import numpy as np
+    if os.path.exists(caminho): os.remove(caminho)
+    rng = np.random.default_rng(semente)
+    conn = sqlite3.connect(caminho)
+    aplicar_migracoes(conn)
+    # Arquivo descartável: sem journal e com cache grande
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -500000')
+    conn.executemany('INSERT INTO instituicoes (descricao) VALUES (?)', [(f'Banco {n}',) for n in range(1, contas + 1)])
+    conn.executemany('INSERT INTO categorias (descricao, tipo) VALUES (?, ?)',
+                     [(f'Categoria {n:02d}', 'Receita' if n % 8 == 0 else 'Despesa') for n in range(1, categorias + 1)])
+    conn.executemany('INSERT INTO cartoes_credito (descricao, instituicao_id, vencimento, limite) VALUES (?, ?, ?, ?)',
+                     [('Cartão 1', 1, 10, 15000.0), ('Cartão 2', min(2, contas), 20, 20000.0)])
+
+    # Índices dos lançamentos recriados depois da carga: ordenar uma vez custa menos que inserir fora de ordem
+    indices = conn.execute('''SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL
+                              AND tbl_name IN ('movimentos', 'transferencias')''').fetchall()
+    for nome, _ in indices:
+        conn.execute(f'DROP INDEX {nome}')
+
+    hoje = date.today()
+    primeiro = np.datetime64(hoje.replace(year=hoje.year - anos))
+    total_dias = int((np.datetime64(hoje) - primeiro).astype(int))
+
+    def datas(quantidade):
+        return np.sort(primeiro + rng.integers(0, total_dias, quantidade)).astype(str).tolist()
+
+    data_mov = datas(movimentos)
+    efetivado = (rng.random(movimentos) < 0.9).tolist()
+    cartao = rng.choice(np.array([None, None, None, 1, 2], dtype=object), movimentos).tolist()
+    conn.executemany('''INSERT INTO movimentos (data_movimento, data_efetivacao, descricao, categoria_id, instituicao_id,
+                        cartao_id, valor_centavos, status, compartilhado) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                     zip(data_mov, [d if e else None for d, e in zip(data_mov, efetivado)], ['Lançamento'] * movimentos,
+                         rng.integers(1, categorias + 1, movimentos).tolist(),
+                         rng.integers(1, contas + 1, movimentos).tolist(), cartao,
+                         rng.integers(-80000, 80001, movimentos).tolist(),
+                         ['Efetivado' if e else 'Pendente' for e in efetivado],
+                         rng.choice(COMPARTILHADOS, movimentos).tolist()))
+
+    data_transf = datas(transferencias)
+    origem = rng.integers(1, contas + 1, transferencias)
+    # 30% pagamentos de fatura; o resto vai para outra conta (deslocamento de 1 a contas-1)
+    fatura = ((rng.random(transferencias) < 0.3) | (contas == 1)).tolist()
+    destino = ((origem - 1 + rng.integers(1, max(contas, 2), transferencias)) % contas + 1).tolist()
+    cartao = rng.integers(1, 3, transferencias).tolist()
+    conn.executemany('''INSERT INTO transferencias (data_transferencia, data_efetivacao, descricao, conta_origem_id,
+                        conta_destino_id, cartao_id, valor_centavos, status, tipo_transferencia, compartilhado)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                     zip(data_transf, data_transf, ['Transferência'] * transferencias, origem.tolist(),
+                         [None if f else d for f, d in zip(fatura, destino)], [c if f else None for f, c in zip(fatura, cartao)],
+                         rng.integers(100, 500001, transferencias).tolist(), ['Efetivado'] * transferencias,
+                         ['Pagamento Fatura' if f else 'Entre Contas' for f in fatura],
+                         rng.choice(COMPARTILHADOS, transferencias).tolist()))
+
+    for _, sql in indices:
+        conn.execute(sql)
+    reconstruir_saldos_diarios(conn)
+    reconstruir_resumo_mensal(conn)
+    reconstruir_posicoes_investimentos(conn)
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.close()
+    return caminho
+
+def preparar_banco(args, pasta, **parametros):
+    """Banco usado pelo benchmark: cópia migrada de --banco ou um banco sintético novo."""
+    destino = os.path.join(pasta, 'financas.db')
+    if args.banco:
+        return copiar_banco(args.banco, destino)
+    return criar_banco_sintetico(destino, **parametros)
@@ -0,0 +1,84 @@
+"""
+Benchmark das consultas do extrato da conta (user-012).
+
+Mede a consulta que extrato_conta() executa nos três ramos de período (sem datas, só início,
+início e fim), na forma atual (faixa sobre a coluna indexada dia_efetivacao) e na forma
+anterior (date(data_efetivacao) comparado com date(?), que impede o uso do índice no período).
+Para cada uma imprime o EXPLAIN QUERY PLAN e o tempo mínimo e mediano.
+
+    python scripts/bench_extrato.py                        # banco sintético (400 mil movimentos)
+    python scripts/bench_extrato.py --banco financas.db    # cópia migrada de um banco real
+
+O banco informado em --banco não é alterado: o benchmark roda sobre uma cópia temporária.
+"""
+import argparse
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from banco_sintetico import preparar_banco
+
+RAMOS = [
+    ('sem período', None, None),
+    ('só início', 'inicio', None),
+    ('início e fim', 'inicio', 'fim'),
+]
+
+def forma_anterior(sql):
+    """A mesma consulta com o filtro de período sobre date(data_efetivacao), como antes da migração 6."""
+    return re.sub(r'(\w+)\.dia_efetivacao ([<>]=?) date\(', r'date(\1.data_efetivacao) \2 date(', sql)
+
+def cronometrar(conn, sql, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        conn.execute(sql).fetchall()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return min(tempos), statistics.median(tempos)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--banco', help='banco a copiar (padrão: gera um banco sintético)')
+    parser.add_argument('--movimentos', type=int, default=400000)
+    parser.add_argument('--transferencias', type=int, default=50000)
+    parser.add_argument('--repeticoes', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = preparar_banco(args, pasta, movimentos=args.movimentos, transferencias=args.transferencias)
+        import app as modulo_app
+        modulo_app.app.config['DATABASE'] = caminho
+        conn = modulo_app._nova_conexao(somente_leitura=True)
+
+        conta, = conn.execute('''SELECT instituicao_id FROM movimentos WHERE status = 'Efetivado' AND cartao_id IS NULL
+                                 GROUP BY instituicao_id ORDER BY COUNT(*) DESC LIMIT 1''').fetchone()
+        primeiro, ultimo = conn.execute('SELECT MIN(dia_efetivacao), MAX(dia_efetivacao) FROM movimentos').fetchone()
+        # Período de um mês no fim do histórico, como o extrato costuma ser consultado
+        datas = {'inicio': ultimo[:8] + '01', 'fim': ultimo}
+        total, = conn.execute('SELECT COUNT(*) FROM movimentos').fetchone()
+        print(f'{total} movimentos; conta {conta}; histórico de {primeiro} a {ultimo}; período {datas["inicio"]} a {datas["fim"]}')
+
+        for nome, inicio, fim in RAMOS:
+            # O SQL exato que extrato_conta monta para o ramo, com os parâmetros expandidos
+            capturado = []
+            conn.set_trace_callback(capturado.append)
+            modulo_app.extrato_conta(conn, conta, datas.get(inicio), datas.get(fim))
+            conn.set_trace_callback(None)
+            sql = next(s for s in capturado if 'lancamentos' in s)
+
+            formas = [('atual', sql)]
+            if inicio or fim: formas.append(('date(data_efetivacao)', forma_anterior(sql)))
+            for forma, consulta in formas:
+                minimo, mediana = cronometrar(conn, consulta, args.repeticoes)
+                print(f'\n=== {nome} — {forma}: mínimo {minimo:.2f} ms, mediana {mediana:.2f} ms')
+                for linha in conn.execute('EXPLAIN QUERY PLAN ' + consulta):
+                    if linha[3].startswith(('SCAN', 'SEARCH')): print('   ', linha[3])
+        conn.close()
+
+if __name__ == '__main__':
+    main()
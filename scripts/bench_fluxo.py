@@ -0,0 +1,89 @@
+"""
+Benchmark da formatação em reais do relatório de fluxo (user-015).
+
+1. Pivô de 80 categorias x 61 colunas (5 anos + Média): df.map com o format_brl escalar sem
+   cache, como era antes, contra format_brl_frame.
+2. /relatorio/fluxo de 5 anos com 80 categorias: tempo da requisição e parcela gasta formatando,
+   com a formatação vetorizada atual e com a formatação célula a célula no lugar dela.
+
+    python scripts/bench_fluxo.py                        # banco sintético (5 anos, 80 categorias)
+    python scripts/bench_fluxo.py --banco financas.db    # cópia migrada de um banco real
+
+O banco informado em --banco não é alterado: o benchmark roda sobre uma cópia temporária.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from banco_sintetico import preparar_banco
+
+def cronometrar(funcao, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tempos)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--banco', help='banco a copiar (padrão: gera um banco sintético)')
+    parser.add_argument('--movimentos', type=int, default=20000)
+    parser.add_argument('--repeticoes', type=int, default=20)
+    args = parser.parse_args()
+
+    import numpy as np
+    import pandas as pd
+    import formatacao
+
+    # ===== 1. PIVÔ ISOLADO =====
+    rng = np.random.default_rng(42)
+    pivot = pd.DataFrame(rng.normal(0, 5000, (80, 61)).round(2), columns=[f'c{n}' for n in range(61)])
+    por_celula = cronometrar(lambda: pivot.map(formatacao._format_brl), args.repeticoes)
+    vetorizado = cronometrar(lambda: formatacao.format_brl_frame(pivot), args.repeticoes)
+    print(f'Pivô 80 x 61: df.map(format_brl) {por_celula:.1f} ms -> format_brl_frame {vetorizado:.1f} ms')
+
+    # ===== 2. /relatorio/fluxo =====
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = preparar_banco(args, pasta, movimentos=args.movimentos, transferencias=1000, categorias=80, anos=5)
+        import app as modulo_app
+        # Sem cache de relatórios: toda requisição recalcula a página
+        modulo_app.create_app({'DATABASE': caminho, 'UPLOAD_FOLDER': os.path.join(pasta, 'uploads'),
+                               'CACHE_RELATORIOS_MAX_BYTES': 0})
+        client = modulo_app.app.test_client()
+
+        formatacoes = {
+            'vetorizada': (formatacao.format_brl_frame, formatacao.format_brl_array),
+            'célula a célula': (lambda df: df.map(formatacao._format_brl),
+                                lambda valores: np.array([formatacao._format_brl(v) for v in valores], dtype=object)),
+        }
+        for nome, (formatar_frame, formatar_array) in formatacoes.items():
+            gasto = [0.0]
+            def medir(funcao):
+                def medida(*a, **k):
+                    inicio = time.perf_counter()
+                    try: return funcao(*a, **k)
+                    finally: gasto[0] += time.perf_counter() - inicio
+                return medida
+            modulo_app.format_brl_frame, modulo_app.format_brl_array = medir(formatar_frame), medir(formatar_array)
+
+            client.get('/relatorio/fluxo')  # aquecimento: importações e cache de páginas do SQLite
+            totais, formatando = [], []
+            for _ in range(args.repeticoes):
+                gasto[0] = 0.0
+                inicio = time.perf_counter()
+                resposta = client.get('/relatorio/fluxo')
+                totais.append((time.perf_counter() - inicio) * 1000)
+                formatando.append(gasto[0] * 1000)
+                assert resposta.status_code == 200
+            total, formatacao_ms = statistics.median(totais), statistics.median(formatando)
+            print(f'/relatorio/fluxo, formatação {nome}: requisição {total:.1f} ms, '
+                  f'formatando {formatacao_ms:.1f} ms ({formatacao_ms / total:.0%})')
+
+if __name__ == '__main__':
+    main()
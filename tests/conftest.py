@@ -0,0 +1,106 @@
+"""
+Fixtures compartilhadas dos testes: um banco temporário migrado com aplicar_migracoes() e
+preenchido com alguns milhares de lançamentos, e o app configurado para usá-lo.
+"""
+import os
+import random
+import sqlite3
+import sys
+from datetime import date, timedelta
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+from migracoes import (aplicar_migracoes, reconstruir_saldos_diarios, reconstruir_resumo_mensal,
+                       reconstruir_posicoes_investimentos)
+
+INICIO_DADOS = date(2023, 1, 1)
+DIAS_DADOS = 730
+COMPARTILHADOS = ['100% Silvia', '100% Nelson', '50/50']
+
+def popular_banco(conn, movimentos=5000, transferencias=800, investimentos=300, semente=42):
+    """Cadastros e lançamentos aleatórios (mas reprodutíveis) espalhados por dois anos."""
+    rnd = random.Random(semente)
+    conn.executemany('INSERT INTO instituicoes (descricao) VALUES (?)', [(f'Banco {n}',) for n in range(1, 5)])
+    conn.executemany('INSERT INTO categorias (descricao, tipo) VALUES (?, ?)',
+                     [(f'Categoria {n}', 'Receita' if n <= 2 else 'Despesa') for n in range(1, 11)])
+    conn.executemany('INSERT INTO cartoes_credito (descricao, instituicao_id, vencimento, limite) VALUES (?, ?, ?, ?)',
+                     [('Cartão 1', 1, 10, 5000.0), ('Cartão 2', 2, 20, 8000.0)])
+    conn.executemany('INSERT INTO tickers (descricao, classe, tipo) VALUES (?, ?, ?)',
+                     [(f'TICK{n}', 'Ações', 'Renda Variável') for n in range(1, 21)])
+    conn.executemany('INSERT INTO moedas (codigo, descricao) VALUES (?, ?)', [('BRL', 'Real')])
+    conn.executemany('INSERT INTO operacoes (descricao, natureza) VALUES (?, ?)', [('Compra', 'Entrada'), ('Venda', 'Saida')])
+
+    def dia():
+        return (INICIO_DADOS + timedelta(days=rnd.randrange(DIAS_DADOS))).isoformat()
+
+    linhas = []
+    for _ in range(movimentos):
+        data_mov = dia()
+        efetivado = rnd.random() < 0.8
+        linhas.append((data_mov, data_mov if efetivado else None, 'Lançamento', rnd.randint(1, 10), rnd.randint(1, 4),
+                       rnd.choice([None, None, 1, 2]), rnd.randint(-50000, 50000),
+                       'Efetivado' if efetivado else 'Pendente', rnd.choice(COMPARTILHADOS)))
+    conn.executemany('''INSERT INTO movimentos (data_movimento, data_efetivacao, descricao, categoria_id, instituicao_id,
+                        cartao_id, valor_centavos, status, compartilhado) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', linhas)
+
+    linhas = []
+    for _ in range(transferencias):
+        data_transf = dia()
+        origem = rnd.randint(1, 4)
+        if rnd.random() < 0.3:
+            destino, cartao, tipo = None, rnd.randint(1, 2), 'Pagamento Fatura'
+        else:
+            destino, cartao, tipo = rnd.choice([n for n in range(1, 5) if n != origem]), None, 'Entre Contas'
+        linhas.append((data_transf, data_transf, 'Transferência', origem, destino, cartao, rnd.randint(100, 200000),
+                       'Efetivado', tipo, rnd.choice(COMPARTILHADOS)))
+    conn.executemany('''INSERT INTO transferencias (data_transferencia, data_efetivacao, descricao, conta_origem_id,
+                        conta_destino_id, cartao_id, valor_centavos, status, tipo_transferencia, compartilhado)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', linhas)
+
+    linhas = [(dia(), rnd.randint(1, 20), 1, 1, rnd.randint(1, 100), rnd.randint(1000, 500000), rnd.randint(1, 4))
+              for _ in range(investimentos)]
+    conn.executemany('''INSERT INTO investimentos (data_investimento, ticker_id, operacao_id, moeda_id, quantidade,
+                        valor_total_centavos, instituicao_id) VALUES (?, ?, ?, ?, ?, ?, ?)''', linhas)
+
+    reconstruir_saldos_diarios(conn)
+    reconstruir_resumo_mensal(conn)
+    reconstruir_posicoes_investimentos(conn)
+    conn.commit()
+    conn.execute('ANALYZE')
+
+@pytest.fixture(scope='session')
+def banco(tmp_path_factory):
+    """Caminho de um banco novo, migrado do zero e populado."""
+    caminho = str(tmp_path_factory.mktemp('banco') / 'financas.db')
+    conn = sqlite3.connect(caminho)
+    aplicar_migracoes(conn)
+    popular_banco(conn)
+    conn.close()
+    return caminho
+
+@pytest.fixture(scope='session')
+def app_teste(banco, tmp_path_factory):
+    import app as modulo_app
+    return modulo_app.create_app({'DATABASE': banco, 'UPLOAD_FOLDER': str(tmp_path_factory.mktemp('uploads')),
+                                  'TESTING': True})
+
+@pytest.fixture
+def client(app_teste):
+    return app_teste.test_client()
+
+@pytest.fixture
+def banco_isolado(app_teste, banco, tmp_path):
+    """Banco pequeno só deste teste, para os que gravam lançamentos; depois o app volta ao banco da sessão."""
+    import app as modulo_app
+    caminho = str(tmp_path / 'financas.db')
+    conn = sqlite3.connect(caminho)
+    aplicar_migracoes(conn)
+    popular_banco(conn, movimentos=300, transferencias=60, investimentos=20)
+    conn.close()
+    modulo_app.create_app({'DATABASE': caminho})
+    yield caminho
+    modulo_app.create_app({'DATABASE': banco})
@@ -0,0 +1,52 @@
+"""format_brl_array / format_brl_frame devolvem exatamente o texto de format_brl célula a célula."""
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from formatacao import format_brl, format_brl_array, format_brl_frame
+
+CASOS_ESPECIAIS = [
+    0.0, -0.0, math.nan, math.inf, -math.inf, 1e17, -1e17, 1e15 + 0.01, 2.0 ** 53 / 100, 9.99e20,
+    0.005, 0.015, 0.025, 1.005, 2.675, -2.675, 1234.565, -0.004, 0.004, 0.0049999, 999.995, 999999.995,
+    1234.56, -1234.56, 1000000, -1, 0.01, -0.01, 0.1 + 0.2, 1e-9, -1e-9,
+]
+
+def esperado(valores):
+    return [format_brl(v) for v in valores]
+
+def test_valores_conhecidos():
+    assert list(format_brl_array([1234.56, -1234.56, 0, -0.0, math.nan, 1e6, 0.5])) == [
+        'R$ 1.234,56', 'R$ -1.234,56', 'R$ 0,00', 'R$ 0,00', 'R$ 0,00', 'R$ 1.000.000,00', 'R$ 0,50']
+
+def test_casos_especiais():
+    assert list(format_brl_array(CASOS_ESPECIAIS)) == esperado(CASOS_ESPECIAIS)
+
+@pytest.mark.parametrize('escala', [1, 100, 1e4, 1e8, 1e12])
+def test_valores_aleatorios(escala):
+    rng = np.random.default_rng(int(escala))
+    valores = np.concatenate([
+        rng.integers(-10 ** 9, 10 ** 9, 20000) / 100,  # centavos exatos
+        rng.normal(0, escala, 20000),
+        (rng.integers(-10 ** 7, 10 ** 7, 5000) + 0.5) / 100,  # meio centavo
+    ])
+    assert list(format_brl_array(valores)) == esperado(valores.tolist())
+
+def test_valores_nao_numericos():
+    valores = [1.5, 'abc', None, 2]
+    assert list(format_brl_array(valores)) == esperado(valores)
+
+def test_forma_preservada():
+    valores = np.array([[1.0, -2.5], [math.nan, 1e17]])
+    resultado = format_brl_array(valores)
+    assert resultado.shape == (2, 2)
+    assert resultado.ravel().tolist() == esperado(valores.ravel().tolist())
+
+def test_frame_igual_a_map():
+    rng = np.random.default_rng(7)
+    df = pd.DataFrame(rng.normal(0, 5000, (80, 61)).round(2), columns=[f'c{n}' for n in range(61)])
+    df.iloc[0, 0] = -0.0
+    df.iloc[1, 1] = math.nan
+    df.iloc[2, 2] = 1e17
+    assert format_brl_frame(df).equals(df.map(format_brl))
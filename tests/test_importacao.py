@@ -0,0 +1,49 @@
+"""
+Importar o app não carrega pandas, NumPy nem openpyxl: eles só são importados pelas rotas que
+os usam. Cada verificação roda num processo novo, já que este processo de testes os importou.
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Tempo cumulativo máximo de "import app" (python -X importtime). Sem as bibliotecas de dados
+# fica em ~300 ms (quase tudo Flask); com pandas de volta no import passa de 650 ms.
+ORCAMENTO_IMPORT_MS = 600
+MODULOS_PESADOS = ('pandas', 'numpy', 'openpyxl')
+
+def rodar_python(codigo, env=None, *opcoes):
+    return subprocess.run([sys.executable, *opcoes, '-c', codigo], cwd=RAIZ, capture_output=True, text=True,
+                          env={**os.environ, **(env or {})}, check=True)
+
+def tempo_import_app_ms():
+    saida = rodar_python('import app', None, '-X', 'importtime').stderr
+    # Linhas "import time: self [us] | cumulative | imported package"
+    encontrado = re.search(r'^import time:\s+\d+ \|\s+(\d+) \| app$', saida, re.M)
+    assert encontrado, saida[-2000:]
+    return int(encontrado.group(1)) / 1000
+
+def test_import_app_dentro_do_orcamento():
+    # O menor de três tempos: o que interessa é o custo do import, não o ruído da máquina
+    melhor = min(tempo_import_app_ms() for _ in range(3))
+    assert melhor < ORCAMENTO_IMPORT_MS, f'import app levou {melhor:.0f} ms (orçamento {ORCAMENTO_IMPORT_MS} ms)'
+
+def test_cadastros_nao_carregam_bibliotecas_de_dados(banco, tmp_path):
+    # Sobe pelo wsgi.py, como em produção, apontando para o banco de teste pelas variáveis FINANCAS_*
+    codigo = f'''
+import json, sys
+from wsgi import app
+carregados = {{'create_app': [m for m in {MODULOS_PESADOS!r} if m in sys.modules]}}
+client = app.test_client()
+for rota in ('/categorias', '/instituicoes', '/cartoes', '/movimentos'):
+    assert client.get(rota).status_code == 200, rota
+    carregados[rota] = [m for m in {MODULOS_PESADOS!r} if m in sys.modules]
+print(json.dumps(carregados))
+'''
+    env = {'FINANCAS_DATABASE': banco, 'FINANCAS_UPLOAD_FOLDER': str(tmp_path / 'uploads')}
+    carregados = json.loads(rodar_python(codigo, env).stdout.strip().splitlines()[-1])
+    assert carregados == {etapa: [] for etapa in carregados}
+    assert set(carregados) == {'create_app', '/categorias', '/instituicoes', '/cartoes', '/movimentos'}
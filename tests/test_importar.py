@@ -0,0 +1,94 @@
+"""
+Importação em etapas: o arquivo validado vai para importacoes/importacao_linhas, a revisão corrige
+as linhas com erro pelos campos <campo>_<linha> e a confirmação grava tudo numa transação só.
+"""
+import io
+import sqlite3
+
+import pytest
+
+ARQUIVO = '''data;descricao;categoria;conta;cartao;valor;status;compartilhado
+2024-05-01;Mercado;Categoria 3;Banco 1;;12,50;Efetivado;50/50
+02/05/2024;Salário;Categoria 1;Banco 2;;3000;Efetivado;100% Nelson
+2024-05-03;Padaria;Categoria X;Banco 1;;7,20;Pendente;50/50
+2024-05-04;Farmácia;Categoria 4;Banco 9;Cartão 1;40;efetivado;50/50
+2024-05-05;Sem valor;Categoria 4;Banco 1;;abc;Efetivado;50/50
+'''
+
+def consultar(banco, sql, params=()):
+    conn = sqlite3.connect(banco)
+    try: return conn.execute(sql, params).fetchall()
+    finally: conn.close()
+
+def mensagens(client):
+    with client.session_transaction() as sessao:
+        return [mensagem for _, mensagem in sessao.pop('_flashes', [])]
+
+def enviar(client, conteudo=ARQUIVO):
+    """Envia o arquivo e segue até a revisão; devolve o id da importação no staging."""
+    resposta = client.post('/importar', data={'arquivo': (io.BytesIO(conteudo.encode()), 'extrato.csv')},
+                           content_type='multipart/form-data')
+    assert resposta.status_code == 302 and '/importar/validar/extrato.csv' in resposta.location
+    resposta = client.get(resposta.location)
+    assert resposta.status_code == 302 and '/importar/revisar/' in resposta.location, mensagens(client)
+    return resposta.location.rsplit('/', 1)[1]
+
+def test_staging_revisao_e_confirmacao(client, banco_isolado):
+    importacao_id = enviar(client)
+    assert consultar(banco_isolado, 'SELECT arquivo, total_linhas, linhas_com_erro FROM importacoes WHERE id = ?',
+                     (importacao_id,)) == [('extrato.csv', 5, 3)]
+    assert consultar(banco_isolado, '''SELECT linha, data_movimento, categoria_id, instituicao_id, cartao_id, valor, status, erros
+                                       FROM importacao_linhas WHERE importacao_id = ? ORDER BY linha''', (importacao_id,)) == [
+        (1, '2024-05-01', 3, 1, None, '12.50', 'Efetivado', None),
+        (2, '2024-05-02', 1, 2, None, '3000', 'Efetivado', None),
+        (3, '2024-05-03', None, 1, None, '7.20', 'Pendente', "Categoria 'Categoria X' ?"),
+        (4, '2024-05-04', 4, None, 1, '40', 'Efetivado', "Conta 'Banco 9' ?"),
+        (5, '2024-05-05', 4, 1, None, 'abc', 'Efetivado', "Valor 'abc' ?"),
+    ]
+    revisao = client.get(f'/importar/revisar/{importacao_id}')
+    assert revisao.status_code == 200
+    pagina = revisao.get_data(as_text=True)
+    # Só as células com erro viram campos de correção
+    assert 'name="categoria_id_3"' in pagina and 'name="instituicao_id_4"' in pagina
+    assert 'name="categoria_id_1"' not in pagina and 'name="instituicao_id_3"' not in pagina
+
+    ultimo_id = consultar(banco_isolado, 'SELECT MAX(id) FROM movimentos')[0][0]
+    # Linhas 3 e 4 corrigidas na tela; a 5 continua com valor inválido e fica de fora
+    resposta = client.post('/importar/salvar', data={'importacao_id': importacao_id,
+                                                     'categoria_id_3': '5', 'instituicao_id_4': '2'})
+    assert resposta.status_code == 302
+    assert mensagens(client) == ['Linha 5 (Sem valor) ignorada: valor inválido.',
+                                 '4 de 5 movimentos importados com sucesso!']
+    assert consultar(banco_isolado, '''SELECT id, data_movimento, data_efetivacao, descricao, categoria_id, instituicao_id,
+                                       cartao_id, valor_centavos, status, compartilhado
+                                       FROM movimentos WHERE id > ? ORDER BY id''', (ultimo_id,)) == [
+        (ultimo_id + 1, '2024-05-01', '2024-05-01', 'Mercado', 3, 1, None, -1250, 'Efetivado', '50/50'),
+        (ultimo_id + 2, '2024-05-02', '2024-05-02', 'Salário', 1, 2, None, 300000, 'Efetivado', '100% Nelson'),
+        (ultimo_id + 3, '2024-05-03', None, 'Padaria', 5, 1, None, -720, 'Pendente', '50/50'),
+        (ultimo_id + 4, '2024-05-04', '2024-05-04', 'Farmácia', 4, 2, 1, -4000, 'Efetivado', '50/50'),
+    ]
+    assert consultar(banco_isolado, 'SELECT COUNT(*) FROM importacoes')[0][0] == 0
+    assert consultar(banco_isolado, 'SELECT COUNT(*) FROM importacao_linhas')[0][0] == 0
+
+def test_cancelar_remove_o_staging(client, banco_isolado):
+    mantida, cancelada = enviar(client), enviar(client)
+    resposta = client.post(f'/importar/cancelar/{cancelada}')
+    assert resposta.status_code == 302
+    assert mensagens(client) == ['Importação cancelada.']
+    assert consultar(banco_isolado, 'SELECT id FROM importacoes') == [(mantida,)]
+    assert consultar(banco_isolado, 'SELECT DISTINCT importacao_id FROM importacao_linhas') == [(mantida,)]
+    assert client.get(f'/importar/revisar/{cancelada}').status_code == 302
+
+def test_falha_na_confirmacao_nao_grava_nada(client, banco_isolado, monkeypatch):
+    import app as modulo_app
+    importacao_id = enviar(client)
+    tabelas = ('movimentos', 'saldos_diarios', 'resumo_mensal', 'importacoes', 'importacao_linhas')
+    antes = {tabela: consultar(banco_isolado, f'SELECT * FROM {tabela}') for tabela in tabelas}
+    # Falha depois do executemany, ainda dentro da transação
+    def falha(*args, **kwargs): raise sqlite3.OperationalError('disk I/O error')
+    monkeypatch.setattr(modulo_app, 'somar_resumo_mensal', falha)
+    resposta = client.post('/importar/salvar', data={'importacao_id': importacao_id, 'categoria_id_3': '5',
+                                                     'instituicao_id_4': '2'})
+    assert resposta.status_code == 302
+    assert mensagens(client)[-1] == 'Erro DB: disk I/O error. Nenhuma linha salva.'
+    assert {tabela: consultar(banco_isolado, f'SELECT * FROM {tabela}') for tabela in tabelas} == antes
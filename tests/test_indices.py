@@ -0,0 +1,103 @@
+"""
+Os relatórios usam os índices criados pelas migrações: cada consulta que lê movimentos,
+transferências ou investimentos tem de resolver por SEARCH ou por um SCAN sobre índice,
+nunca por varredura da tabela inteira.
+
+As consultas são as que as rotas realmente executam: o teste atende a requisição com o
+trace do sqlite3 ligado e roda EXPLAIN QUERY PLAN em cada SELECT capturado.
+"""
+import re
+import sqlite3
+
+import pytest
+
+import app as modulo_app
+
+RE_TABELA = re.compile(r'\b(movimentos|transferencias|investimentos)\b(?:\s+(?:AS\s+)?(\w+))?', re.I)
+PALAVRAS_SQL = {'on', 'where', 'join', 'left', 'inner', 'cross', 'order', 'group', 'union', 'limit', 'using', 'window'}
+RE_PASSO = re.compile(r'^(SCAN|SEARCH) (\w+)')
+
+# Rota e índices que o plano das consultas dela tem de usar
+EXTRATO = {'idx_movimentos_conta_dia', 'idx_transferencias_origem_dia', 'idx_transferencias_destino_dia'}
+ROTAS = [
+    # Listagem de movimentos por keyset: primeira página, página seguinte e período
+    ('/movimentos', {'idx_movimentos_data'}),
+    ('/movimentos?cursor_data=2024-06-30&cursor_id=2500', {'idx_movimentos_data'}),
+    ('/movimentos?data_inicio=2024-01-01&data_fim=2024-03-31', {'idx_movimentos_data'}),
+    ('/api/movimentos?cursor_data=2024-06-30&cursor_id=2500&limite=50', {'idx_movimentos_data'}),
+    # SQL_EXTRATO nos três ramos: sem período, só início, início e fim
+    ('/relatorio/extrato?instituicao_id=1', EXTRATO),
+    ('/relatorio/extrato?instituicao_id=2&data_inicio=2024-01-01', EXTRATO),
+    ('/relatorio/extrato?instituicao_id=3&data_inicio=2024-01-01&data_fim=2024-06-30', EXTRATO),
+    # Gastos por cartão e pagamentos de fatura por cartão
+    ('/relatorio/cartoes?mes=2024-03', {'idx_movimentos_cartao_data', 'idx_transferencias_cartao'}),
+    ('/relatorio/cartoes?mes=2024-03&compartilhado=50/50', {'idx_movimentos_data', 'idx_transferencias_cartao'}),
+    ('/transferencias', {'idx_transferencias_data'}),
+    ('/investimentos', {'idx_investimentos_data'}),
+]
+
+@pytest.fixture
+def consultas(app_teste, monkeypatch):
+    """Lista que recebe o texto (com os parâmetros já expandidos) de cada SQL executado nas rotas."""
+    capturadas = []
+    nova_conexao = modulo_app._nova_conexao
+
+    def nova_conexao_com_trace(*args, **kwargs):
+        conn = nova_conexao(*args, **kwargs)
+        conn.set_trace_callback(capturadas.append)
+        return conn
+
+    # As conexões ociosas do pool não têm o trace: descarta e deixa o pool abrir novas
+    modulo_app.pool_conexoes.fechar()
+    modulo_app.pool_leitura.fechar()
+    monkeypatch.setattr(modulo_app, '_nova_conexao', nova_conexao_com_trace)
+    yield capturadas
+    monkeypatch.undo()
+    modulo_app.pool_conexoes.fechar()
+    modulo_app.pool_leitura.fechar()
+
+def aliases_grandes(sql):
+    """Nomes pelos quais as tabelas grandes aparecem no plano (o alias, se houver)."""
+    nomes = set()
+    for tabela, alias in RE_TABELA.findall(sql):
+        nomes.add(alias if alias and alias.lower() not in PALAVRAS_SQL else tabela)
+    return nomes
+
+def plano(conn, sql):
+    return [linha[3] for linha in conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+
+@pytest.mark.parametrize('rota, indices_esperados', ROTAS, ids=[rota for rota, _ in ROTAS])
+def test_consultas_dos_relatorios_usam_indice(rota, indices_esperados, client, consultas):
+    resposta = client.get(rota)
+    assert resposta.status_code == 200
+
+    selects = [sql for sql in consultas
+               if re.match(r'\s*(SELECT|WITH)\b', sql, re.I) and RE_TABELA.search(sql)]
+    assert selects, f'{rota} não consultou nenhuma tabela de lançamentos'
+
+    usados = set()
+    conn = modulo_app._nova_conexao(somente_leitura=True)
+    try:
+        for sql in selects:
+            passos = plano(conn, sql)
+            nomes = aliases_grandes(sql)
+            texto = '\n'.join(passos)
+            assert 'USING INDEX' in texto or 'USING COVERING INDEX' in texto, f'{rota}: sem índice\n{sql}\n{texto}'
+            for passo in passos:
+                encontrado = RE_PASSO.match(passo)
+                if not encontrado or encontrado.group(2) not in nomes:
+                    continue
+                assert not (encontrado.group(1) == 'SCAN' and 'USING' not in passo), \
+                    f'{rota}: varredura completa em {encontrado.group(2)}\n{sql}\n{texto}'
+            usados.update(re.findall(r'USING (?:COVERING )?INDEX (\w+)', texto))
+    finally:
+        conn.close()
+    assert indices_esperados <= usados, f'{rota}: esperava {sorted(indices_esperados)}, usou {sorted(usados)}'
+
+def test_indices_das_migracoes_existem(banco):
+    """Os índices esperados acima sobrevivem às migrações que recriam tabelas."""
+    conn = sqlite3.connect(banco)
+    indices = {nome for (nome,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    conn.close()
+    for _, esperados in ROTAS:
+        assert esperados <= indices
@@ -0,0 +1,34 @@
+"""Valores não finitos em custos, taxas e IRRF voltam como erro de conversão, não como erro 500."""
+import sqlite3
+
+import pytest
+
+FORMULARIO = {'data_investimento': '2024-03-01', 'ticker_id': '1', 'operacao_id': '1', 'moeda_id': '1',
+              'quantidade': '10', 'valor_unitario': '10,50', 'valor_total': '105,00'}
+
+def investimentos(banco):
+    conn = sqlite3.connect(banco)
+    try: return conn.execute('SELECT * FROM investimentos ORDER BY id').fetchall()
+    finally: conn.close()
+
+def mensagens(client):
+    with client.session_transaction() as sessao:
+        return [mensagem for _, mensagem in sessao.get('_flashes', [])]
+
+@pytest.mark.parametrize('campo', ['custos', 'taxas', 'irrf'])
+@pytest.mark.parametrize('valor', ['nan', 'inf', '-inf'])
+def test_add_com_valor_nao_finito(client, banco, campo, valor):
+    antes = investimentos(banco)
+    resposta = client.post('/investimentos/add', data={**FORMULARIO, campo: valor})
+    assert resposta.status_code == 302
+    assert mensagens(client) == ['Erro ao converter valores numéricos. Use ponto ou vírgula como decimal.']
+    assert investimentos(banco) == antes
+
+@pytest.mark.parametrize('campo', ['custos', 'taxas', 'irrf'])
+@pytest.mark.parametrize('valor', ['nan', 'inf', '-inf'])
+def test_edit_com_valor_nao_finito(client, banco, campo, valor):
+    antes = investimentos(banco)
+    resposta = client.post('/investimentos/edit/1', data={**FORMULARIO, campo: valor})
+    assert resposta.status_code == 200
+    assert 'Erro ao converter valores numéricos.' in resposta.get_data(as_text=True)
+    assert investimentos(banco) == antes
@@ -0,0 +1,94 @@
+"""Migrações aplicadas sobre bancos com dados, com as FKs ligadas como o app abre as conexões."""
+import sqlite3
+
+import pytest
+
+import migracoes
+from migracoes import MIGRACOES, aplicar_migracoes, versao_atual
+
+def banco_na_versao(caminho, versao):
+    """Banco novo migrado só até 'versao'."""
+    conn = sqlite3.connect(caminho)
+    todas = migracoes.MIGRACOES
+    migracoes.MIGRACOES = [m for m in todas if m[0] <= versao]
+    try:
+        aplicar_migracoes(conn)
+    finally:
+        migracoes.MIGRACOES = todas
+    return conn
+
+def popular_versao_4(conn):
+    """Lançamentos no esquema anterior aos centavos, com uma transferência ligada a um investimento."""
+    conn.execute("INSERT INTO instituicoes (descricao) VALUES ('Banco A'), ('Banco B')")
+    conn.execute("INSERT INTO categorias (descricao, tipo) VALUES ('Salário', 'Receita'), ('Mercado', 'Despesa')")
+    conn.execute("INSERT INTO tickers (descricao, classe, tipo) VALUES ('PETR4', 'Ações', 'Renda Variável')")
+    conn.execute("INSERT INTO moedas (codigo, descricao) VALUES ('BRL', 'Real')")
+    conn.execute("INSERT INTO operacoes (descricao, natureza) VALUES ('Compra', 'Entrada')")
+    conn.execute('''INSERT INTO movimentos (data_movimento, data_efetivacao, descricao, categoria_id, instituicao_id,
+                    valor, status, compartilhado) VALUES
+                    ('2024-01-05', '2024-01-05', 'Salário', 1, 1, 5000.10, 'Efetivado', '50/50'),
+                    ('2024-01-06', '2024-01-07 10:00:00', 'Mercado', 2, 1, -123.45, 'Efetivado', '50/50')''')
+    conn.execute('''INSERT INTO investimentos (data_investimento, ticker_id, operacao_id, moeda_id, quantidade, valor_total)
+                    VALUES ('2024-01-08', 1, 1, 1, 10, 1000.07)''')
+    conn.execute('''INSERT INTO transferencias (data_transferencia, data_efetivacao, descricao, conta_origem_id,
+                    conta_destino_id, valor, status, tipo_transferencia, investimento_id, compartilhado) VALUES
+                    ('2024-01-08', '2024-01-08', 'Aporte', 1, 2, 1000.07, 'Efetivado', 'Para Investimento', 1, '50/50')''')
+    conn.commit()
+
+@pytest.fixture
+def banco_v4(tmp_path):
+    conn = banco_na_versao(str(tmp_path / 'financas.db'), 4)
+    popular_versao_4(conn)
+    # Como o app abre as conexões (DB_PRAGMAS)
+    conn.execute('PRAGMA foreign_keys = ON')
+    yield conn
+    conn.close()
+
+def test_centavos_com_transferencia_ligada_a_investimento(banco_v4):
+    conn = banco_v4
+    assert aplicar_migracoes(conn) == [versao for versao, _, _ in MIGRACOES if versao > 4]
+    assert versao_atual(conn) == MIGRACOES[-1][0]
+    assert conn.execute('PRAGMA foreign_keys').fetchone()[0] == 1
+    assert conn.execute('PRAGMA foreign_key_check').fetchall() == []
+    assert conn.execute('SELECT investimento_id, valor_centavos FROM transferencias').fetchall() == [(1, 100007)]
+    assert conn.execute('SELECT valor_total_centavos FROM investimentos').fetchall() == [(100007,)]
+    assert conn.execute('SELECT valor_centavos FROM movimentos ORDER BY id').fetchall() == [(500010,), (-12345,)]
+    assert conn.execute('SELECT instituicao_id, data, saldo_centavos FROM saldos_diarios ORDER BY 1, 2').fetchall() == [
+        (1, '2024-01-05', 500010), (1, '2024-01-07', 487665), (1, '2024-01-08', 387658), (2, '2024-01-08', 100007)]
+
+def test_migracao_que_quebra_fk_e_desfeita(banco_v4, monkeypatch):
+    conn = banco_v4
+    def quebra_fk(conn):
+        conn.execute('DELETE FROM investimentos')
+    monkeypatch.setattr(migracoes, 'MIGRACOES', [(5, 'Quebra FK', quebra_fk)])
+    with pytest.raises(sqlite3.IntegrityError, match='transferencias'):
+        aplicar_migracoes(conn)
+    assert versao_atual(conn) == 4
+    assert conn.execute('SELECT COUNT(*) FROM investimentos').fetchone()[0] == 1
+    assert conn.execute('PRAGMA foreign_keys').fetchone()[0] == 1
+
+def test_orfas_anteriores_nao_bloqueiam(banco_v4):
+    conn = banco_v4
+    # Banco antigo criado pelos scripts sem FKs: transferência apontando para investimento inexistente
+    conn.execute('PRAGMA foreign_keys = OFF')
+    conn.execute('UPDATE transferencias SET investimento_id = 99')
+    conn.commit()
+    conn.execute('PRAGMA foreign_keys = ON')
+    aplicar_migracoes(conn)
+    assert versao_atual(conn) == MIGRACOES[-1][0]
+    assert conn.execute('SELECT investimento_id FROM transferencias').fetchall() == [(99,)]
+
+def test_ledger_da_versao_2_em_reais_convertido_na_5(tmp_path):
+    # Banco antigo (scripts originais) com lançamentos, migrado primeiro só até a versão 2
+    conn = banco_na_versao(str(tmp_path / 'financas.db'), 1)
+    popular_versao_4(conn)
+    conn.close()
+    conn = banco_na_versao(str(tmp_path / 'financas.db'), 2)
+    assert conn.execute('SELECT instituicao_id, data, saldo FROM saldos_diarios ORDER BY 1, 2').fetchall() == [
+        (1, '2024-01-05', 5000.10), (1, '2024-01-07', pytest.approx(4876.65)),
+        (1, '2024-01-08', pytest.approx(3876.58)), (2, '2024-01-08', 1000.07)]
+    conn.execute('PRAGMA foreign_keys = ON')
+    aplicar_migracoes(conn)
+    assert conn.execute('SELECT instituicao_id, data, saldo_centavos FROM saldos_diarios ORDER BY 1, 2').fetchall() == [
+        (1, '2024-01-05', 500010), (1, '2024-01-07', 487665), (1, '2024-01-08', 387658), (2, '2024-01-08', 100007)]
+    conn.close()
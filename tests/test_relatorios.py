@@ -0,0 +1,17 @@
+"""Relatórios servidos a partir do cubo mensal."""
+import pytest
+
+@pytest.mark.parametrize('rota', [
+    '/relatorio/fluxo?data_inicio=2024-13-45&data_fim=2024-06-30',
+    '/relatorio/fluxo?data_inicio=abc&data_fim=xyz',
+    '/movimentos/exportar-resumo?formato=csv&data_inicio=01/02/2024',
+    '/movimentos/exportar-resumo?formato=excel&data_fim=2024-02-30',
+])
+def test_periodo_invalido_ignora_o_limite(rota, client):
+    assert client.get(rota).status_code in (200, 302)
+
+def test_periodo_invalido_igual_a_sem_limite(client):
+    parcial = client.get('/movimentos/exportar-resumo?formato=csv&data_inicio=invalida&data_fim=2024-06-30')
+    valido = client.get('/movimentos/exportar-resumo?formato=csv&data_fim=2024-06-30')
+    assert parcial.status_code == 200
+    assert parcial.data == valido.data
@@ -0,0 +1,127 @@
+"""
+O ledger saldos_diarios mantido pelas rotas (estorno e reaplicação a cada escrita, soma incremental
+na importação) fica igual ao que reconstruir_saldos_diarios() calcula do zero.
+"""
+import io
+import sqlite3
+from itertools import accumulate
+
+import pytest
+
+from migracoes import reconstruir_saldos_diarios
+
+def ledger(conn):
+    return conn.execute('SELECT instituicao_id, data, variacao_centavos, saldo_centavos FROM saldos_diarios ORDER BY 1, 2').fetchall()
+
+def conferir_ledger(banco):
+    conn = sqlite3.connect(banco)
+    try:
+        incremental = ledger(conn)
+        # Cada saldo é o acumulado das variações da conta até o dia
+        for conta in {linha[0] for linha in incremental}:
+            linhas = [linha for linha in incremental if linha[0] == conta]
+            assert [linha[3] for linha in linhas] == list(accumulate(linha[2] for linha in linhas)), conta
+        conn.execute('BEGIN')
+        reconstruir_saldos_diarios(conn)
+        reconstruido = ledger(conn)
+        conn.rollback()
+    finally:
+        conn.close()
+    # Um dia cujos lançamentos foram excluídos ou mudaram de data fica com variação 0 no ledger
+    # incremental (e um dia que soma 0 também aparece na reconstrução): só os dias com variação contam
+    assert [linha for linha in incremental if linha[2]] == [linha for linha in reconstruido if linha[2]]
+
+def ultimo_id(banco, tabela):
+    conn = sqlite3.connect(banco)
+    try: return conn.execute(f'SELECT MAX(id) FROM {tabela}').fetchone()[0]
+    finally: conn.close()
+
+def movimento(**campos):
+    return {'data_movimento': '2024-03-10', 'descricao': 'Teste', 'categoria_id': '3', 'instituicao_id': '1',
+            'valor': '150,25', 'status': 'Efetivado', 'compartilhado': '50/50', **campos}
+
+def transferencia(**campos):
+    return {'data_transferencia': '2024-03-12', 'descricao': 'Teste', 'conta_origem_id': '1', 'conta_destino_id': '2',
+            'valor': '500,00', 'status': 'Efetivado', 'tipo_transferencia': 'Entre Contas', 'compartilhado': '50/50', **campos}
+
+def test_movimentos(client, banco_isolado):
+    passos = [
+        ('/movimentos/add', movimento()),
+        ('/movimentos/add', movimento(data_movimento='2023-06-01', categoria_id='1', instituicao_id='2', status='Pendente')),
+        ('/movimentos/add', movimento(cartao_id='1')),
+    ]
+    for rota, dados in passos:
+        assert client.post(rota, data=dados).status_code == 302
+        conferir_ledger(banco_isolado)
+    efetivado, pendente, cartao = (ultimo_id(banco_isolado, 'movimentos') - n for n in (2, 1, 0))
+    passos = [
+        # Pendente -> Efetivado com efetivação em outro dia
+        (f'/movimentos/edit/{pendente}', movimento(data_movimento='2023-06-01', data_efetivacao='2023-06-05',
+                                                   categoria_id='1', instituicao_id='2')),
+        # Muda a data para antes e a conta
+        (f'/movimentos/edit/{efetivado}', movimento(data_movimento='2023-02-01', instituicao_id='3')),
+        # Efetivado -> Pendente
+        (f'/movimentos/edit/{pendente}', movimento(data_movimento='2023-06-01', categoria_id='1', instituicao_id='2',
+                                                   status='Pendente')),
+        # Sai do cartão: passa a contar no ledger
+        (f'/movimentos/edit/{cartao}', movimento(data_movimento='2024-12-30')),
+        # Lançamento já existente no banco
+        ('/movimentos/edit/1', movimento(data_movimento='2023-01-01', valor='99,99')),
+        (f'/movimentos/delete/{efetivado}', {}),
+        ('/movimentos/delete/2', {}),
+    ]
+    for rota, dados in passos:
+        assert client.post(rota, data=dados).status_code == 302
+        conferir_ledger(banco_isolado)
+
+def test_transferencias(client, banco_isolado):
+    passos = [
+        ('/transferencias/add', transferencia()),
+        ('/transferencias/add', transferencia(data_transferencia='2023-08-20', conta_origem_id='3', conta_destino_id='4',
+                                              status='Pendente')),
+        ('/transferencias/add', transferencia(tipo_transferencia='Pagamento Fatura', conta_destino_id='', cartao_id='2')),
+    ]
+    for rota, dados in passos:
+        assert client.post(rota, data=dados).status_code == 302
+        conferir_ledger(banco_isolado)
+    entre_contas, pendente, fatura = (ultimo_id(banco_isolado, 'transferencias') - n for n in (2, 1, 0))
+    passos = [
+        (f'/transferencias/edit/{pendente}', transferencia(data_transferencia='2023-08-20', data_efetivacao='2023-08-22',
+                                                           conta_origem_id='3', conta_destino_id='4')),
+        (f'/transferencias/edit/{entre_contas}', transferencia(data_transferencia='2023-01-15', conta_origem_id='2',
+                                                               conta_destino_id='1', valor='12,34')),
+        (f'/transferencias/edit/{pendente}', transferencia(data_transferencia='2023-08-20', conta_origem_id='3',
+                                                           conta_destino_id='4', status='Pendente')),
+        (f'/transferencias/delete/{fatura}', {}),
+        ('/transferencias/edit/1', transferencia(data_transferencia='2024-12-31')),
+        ('/transferencias/delete/2', {}),
+    ]
+    for rota, dados in passos:
+        assert client.post(rota, data=dados).status_code == 302
+        conferir_ledger(banco_isolado)
+
+@pytest.mark.parametrize('linhas', [
+    # Dias no meio do histórico: entram em dias já existentes e em dias novos e deslocam os saldos seguintes
+    ['2023-03-15;A;Categoria 3;Banco 1;;10,00;Efetivado;50/50', '15/03/2023;B;Categoria 1;Banco 1;;2500;Efetivado;50/50',
+     '2023-03-16;C;Categoria 4;Banco 2;;7,77;Efetivado;50/50', '2023-03-17;D;Categoria 4;Banco 2;Cartão 1;40;Efetivado;50/50',
+     '2023-03-18;E;Categoria 5;Banco 3;;1;Pendente;50/50', '2024-12-31;F;Categoria 2;Banco 4;;1000;Efetivado;50/50',
+     '2022-12-31;G;Categoria 6;Banco 4;;5;Efetivado;50/50'],
+    # Só pendentes e cartão: o ledger não muda
+    ['2023-03-18;E;Categoria 5;Banco 3;;1;Pendente;50/50', '2023-03-17;D;Categoria 4;Banco 2;Cartão 1;40;Efetivado;50/50'],
+])
+def test_importacao(client, banco_isolado, linhas):
+    conn = sqlite3.connect(banco_isolado)
+    antes = ledger(conn)
+    conn.close()
+    arquivo = '\n'.join(['data;descricao;categoria;conta;cartao;valor;status;compartilhado', *linhas]) + '\n'
+    resposta = client.post('/importar', data={'arquivo': (io.BytesIO(arquivo.encode()), 'extrato.csv')},
+                           content_type='multipart/form-data')
+    importacao_id = client.get(resposta.location).location.rsplit('/', 1)[1]
+    assert client.post('/importar/salvar', data={'importacao_id': importacao_id}).status_code == 302
+    with client.session_transaction() as sessao:
+        assert sessao['_flashes'][-1][1] == f'{len(linhas)} de {len(linhas)} movimentos importados com sucesso!'
+    conferir_ledger(banco_isolado)
+    if len(linhas) == 2:
+        conn = sqlite3.connect(banco_isolado)
+        assert ledger(conn) == antes
+        conn.close()
@@ -0,0 +1,128 @@
+"""
+validar_linhas_importacao (colunas inteiras de uma vez) marca as mesmas linhas, com as mesmas
+mensagens, que a validação linha a linha feita antes dela, e só as linhas com erro ganham mensagens.
+"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import validar_linhas_importacao
+
+CATEGORIAS = {'Mercado': (1, 'Despesa'), 'Salário': (2, 'Receita'), 'Saúde': (3, 'Despesa')}
+INSTITUICOES = {'Banco A': 1, 'Banco B': 2}
+CARTOES = {'Visa': 1, 'Master': 2}
+COLUNAS = ['data', 'descricao', 'categoria', 'conta', 'cartao', 'valor', 'status', 'compartilhado']
+# O dayfirst=True do loop antigo avisa a cada data ISO
+pytestmark = pytest.mark.filterwarnings('ignore:Parsing dates in .* when dayfirst=True:UserWarning')
+
+def validar_linha_a_linha(df):
+    """A validação antiga, uma linha por vez com df.iterrows(): devolve [(data, [erros])]."""
+    resultado = []
+    for _, row in df.iterrows():
+        erros = []
+        data = str(row.get('data', '')).strip()
+        try:
+            if isinstance(row.get('data'), datetime): data = row.get('data').strftime('%Y-%m-%d')
+            else:
+                data_obj = pd.to_datetime(data, errors='coerce', dayfirst=True)
+                if pd.isna(data_obj): data_obj = pd.to_datetime(data, errors='raise')
+                data = data_obj.strftime('%Y-%m-%d')
+        except Exception: erros.append(f"Data '{data}' inválida.")
+        categoria_nome = str(row.get('categoria', '')).strip()
+        conta_nome = str(row.get('conta', '')).strip()
+        cartao_nome = str(row.get('cartao', '')).strip()
+        if cartao_nome.lower() == 'nan': cartao_nome = ''
+        valor_str = str(row.get('valor', '0')).replace(',', '.').strip()
+        status = str(row.get('status', '')).strip().title()
+        compartilhado = str(row.get('compartilhado', '')).strip()
+        if categoria_nome not in CATEGORIAS: erros.append(f"Categoria '{categoria_nome}' ?")
+        if conta_nome not in INSTITUICOES: erros.append(f"Conta '{conta_nome}' ?")
+        if cartao_nome and cartao_nome not in CARTOES: erros.append(f"Cartão '{cartao_nome}' ?")
+        if status not in ['Pendente', 'Efetivado']: erros.append(f"Status '{status}' ?")
+        if compartilhado not in ['100% Silvia', '100% Nelson', '50/50']: erros.append(f"Compartilhado '{compartilhado}' ?")
+        try: float(valor_str)
+        except ValueError: erros.append(f"Valor '{valor_str}' ?")
+        resultado.append((data, erros))
+    return resultado
+
+def validar(df):
+    """validar_linhas_importacao no formato da referência: [(data, [erros])] e a contagem de linhas com erro."""
+    linhas, com_erro = validar_linhas_importacao(df, CATEGORIAS, INSTITUICOES, CARTOES)
+    return [(linha[1], linha[-1].split('\n') if linha[-1] else []) for linha in linhas], com_erro
+
+def quadro(*linhas):
+    return pd.DataFrame(list(linhas), columns=COLUNAS)
+
+def valida(**campos):
+    return {'data': '2024-05-01', 'descricao': 'Compra', 'categoria': 'Mercado', 'conta': 'Banco A', 'cartao': np.nan,
+            'valor': '12,50', 'status': 'Efetivado', 'compartilhado': '50/50', **campos}
+
+def conferir(df):
+    resultado, com_erro = validar(df)
+    # Só as mensagens: com dayfirst=True o loop antigo lia '2024-05-01' como 5 de janeiro no pandas 3,
+    # então as datas convertidas são conferidas pelos valores esperados em cada teste
+    assert [erros for _, erros in resultado] == [erros for _, erros in validar_linha_a_linha(df)]
+    assert com_erro == sum(1 for _, erros in resultado if erros)
+    return resultado
+
+def test_formatos_de_data_misturados():
+    datas = ['2024-05-01', '2024-05-01 13:45:00', '02/05/2024', '03-05-2024', '04/05/24', '05.05.2024',
+             '6 de maio', '2024/05/07', 'May 8, 2024', '31/02/2024', '', 'ontem', '2024-13-01']
+    resultado = conferir(quadro(*[valida(data=data) for data in datas]))
+    assert [data for data, _ in resultado[:9]] == ['2024-05-01', '2024-05-01', '2024-05-02', '2024-05-03',
+                                                   '2024-05-04', '2024-05-05', resultado[6][0], '2024-05-07', '2024-05-08']
+    # Mês 13 não existe: o parser genérico inverte dia e mês, como o loop antigo fazia
+    assert resultado[9:] == [('31/02/2024', ["Data '31/02/2024' inválida."]), ('', ["Data '' inválida."]),
+                             ('ontem', ["Data 'ontem' inválida."]), ('2024-01-13', [])]
+
+def test_datas_de_planilha():
+    df = quadro(valida(), valida(), valida())
+    df['data'] = pd.to_datetime(['2024-05-01', '2024-05-02 10:30', None], format='ISO8601')
+    assert conferir(df) == [('2024-05-01', []), ('2024-05-02', []), ('NaT', ["Data 'NaT' inválida."])]
+
+def test_nomes_desconhecidos():
+    resultado = conferir(quadro(
+        valida(categoria='Mercadinho'), valida(conta=' Banco C '), valida(cartao='Amex'), valida(cartao='Visa'),
+        valida(categoria='mercado', conta='banco a', cartao='visa'), valida(status='efetivado'), valida(status='Pago'),
+        valida(compartilhado='100% silvia'), valida(categoria=np.nan, conta=np.nan)))
+    assert [erros for _, erros in resultado] == [
+        ["Categoria 'Mercadinho' ?"], ["Conta 'Banco C' ?"], ["Cartão 'Amex' ?"], [],
+        ["Categoria 'mercado' ?", "Conta 'banco a' ?", "Cartão 'visa' ?"], [], ["Status 'Pago' ?"],
+        ["Compartilhado '100% silvia' ?"], ["Categoria 'nan' ?", "Conta 'nan' ?"]]
+
+def test_valores_nao_numericos():
+    valores = ['12,50', '-3.000', '1e3', ' 7 ', 'abc', 'R$ 10,00', '1.234,56', '', np.nan, 'nan', 'inf', '1_000', 42, -0.5]
+    resultado = conferir(quadro(*[valida(valor=valor) for valor in valores]))
+    assert [erros for _, erros in resultado] == [
+        [], [], [], [], ["Valor 'abc' ?"], ["Valor 'R$ 10.00' ?"], ["Valor '1.234.56' ?"], ["Valor '' ?"], [], [], [], [], [], []]
+
+def test_so_linhas_com_erro_ganham_mensagens():
+    df = quadro(*[valida() for _ in range(5000)])
+    df.loc[[10, 2000, 4999], 'categoria'] = 'Outra'
+    df.loc[2000, 'valor'] = 'x'
+    linhas, com_erro = validar_linhas_importacao(df, CATEGORIAS, INSTITUICOES, CARTOES)
+    assert com_erro == 3
+    assert {linha[0]: linha[-1] for linha in linhas if linha[-1] is not None} == {
+        11: "Categoria 'Outra' ?", 2001: "Categoria 'Outra' ?\nValor 'x' ?", 4999 + 1: "Categoria 'Outra' ?"}
+    # Linhas válidas já saem com os ids resolvidos, prontas para o staging
+    assert linhas[0] == (1, '2024-05-01', 'Compra', 1, 'Mercado', 1, 'Banco A', None, '', '12.50', 'Efetivado', '50/50', None)
+
+@pytest.mark.parametrize('semente', [1, 2, 3])
+def test_arquivo_aleatorio_igual_a_linha_a_linha(semente):
+    rng = np.random.default_rng(semente)
+    def sorteio(opcoes, n=400):
+        return rng.choice(np.array(opcoes, dtype=object), n)
+    df = pd.DataFrame({
+        'data': sorteio(['2024-01-31', '31/01/2024', '31-01-2024', '31/01/24', '31.01.2024', '2024-01-31 08:00:00',
+                         '2024/01/31', '32/01/2024', 'x', np.nan]),
+        'descricao': sorteio(['A', ' B ', np.nan]),
+        'categoria': sorteio([*CATEGORIAS, 'Lazer', ' Mercado', np.nan]),
+        'conta': sorteio([*INSTITUICOES, 'Banco Z', np.nan]),
+        'cartao': sorteio([*CARTOES, 'Elo', '', np.nan, np.nan]),
+        'valor': sorteio(['10', '10,5', '-7.25', 'dez', '', 'nan', np.nan, 3.5]),
+        'status': sorteio(['Efetivado', 'pendente', 'PENDENTE', 'Cancelado', np.nan]),
+        'compartilhado': sorteio(['50/50', '100% Silvia', '100% Nelson', '100%', np.nan]),
+    })
+    conferir(df)
@@ -0,0 +1,21 @@
+"""
+Ponto de entrada WSGI para produção.
+
+    gunicorn --workers 4 --threads 4 --preload wsgi:app
+
+--preload roda create_app() (e as migrações) uma vez no processo mestre, antes do fork. Sem ele,
+cada worker roda create_app() ao subir, e as migrações pendentes são aplicadas por um só deles.
+Cada worker abre as próprias conexões SQLite no primeiro request (pool de DB_POOL_TAMANHO conexões
+por processo, compartilhado pelas threads). Configuração por variáveis de ambiente FINANCAS_*,
+por exemplo FINANCAS_DATABASE=/srv/financas/financas.db e FINANCAS_SECRET_KEY=...
+
+Teste de carga local (páginas de leitura; escala com o número de workers até o número de núcleos):
+
+    gunicorn --workers N --threads 4 --preload --bind 127.0.0.1:8000 wsgi:app
+    ab -n 2000 -c 16 http://127.0.0.1:8000/movimentos
+
+Desenvolvimento: python app.py (servidor do Flask com reloader) ou flask --app "app:create_app()" run.
+"""
+from app import create_app
+
+app = create_app()